@@ -1,21 +1,22 @@
 import streamlit as st
-import osmnx as ox
-import networkx as nx
+import streamlit.components.v1 as components
 import folium
-from folium.plugins import MarkerCluster, HeatMap
-from streamlit_folium import folium_static
-from shapely.geometry import Point
+from folium.plugins import HeatMap
 import traceback
-import pandas as pd
-from functools import lru_cache
-import glob
-import sqlite3
-import bcrypt
-from datetime import datetime
-import uuid
-from shapely.geometry import LineString
-from pathlib import Path
-from utils import geocode_cached, detect_polarity
+import threading
+import time
+import logging
+from routing_engine import RoutingEngine, GeocodeError, SearchCancelled
+from isochrone import compute_isochrone, isochrone_geojson
+from overlay import danger_overlay_geojson, overlay_style
+from map_layers import add_poi_layers, add_report_layer
+from memory import format_size
+import auth_db
+from polarity import reclassify_reports
+from parallel_costs import CostPool
+from report_signal import ReportSignal
+import metrics
+from metrics import span
 
 
 
@@ -41,415 +42,25 @@ st.markdown(
 from sidebar import render_sidebar
 render_sidebar()
 
+# 段階ごとの計測を構造化ログ（nightwalk.metrics）に出す
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+show_debug = st.sidebar.checkbox("🔧 計測パネルを表示", key="show_debug")
 
 
-def safe_graph_from_place(place):
-    import osmnx as ox
-    try:
-        # 通常の place → polygon 取得
-        return ox.graph_from_place(place, network_type="walk")
-    except Exception:
-        try:
-            # geocode → bbox 取得
-            geocode = ox.geocode_to_gdf(place)
-            bounds = geocode.total_bounds  # [west, south, east, north]
-            west, south, east, north = bounds
-
-            # ★ OSRMnx v1.1〜1.2 は位置引数の graph_from_bbox を使用する必要がある
-            return ox.graph_from_bbox(north, south, east, west, network_type="walk")
-
-        except Exception as e:
-            raise RuntimeError(f"フォールバック bbox も失敗: {e}")
-        
-# pyproj を使って緯度経度 -> 投影座標に変換する
-try:
-    from pyproj import Transformer, CRS
-except Exception:
-    Transformer = None
-
 # -----------------------
 # --- データベース設定 ---
 # -----------------------
-DB_PATH = "users.db"
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
-def get_connection():
-    # check_same_thread=False にしておくと Streamlit のマルチスレッドで便利
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
-
-def init_db():
-    conn = get_connection()
-    cur = conn.cursor()
-    # ユーザーテーブル
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE,
-        email TEXT UNIQUE,
-        password_hash BLOB
-    )
-    """)
-    # 投稿（掲示板）テーブル
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS reports (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        username TEXT,
-        text TEXT,
-        address TEXT,
-        lat REAL,
-        lon REAL,
-        post_type TEXT,
-        tags TEXT,
-        image_path TEXT,
-        polarity TEXT,
-        created_at TEXT,
-        FOREIGN KEY(user_id) REFERENCES users(id)
-    )
-    """)
-    # Ensure additional columns exist for older DBs
-    cur.execute("PRAGMA table_info(reports)")
-    cols = [r[1] for r in cur.fetchall()]
-    # Add missing columns if necessary
-    extra_cols = {
-        'post_type': 'TEXT',
-        'tags': 'TEXT',
-        'image_path': 'TEXT',
-        'polarity': 'TEXT'
-    }
-    for col, coltype in extra_cols.items():
-        if col not in cols:
-            try:
-                cur.execute(f"ALTER TABLE reports ADD COLUMN {col} {coltype}")
-            except Exception:
-                pass
-    conn.commit()
-    conn.close()
-
-init_db()
-
-# -----------------------
-# --- ユーザ認証関数 ---
-# -----------------------
-def signup(username, email, password):
-    conn = get_connection()
-    cur = conn.cursor()
-    password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
-    try:
-        cur.execute(
-            "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
-            (username, email, password_hash)
-        )
-        conn.commit()
-        return True, None
-    except sqlite3.IntegrityError as e:
-        # 一意制約違反（重複）
-        if "username" in str(e).lower():
-            return False, "そのユーザー名は既に使われています。"
-        if "email" in str(e).lower():
-            return False, "そのメールアドレスは既に使われています。"
-        return False, "登録に失敗しました（重複等）。"
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
-
-def login(email_or_username, password):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, username, email, password_hash FROM users WHERE email = ? OR username = ?",
-        (email_or_username, email_or_username)
-    )
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        return None
-    user_id, username, email, password_hash = row
-    # password_hash は bytes で保存されている
-    if isinstance(password_hash, str):
-        password_hash = password_hash.encode("utf-8")
-    try:
-        if bcrypt.checkpw(password.encode("utf-8"), password_hash):
-            return {"id": user_id, "username": username, "email": email}
-        else:
-            return None
-    except Exception:
-        return None
-
-# -----------------------
-# --- 掲示板DB操作 ---
-# -----------------------
-def save_report(user, text, address, lat, lon, post_type=None, tags=None, image_path=None, polarity=None):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO reports (user_id, username, text, address, lat, lon, post_type, tags, image_path, polarity, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (
-            user["id"] if user else None,
-            user["username"] if user else None,
-            text,
-            address,
-            lat,
-            lon,
-            post_type,
-            tags,
-            image_path,
-            polarity,
-            datetime.utcnow().isoformat(),
-        ),
-    )
-    rid = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return rid
-
-def load_reports():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, user_id, username, text, address, lat, lon, post_type, tags, image_path, polarity, created_at FROM reports ORDER BY created_at DESC")
-    rows = cur.fetchall()
-    conn.close()
-    reports = []
-    for r in rows:
-        reports.append({
-            "id": r[0],
-            "user_id": r[1],
-            "username": r[2],
-            "text": r[3],
-            "address": r[4],
-            "lat": r[5],
-            "lon": r[6],
-            "post_type": r[7],
-            "tags": r[8],
-            "image_path": r[9],
-            "polarity": r[10],
-            "created_at": r[11],
-        })
-    return reports
-
-
-def update_report_with_meta(report_id, post_type=None, tags=None, image_path=None, polarity=None):
-    conn = get_connection()
-    cur = conn.cursor()
-    updates = []
-    params = []
-    if post_type is not None:
-        updates.append("post_type = ?")
-        params.append(post_type)
-    if tags is not None:
-        updates.append("tags = ?")
-        params.append(tags)
-    if image_path is not None:
-        updates.append("image_path = ?")
-        params.append(image_path)
-    if polarity is not None:
-        updates.append("polarity = ?")
-        params.append(polarity)
-    if not updates:
-        conn.close()
-        return
-    params.append(report_id)
-    sql = f"UPDATE reports SET {', '.join(updates)} WHERE id = ?"
-    cur.execute(sql, params)
-    conn.commit()
-    conn.close()
-
-
-def detect_polarity(text, tags_text=None):
-    # 簡易ルールベース判定: ポジティブ語/ネガティブ語のカウントで判定
-    positive = ["安全", "明る", "広い", "問題ない", "安心", "見通し良"]
-    negative = ["暗", "怖", "危", "怪しい", "人通り少", "危険", "狭い"]
-    score = 0
-    txt = (text or "").lower()
-    for w in positive:
-        if w in txt:
-            score += 1
-    for w in negative:
-        if w in txt:
-            score -= 1
-    if tags_text:
-        for t in (tags_text or "").split(','):
-            tt = t.strip()
-            if not tt:
-                continue
-            for w in positive:
-                if w in tt:
-                    score += 1
-            for w in negative:
-                if w in tt:
-                    score -= 1
-    return "良い方向" if score >= 0 else "悪い方向"
-
-# -----------------------
-# --- ジオコーディング & CSV読み込み ---
-# -----------------------
-from pathlib import Path
-import pandas as pd
-import streamlit as st
-
-@st.cache_data(show_spinner=False)
-def load_crime_data():
-    base = Path(__file__).parent
-    csv_path = base / "data" / "crime_geocoded.csv"
-
-    st.write("CSV path:", csv_path)
-    st.write("Exists:", csv_path.exists())
-
-    if not csv_path.exists():
-        return []
-
-    df = pd.read_csv(csv_path)
-    st.write("CSV rows:", len(df))
-    st.write(df.head())
-
-    return list(zip(df["lat"], df["lon"]))
-
-
-
-
-# @st.cache_data(show_spinner=False)
-#     base = Path(__file__).parent
-#     csv_path = base / "data" / "crime_geocoded.csv"
-
-#     if not csv_path.exists():
-#         return []
-
-#     df = pd.read_csv(csv_path)
-#     return list(zip(df["lat"], df["lon"]))
-
-
-# -----------------------
-# --- OSM 街灯取得 ---
-# -----------------------
-import requests
-
-OVERPASS_URLS = [
-    "https://overpass.kumi.systems/api/interpreter",
-    "https://lz4.overpass-api.de/api/interpreter",
-    "https://overpass.openstreetmap.ru/api/interpreter"
-]
-
-def load_street_lamps_bbox(place):
-    try:
-        south, west, north, east = place
-
-
-        query = f"""
-        [out:json][timeout:120];
-        (
-          node["highway"="street_lamp"]({south},{west},{north},{east});
-          node["man_made"="street_lamp"]({south},{west},{north},{east});
-          node["amenity"="street_lamp"]({south},{west},{north},{east});
-        );
-        out body;
-        """
-
-        last_error = None
-
-        for url in OVERPASS_URLS:
-            try:
-                r = requests.post(url, data=query, timeout=180)
-                if r.status_code == 200:
-                    data = r.json()
-                    lamps = []
-                    for el in data.get("elements", []):
-                        if "lat" in el and "lon" in el:
-                            lamps.append((el["lat"], el["lon"], el.get("tags", {})))
-                    return lamps
-                else:
-                    last_error = f"{url} → HTTP {r.status_code}"
-            except Exception as e:
-                last_error = f"{url} → {e}"
-
-        raise RuntimeError(last_error)
-
-    except Exception as e:
-        raise RuntimeError(f"Overpass API 取得失敗: {e}")
+# テーブル作成と接続（スレッドごとの接続・WAL・書き込みキュー）は auth_db.py にまとめている
+auth_db.init_db()
 
 
-# -----------------------
-# --- OSM コンビニ取得 ---
-# -----------------------
-def load_convenience_stores_bbox(place):
-    try:
-        south, west, north, east = place
-
-        query = f"""
-        [out:json][timeout:120];
-        (
-          node["shop"="convenience"]({south},{west},{north},{east});
-          way["shop"="convenience"]({south},{west},{north},{east});
-        );
-        out center;
-        """
-
-        last_error = None
-
-        for url in OVERPASS_URLS:
-            try:
-                r = requests.post(url, data=query, timeout=180)
-                if r.status_code == 200:
-                    data = r.json()
-                    stores = []
-                    for el in data.get("elements", []):
-                        lat = el.get("lat") or el.get("center", {}).get("lat")
-                        lon = el.get("lon") or el.get("center", {}).get("lon")
-                        if lat and lon:
-                            stores.append((lat, lon, el.get("tags", {})))
-                    return stores
-                else:
-                    last_error = f"{url} → HTTP {r.status_code}"
-            except Exception as e:
-                last_error = f"{url} → {e}"
-
-        raise RuntimeError(last_error)
-
-    except Exception as e:
-        raise RuntimeError(f"Overpass API 取得失敗: {e}")
-    
-# -----------------------
-# --- OSM 交番取得 ---
-# -----------------------
-def load_koban_bbox(place):
-    try:
-        south, west, north, east = place
-
-        query = f"""
-        [out:json][timeout:120];
-        (
-          node["amenity"="police"]({south},{west},{north},{east});
-          way["amenity"="police"]({south},{west},{north},{east});
-          node["police"]({south},{west},{north},{east});
-          way["police"]({south},{west},{north},{east});
-        );
-        out center;
-        """
-
-        last_error = None
-        for url in OVERPASS_URLS:
-            try:
-                r = requests.post(url, data=query, timeout=180)
-                if r.status_code == 200:
-                    data = r.json()
-                    kobans = []
-                    for el in data.get("elements", []):
-                        lat = el.get("lat") or el.get("center", {}).get("lat")
-                        lon = el.get("lon") or el.get("center", {}).get("lon")
-                        if lat and lon:
-                            kobans.append((lat, lon, el.get("tags", {})))
-                    return kobans
-                else:
-                    last_error = f"{url} → HTTP {r.status_code}"
-            except Exception as e:
-                last_error = f"{url} → {e}"
-
-        raise RuntimeError(last_error)
-    except Exception as e:
-        raise RuntimeError(f"Overpass API 取得失敗: {e}")
+@st.cache_resource(show_spinner=False)
+def sync_polarity():
+    # 判定の語彙（data/polarity_lexicon.json）が変わっていれば、既存の投稿を付け直す
+    return reclassify_reports()
 
 
+sync_polarity()
 
 
 # -----------------------
@@ -468,289 +79,235 @@ route_mode = st.radio("検索モード", ("最短ルート", "安全ルート"),
 
 origin = st.text_input("出発地", "大宮駅, 埼玉")
 destination = st.text_input("目的地", "さいたま新都心駅, 埼玉")
-place = st.text_input("検索エリア", "さいたま市, 埼玉, Japan")
+auto_area = st.checkbox("検索エリアを自動で決める（市境をまたぐルート向け）", value=False)
+# 自動のときは出発地・目的地の周辺だけをタイル単位で読み込む（place = None）
+place = None if auto_area else st.text_input("検索エリア", "さいたま市, 埼玉, Japan")
 zoom = st.slider("地図のズーム", 13, 18, 15)
+show_overlay = st.checkbox("道路ごとの危険度を表示", value=True)
 
 
 
-# --- 地図とルート検索 ---
-if st.button("ルートを検索"):
-    if Transformer is None:
-        st.error("pyproj が必要です。 `pip install pyproj` を実行してください。")
-        st.stop()
-
-    if not all([origin, destination, place]):
-        st.warning("出発地、目的地、エリアをすべて入力してください。")
-        st.stop()
-
-    try:
-        # --- データ準備 ---
-        st.info("OSM グラフと犯罪データを準備しています...")
-
-        # 安全版 graph_from_place
-        G = safe_graph_from_place(place)
-
-        crime_locations = load_crime_data()
-
-
-        # --- 座標変換 ---
-        try:
-            orig_latlon = geocode_cached(origin)
-            dest_latlon = geocode_cached(destination)
-        except Exception as e:
-            st.error(f"住所変換エラー: {e}")
-            st.stop()
-
-        G_proj = ox.project_graph(G)
-        crs_proj = G_proj.graph.get("crs", "EPSG:3857")
-        target_crs = CRS.from_user_input(crs_proj)
-        transformer = Transformer.from_crs("EPSG:4326", target_crs, always_xy=True)
-
-        orig_x, orig_y = transformer.transform(orig_latlon[1], orig_latlon[0])
-        dest_x, dest_y = transformer.transform(dest_latlon[1], dest_latlon[0])
-
-        orig_node = ox.distance.nearest_nodes(G_proj, orig_x, orig_y)
-        dest_node = ox.distance.nearest_nodes(G_proj, dest_x, dest_y)
-
-        # --- ルート計算 ---
-        st.info("ルートを計算しています...")
-
-        weight = "length"
-        route = nx.shortest_path(G_proj, orig_node, dest_node, weight=weight)
-
-        # --- ルートのbbox（±300mの余白つき） ---
-        xs = []
-        ys = []
-        for node in route:
-            xs.append(G_proj.nodes[node]["x"])
-            ys.append(G_proj.nodes[node]["y"])
-
-        minx, maxx = min(xs), max(xs)
-        miny, maxy = min(ys), max(ys)
-
-        # 300m のバッファ
-        buffer = 300
-        minx -= buffer
-        maxx += buffer
-        miny -= buffer
-        maxy += buffer
-
-        # 緯度経度に戻す
-        inv = Transformer.from_crs(G_proj.graph["crs"], "EPSG:4326", always_xy=True)
-        west, south = inv.transform(minx, miny)
-        east, north = inv.transform(maxx, maxy)
-
-        bbox = (south, west, north, east)
-
-        # --- 街灯とコンビニをルート周辺だけ取得 ---
-        try:
-            street_lamps = load_street_lamps_bbox(bbox)
-        except Exception as e:
-            st.warning(f"街灯取得失敗: {e}")
-            street_lamps = []
-
-        try:
-            convenience_stores = load_convenience_stores_bbox(bbox)
-        except Exception as e:
-            st.warning(f"コンビニ取得失敗: {e}")
-            convenience_stores = []
-
-        try:
-            kobans = load_koban_bbox(bbox)
-        except Exception as e:
-            st.warning(f"交番取得失敗: {e}")
-            kobans = []
-
-
-
-        # --- 安全コスト計算 ---
-        from scipy.spatial import cKDTree
-        import numpy as np
-
-        crime_points_proj = []
-        for lat, lon in crime_locations:
-            crime_points_proj.append(transformer.transform(lon, lat))
-
-        lamp_points = []
-        store_points = []
-        koban_points = []
-
-        for lat, lon, _ in street_lamps:
-            lamp_points.append(transformer.transform(lon, lat))
-
-        for lat, lon, _ in convenience_stores:
-            store_points.append(transformer.transform(lon, lat))
-
-        for lat, lon, _ in kobans:
-            koban_points.append(transformer.transform(lon, lat))
-
-        crime_tree = cKDTree(crime_points_proj) if crime_points_proj else None
-        lamp_tree  = cKDTree(lamp_points)  if lamp_points else None
-        store_tree = cKDTree(store_points) if store_points else None
-        koban_tree = cKDTree(koban_points) if koban_points else None
-
-
-        for u, v, data in G_proj.edges(data=True):
-            mid_x = (G_proj.nodes[u]['x'] + G_proj.nodes[v]['x']) / 2
-            mid_y = (G_proj.nodes[u]['y'] + G_proj.nodes[v]['y']) / 2
-
-            crime_penalty = 0
-            if crime_tree:
-                dist, _ = crime_tree.query([mid_x, mid_y])
-                crime_penalty = max(0, 200 - dist) * 5
-
-            lamp_bonus = 0
-            if lamp_tree:
-                d, _ = lamp_tree.query([mid_x, mid_y])
-                lamp_bonus = max(0, 80 - d) * 1.5
-
-            store_bonus = 0
-            if store_tree:
-                d, _ = store_tree.query([mid_x, mid_y])
-                store_bonus = max(0, 150 - d) * 4
-
-            koban_bonus = 0
-            if koban_tree:
-                d, _ = koban_tree.query([mid_x, mid_y])
-                koban_bonus = max(0, 300 - d) * 8
+# -----------------------
+# --- ルート検索エンジン ---
+# -----------------------
+# グラフ・犯罪インデックス・POI はセッションをまたいで共有する
+@st.cache_resource(show_spinner=False)
+def get_engine():
+    # NIGHTWALK_COST_WORKERS を指定すると、大きなエリアのコスト計算をワーカープロセスに分ける
+    # 掲示板の投稿も安全コストに反映する（新しい投稿は周りのエッジだけを差分で更新）
+    engine = RoutingEngine(cost_pool=CostPool(), report_signal=ReportSignal())
+    # data/ の犯罪データ CSV の追加・更新を定期的に確認し、検索を止めずに差し替える
+    engine.start_watcher(interval=600, preprocess=True)
+    return engine
+
+
+def build_route_map(engine, req, route, route_color, zoom, pois=None, costs=None):
+    m = folium.Map(location=req["origin"], zoom_start=zoom)
+
+    # 犯罪点はサーバー側でズーム別グリッドに集計済みのセルだけを送る
+    crime_cells = engine.crime_heatmap.cells(zoom, req["bbox"])
+    if crime_cells:
+        HeatMap(
+            crime_cells,
+            radius=25,
+            blur=18,
+            min_opacity=0.4,
+            control=False
+        ).add_to(m)
+
+    # 表示範囲（ルート周辺の bbox）内の道路だけを危険度で色分け
+    if costs is not None and show_overlay:
+        folium.GeoJson(
+            danger_overlay_geojson(req["area"], costs, req["bbox"]),
+            name="道路の危険度",
+            style_function=overlay_style,
+            tooltip=folium.GeoJsonTooltip(fields=["label"], aliases=["危険度"]),
+        ).add_to(m)
+
+    folium.PolyLine(route["latlon"], color=route_color, weight=5, opacity=0.85).add_to(m)
+    folium.Marker(location=req["origin"], popup="出発地", icon=folium.Icon(color="green")).add_to(m)
+    folium.Marker(location=req["destination"], popup="目的地", icon=folium.Icon(color="red")).add_to(m)
+
+    # --- 街灯・コンビニ・交番（ブラウザ側で描画） ---
+    if pois:
+        add_poi_layers(m, pois)
+
+    # --- 掲示板の投稿（表示範囲内のみ） ---
+    add_report_layer(m, req["bbox"], zoom)
+
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m
+
+
+def show_map(m, width=1000, height=700):
+    # folium_static と同じ描画だが、HTML のサイズと生成時間を計測する
+    with span("render.map") as sp:
+        html = folium.Figure().add_child(m).render()
+        sp.set(payload_bytes=len(html.encode("utf-8")))
+        components.html(html, height=height + 10, width=width)
+
+
+def render_debug_panel():
+    with st.expander("🔧 計測（直近の検索）", expanded=True):
+        trace = metrics.last_trace()
+        if trace:
+            st.json(trace)
+        snap = metrics.snapshot()
+        if snap["stages"]:
+            st.dataframe([{"stage": k, **v} for k, v in snap["stages"].items()])
+        if snap["counters"]:
+            st.json(snap["counters"])
+    with st.expander("🧠 メモリ（常駐データ）"):
+        report = get_engine().memory_report()
+        budget = format_size(report["budget"]) if report["budget"] else "無制限"
+        st.caption(f"合計 {format_size(report['total'])} / 予算 {budget} / データ版 {report['data_version']}")
+        st.dataframe([
+            {"area": place, **{k: format_size(v) for k, v in usage.items()}}
+            for place, usage in report["areas"].items()
+        ])
+        st.json({
+            "area_costs": {k: format_size(v) for k, v in report["area_costs"].items()},
+            "pois": {"entries": report["pois"]["entries"], "size": format_size(report["pois"]["bytes"])},
+            "crime_heatmap": format_size(report["crime_heatmap"]),
+            "reports": format_size(report["reports"]),
+        })
 
-            poi_bonus = lamp_bonus + store_bonus + koban_bonus
 
+def cancel_search_job():
+    job = st.session_state.get("search_job")
+    if job:
+        job["cancel"].set()
+        job["future"].cancel()
+        st.session_state["search_job"] = None
 
-            base = data.get("length", 1)
-            data["safety_cost"] = max(1, base + crime_penalty - poi_bonus)
 
-        # ← ループの外で1回だけ実行
-        route = nx.shortest_path(G_proj, orig_node, dest_node, weight="safety_cost")
-        route_color = "red"
+# 入力が変わったら、バックグラウンドで進んでいる前回の検索を止める
+search_key = (origin, destination, place, route_mode)
+if st.session_state.get("search_job") and st.session_state["search_job"]["key"] != search_key:
+    cancel_search_job()
 
-        # --- ルートの安全スコアを計算 ---
-        total_length = 0
-        total_safety_cost = 0
 
-        for u, v in zip(route[:-1], route[1:]):
-            if G_proj.is_multigraph():
-                edge_data = G_proj.get_edge_data(u, v)[0]
-            else:
-                edge_data = G_proj.edges[u, v]
+def run_route_search(status, metric_slot, map_slot):
+    status.info("OSM グラフを準備しています...")
+    engine = get_engine()
+    mode = "shortest" if route_mode == "最短ルート" else "safety"
+    try:
+        req = engine.plan(origin, destination, place)
+    except GeocodeError as e:
+        st.error(str(e))
+        st.stop()
 
-            length = edge_data.get("length", 0)
-            safety = edge_data.get("safety_cost", length)
+    # --- 1段目: 最短ルート + 犯罪ヒートマップ ---
+    engine.shortest_route(req)
+    cancel = threading.Event()
+    future = engine.start_pois(req, cancel)
+    st.session_state["search_job"] = {"key": search_key, "cancel": cancel, "future": future}
+
+    shortest = engine.describe_route(req, "shortest", zoom)
+    with map_slot.container():
+        show_map(build_route_map(engine, req, shortest, "blue", zoom))
+
+    # --- 2段目: 街灯・コンビニ・交番 → 安全ルート・危険度 ---
+    started = time.monotonic()
+    while not future.done():
+        status.info(
+            f"最短ルートを表示しています。街灯・コンビニ・交番を取得中...（{time.monotonic() - started:.0f} 秒）"
+        )
+        time.sleep(0.5)
+    try:
+        future.result()
+    except SearchCancelled:
+        status.info("検索は中止されました")
+        st.stop()
+    st.session_state["search_job"] = None
 
-            total_length += length
-            total_safety_cost += safety
+    for w in req["warnings"]:
+        st.warning(w)
 
-        # 危険度（小さいほど安全）
-        if total_length > 0:
-            danger_score = total_safety_cost / total_length
-        else:
-            danger_score = float("inf")
+    status.info("安全ルートを計算しています...")
+    engine.safety_route(req)
+    result = engine.result(req, mode, zoom)
+    route = result["route"]
+    route_color = "red" if mode == "safety" else "blue"
+    danger_score = route["danger_score"]
 
+    with map_slot.container():
+        show_map(build_route_map(engine, req, route, route_color, zoom, pois=result["pois"], costs=result["safety_cost"]))
 
+    with metric_slot.container():
+        st.metric("🛡 このルートの危険度", f"{danger_score:.2f}")
+        st.caption("※ 数値が小さいほど安全（街灯・コンビニ・交番が多く、犯罪が少ない）")
+    status.success("ルート検索完了")
 
-        # --- 地図描画 ---
-        st.info("地図描画中...")
-        route_latlon = [(G.nodes[n]["y"], G.nodes[n]["x"]) for n in route]
 
-        m = folium.Map(location=orig_latlon, zoom_start=zoom)
+# --- 地図とルート検索 ---
+if st.button("ルートを検索"):
+    if not all([origin, destination, place or auto_area]):
+        st.warning("出発地、目的地、エリアをすべて入力してください。")
+        st.stop()
 
-        if crime_locations:
-            HeatMap(
-                crime_locations,
-                radius=25,
-                blur=18,
-                min_opacity=0.4,
-                control=False
-            ).add_to(m)
+    cancel_search_job()
+    status = st.empty()
+    metric_slot = st.empty()
+    map_slot = st.empty()
 
+    try:
+        with span("search", place=place, mode=route_mode):
+            run_route_search(status, metric_slot, map_slot)
+    except Exception:
+        st.error("エラーが発生しました")
 
-        folium.PolyLine(route_latlon, color=route_color, weight=5, opacity=0.85).add_to(m)
-        folium.Marker(location=orig_latlon, popup="出発地", icon=folium.Icon(color="green")).add_to(m)
-        folium.Marker(location=dest_latlon, popup="目的地", icon=folium.Icon(color="red")).add_to(m)
+        st.text(traceback.format_exc())
 
-        st.success("ルート検索完了")
-        st.metric("🛡 このルートの危険度", f"{danger_score:.2f}")
-        st.caption("※ 数値が小さいほど安全（街灯・コンビニ・交番が多く、犯罪が少ない）")
+    if show_debug:
+        render_debug_panel()
 
 
+# -----------------------
+# --- 安全到達圏 ---
+# -----------------------
+st.divider()
+st.subheader("🟢 安全に歩ける範囲（到達圏）")
+st.caption("出発地から、安全コスト（暗い道・犯罪の多い道ほど大きい）の予算内で歩ける道を色分けします。")
+iso_budgets = st.multiselect(
+    "安全コストの予算（m 相当）",
+    [500, 1000, 1500, 2000, 3000],
+    default=[500, 1000, 2000],
+)
 
-        # --- 街灯をマップへ描画（クラスタリング） ---
-        if street_lamps:
-            try:
-                cluster = MarkerCluster(name="street_lamps")
-                for lat, lon, info in street_lamps:
-                    popup_text = ""
-                    if info:
-                        popup_text = ", ".join([f"{k}: {v}" for k, v in info.items()])
-                    # Use small circle marker inside cluster for performance + visibility
-                    marker = folium.CircleMarker(
-                        location=[lat, lon],
-                        radius=2,
-                        color="yellow",
-                        fill=True,
-                        fill_opacity=0.9,
-                        popup=popup_text or "街灯"
-                    )
-                    cluster.add_child(marker)
-                m.add_child(cluster)
-            except Exception:
-                # フォールバック: 個別に描画（重い場合あり）
-                for lat, lon, info in street_lamps:
-                    try:
-                        folium.CircleMarker(
-                            location=[lat, lon],
-                            radius=2,
-                            color="yellow",
-                            fill=True,
-                            fill_opacity=0.9,
-                            popup=", ".join([f"{k}: {v}" for k, v in info.items()]) if info else "街灯"
-                        ).add_to(m)
-                    except Exception:
-                        continue
-
-        if convenience_stores:
-            store_cluster = MarkerCluster(name="convenience_stores")
-
-            for lat, lon, tags in convenience_stores:
-                name = tags.get("name", "コンビニ")
-                brand = tags.get("brand", "")
-                popup = f"{name} {brand}".strip()
-
-                folium.Marker(
-                    location=[lat, lon],
-                    popup=popup,
-                    icon=folium.Icon(
-                        color="blue",
-                        icon="shopping-cart",
-                        prefix="fa"
-                    )
-                ).add_to(store_cluster)
-
-            m.add_child(store_cluster)
-
-            if kobans:
-                koban_cluster = MarkerCluster(name="kobans")
-            for lat, lon, tags in kobans:
-                name = tags.get("name", "交番")
-                folium.Marker(
-                    location=[lat, lon],
-                    popup=name,
-                    icon=folium.Icon(color="darkblue", icon="shield", prefix="fa")
-                ).add_to(koban_cluster)
-            m.add_child(koban_cluster)
+if st.button("到達圏を表示"):
+    if not all([origin, place or auto_area]) or not iso_budgets:
+        st.warning("出発地、エリア、予算を入力してください。")
+        st.stop()
 
+    try:
+        st.info("到達圏を計算しています...")
+        try:
+            iso = compute_isochrone(get_engine(), origin, place, iso_budgets)
+        except GeocodeError as e:
+            st.error(str(e))
+            st.stop()
 
+        for w in iso["warnings"]:
+            st.warning(w)
+
+        m = folium.Map(location=iso["origin"], zoom_start=zoom)
+        folium.GeoJson(
+            isochrone_geojson(iso),
+            name="安全到達圏",
+            style_function=lambda f: {
+                "color": f["properties"]["color"],
+                "weight": 3,
+                "opacity": 0.85,
+            },
+            tooltip=folium.GeoJsonTooltip(fields=["budget"], aliases=["予算"]),
+        ).add_to(m)
+        folium.Marker(location=iso["origin"], popup="出発地", icon=folium.Icon(color="green")).add_to(m)
         folium.LayerControl(collapsed=False).add_to(m)
 
-        folium_static(m, width=1000, height=700)
+        show_map(m)
 
     except Exception:
         st.error("エラーが発生しました")
 
         st.text(traceback.format_exc())
-
-
-
-
-
-
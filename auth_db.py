@@ -1,27 +1,474 @@
 # auth_db.py
+#
+#   python auth_db.py reindex        # 全文検索インデックスを既存の投稿から作り直す
+#   python auth_db.py migrate-tags   # reports.tags（カンマ区切り）からタグ表と集計表を作り直す
+#   python auth_db.py restore-import # 一括取り込みが途中で落ちたとき、外したままの索引とトリガーを戻す
+#
+# 接続はスレッドごとに 1 本を開いたまま使い回す（文のコンパイル結果も接続ごとにキャッシュされる）。
+# WAL にしているので読み込みは書き込みを待たない。書き込みは専用スレッド 1 本に集め、
+# キューに溜まった分を 1 トランザクションでまとめてコミットする（"database is locked" を避ける）。
+# パスワードのハッシュ計算とログイン失敗の制限は passwords.py。
+import argparse
+import json
+import math
+import queue
+import re
 import sqlite3
-import bcrypt
-from datetime import datetime
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from datetime import datetime, timedelta
 from pathlib import Path
 
+import passwords
+
 DB_PATH = "users.db"
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+PRAGMAS = {
+    "journal_mode": "WAL",
+    # WAL では NORMAL でも壊れない（電源断で直近のコミットが失われることはある）
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # 16MB
+    "mmap_size": 256 * 2**20,
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+}
+# 1 回のコミットにまとめる書き込みの上限
+GROUP_COMMIT_MAX = 256
+# 掲示板の 1 ページの件数
+PAGE_SIZE = 20
+REPORT_COLUMNS = "id, user_id, username, text, address, lat, lon, post_type, tags, image_path, polarity, created_at"
+M_PER_DEG = 111_320.0
+# 全文検索の列の重み（text, address, tags）。タグの一致を本文より高く評価する
+SEARCH_WEIGHTS = (1.0, 0.5, 2.0)
+# trigram は 3 文字未満の語を索引で引けないので、短い語は LIKE で絞る
+TRIGRAM_MIN = 3
+# タグ集計の地図セル（約 500m 四方）
+TAG_CELL_DEG = 0.005
+# ルート検索の投稿レイヤー（report_signal.py）が読む列と、1 回に読む変更の上限
+SIGNAL_COLUMNS = "id, lat, lon, polarity, tags, created_at"
+CHANGES_MAX = 5000
+# report_changes に残す件数（これより遅れた読み手は全件から読み直す）
+CHANGES_KEEP = 100_000
+# 一括取り込み・書き出しで 1 回に扱う行数（取り込みは 1 トランザクション）
+BULK_BATCH = 5000
+REPORT_INSERT = (
+    "INSERT INTO reports (user_id, username, text, address, lat, lon, post_type, tags, image_path, polarity, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+# 一括取り込みの間だけ外す索引とトリガー（行ごとに更新するより、最後にまとめて作る方が速い）
+DEFERRED_INDEXES = ("idx_reports_created", "reports_rtree_ai", "reports_fts_ai", "report_changes_ai")
+# 住所から集計用の地域名（区、なければ市町村）を取り出す
+WARD_RE = re.compile(r"([^\s,、県市]+区)")
+CITY_RE = re.compile(r"([^\s,、県]+?[市町村])")
+
+_local = threading.local()
+_writers = {}
+_writers_lock = threading.Lock()
+# init_db 済みの DB_PATH
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, isolation_level=None, cached_statements=256)
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
 def get_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    # 読み込み用。DB_PATH ごと・スレッドごとに 1 本（close しないこと）
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(DB_PATH)
+    if conn is None:
+        conn = conns[DB_PATH] = _connect(DB_PATH)
+    return conn
 
-# ---------- ユーザー認証 ----------
-def signup(username, email, password):
+
+class _Writer:
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+        self.commits = 0
+        self.writes = 0
+        threading.Thread(target=self._run, name="auth_db-writer", daemon=True).start()
+
+    def submit(self, fn):
+        future = Future()
+        self.queue.put((fn, future))
+        return future.result()
+
+    def _run(self):
+        conn = _connect(self.path)
+        while True:
+            # コミット中に届いた書き込みは次のコミットにまとめる
+            batch = [self.queue.get()]
+            while len(batch) < GROUP_COMMIT_MAX:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(conn, batch)
+
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                # 1 件の失敗（UNIQUE 制約など）で同じコミットの他の書き込みを巻き戻さない
+                conn.execute("SAVEPOINT item")
+                try:
+                    results.append((future, fn(conn), None))
+                    conn.execute("RELEASE item")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO item")
+                    conn.execute("RELEASE item")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.commits += 1
+        self.writes += len(batch)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+def write(fn):
+    # fn(conn) を書き込みスレッドで実行し、その戻り値（または例外）を返す
+    with _writers_lock:
+        writer = _writers.get(DB_PATH)
+        if writer is None:
+            writer = _writers[DB_PATH] = _Writer(DB_PATH)
+    return writer.submit(fn)
+
+
+def writer_stats():
+    writer = _writers.get(DB_PATH)
+    return {"commits": writer.commits, "writes": writer.writes} if writer else {"commits": 0, "writes": 0}
+
+
+def init_db():
+    # Streamlit はページの再実行のたびに呼ぶので、テーブル作成はプロセス内で DB ごとに 1 回だけ
+    with _init_lock:
+        if DB_PATH in _initialized:
+            return
+        if _create_tables():
+            _initialized.add(DB_PATH)
+
+
+def _create_tables():
     conn = get_connection()
     cur = conn.cursor()
-    password_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-    try:
+    # ユーザーテーブル
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE,
+        email TEXT UNIQUE,
+        password_hash BLOB
+    )
+    """)
+    # 投稿（掲示板）テーブル
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        username TEXT,
+        text TEXT,
+        address TEXT,
+        lat REAL,
+        lon REAL,
+        post_type TEXT,
+        tags TEXT,
+        image_path TEXT,
+        polarity TEXT,
+        created_at TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+    # 判定の語彙のバージョンなど、DB ごとの設定値
+    cur.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+    # 古い DB には後から追加した列がないことがある
+    cur.execute("PRAGMA table_info(reports)")
+    cols = [r[1] for r in cur.fetchall()]
+    extra_cols = {
+        'post_type': 'TEXT',
+        'tags': 'TEXT',
+        'image_path': 'TEXT',
+        'polarity': 'TEXT'
+    }
+    for col, coltype in extra_cols.items():
+        if col not in cols:
+            try:
+                cur.execute(f"ALTER TABLE reports ADD COLUMN {col} {coltype}")
+            except Exception:
+                pass
+    if _import_state(cur) is not None:
+        # 一括取り込みの途中（import_reports が索引とトリガーを外している）。ここで作ると取り込み済みの分が
+        # 索引に入り、最後のまとめての反映と重なるので、取り込みが終わるまで作らない（次の呼び出しでまた見る）
+        return False
+    # 新しい順の一覧（キーセットページング）用
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reports_created ON reports (created_at, id)")
+    # 位置の空間インデックス（R*Tree）。reports への追加・更新・削除はトリガーで反映する
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'reports_rtree'")
+    rtree_created = cur.fetchone() is None
+    cur.executescript("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS reports_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+    CREATE TRIGGER IF NOT EXISTS reports_rtree_ai AFTER INSERT ON reports
+    WHEN new.lat IS NOT NULL AND new.lon IS NOT NULL BEGIN
+        INSERT INTO reports_rtree VALUES (new.id, new.lat, new.lat, new.lon, new.lon);
+    END;
+    CREATE TRIGGER IF NOT EXISTS reports_rtree_au AFTER UPDATE OF lat, lon ON reports BEGIN
+        DELETE FROM reports_rtree WHERE id = old.id;
+        INSERT INTO reports_rtree SELECT new.id, new.lat, new.lat, new.lon, new.lon
+        WHERE new.lat IS NOT NULL AND new.lon IS NOT NULL;
+    END;
+    CREATE TRIGGER IF NOT EXISTS reports_rtree_ad AFTER DELETE ON reports BEGIN
+        DELETE FROM reports_rtree WHERE id = old.id;
+    END;
+    """)
+    if rtree_created:
+        # 作る前に投稿された分
         cur.execute(
+            "INSERT INTO reports_rtree SELECT id, lat, lat, lon, lon FROM reports "
+            "WHERE lat IS NOT NULL AND lon IS NOT NULL"
+        )
+    # 投稿の追加・変更・削除の記録。ルート検索の投稿レイヤーは ここから差分だけを読む
+    cur.executescript("""
+    CREATE TABLE IF NOT EXISTS report_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, report_id INTEGER);
+    CREATE TRIGGER IF NOT EXISTS report_changes_ai AFTER INSERT ON reports BEGIN
+        INSERT INTO report_changes (report_id) VALUES (new.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS report_changes_au AFTER UPDATE OF lat, lon, polarity, tags, created_at ON reports BEGIN
+        INSERT INTO report_changes (report_id) VALUES (new.id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS report_changes_ad AFTER DELETE ON reports BEGIN
+        INSERT INTO report_changes (report_id) VALUES (old.id);
+    END;
+    """)
+    _init_search(cur)
+    _init_tags(cur)
+    return True
+
+
+def _init_tags(cur):
+    # reports.tags は表示と全文検索用にそのまま残し、集計はこちらの表を使う。
+    # tag_stats は (タグ, 地域, 日) ごと、tag_cells は (タグ, 地図セル, 日) ごとの件数で、投稿時に更新する
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'report_tags'")
+    created = cur.fetchone() is None
+    cur.executescript("""
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS report_tags (
+        report_id INTEGER NOT NULL,
+        tag_id INTEGER NOT NULL,
+        PRIMARY KEY (report_id, tag_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_report_tags_tag ON report_tags (tag_id, report_id);
+    CREATE TABLE IF NOT EXISTS tag_stats (
+        tag_id INTEGER NOT NULL,
+        area TEXT NOT NULL,
+        day TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (tag_id, area, day)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_tag_stats_area ON tag_stats (area, day);
+    CREATE TABLE IF NOT EXISTS tag_cells (
+        tag_id INTEGER NOT NULL,
+        cell_i INTEGER NOT NULL,
+        cell_j INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (tag_id, cell_i, cell_j, day)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_tag_cells_day ON tag_cells (day);
+    """)
+    if created:
+        migrate_tags()
+
+
+def split_tags(tags_text):
+    seen = []
+    for t in (tags_text or "").split(","):
+        t = t.strip()
+        if t and t not in seen:
+            seen.append(t)
+    return seen
+
+
+def report_area(address):
+    text = address or ""
+    m = WARD_RE.search(text) or CITY_RE.search(text)
+    return m.group(1) if m else ""
+
+
+def _tag_ids(conn, names):
+    conn.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(n,) for n in names])
+    marks = ", ".join("?" * len(names))
+    return [r[0] for r in conn.execute(f"SELECT id FROM tags WHERE name IN ({marks})", names)]
+
+
+def _count_tags(conn, tag_ids, address, lat, lon, created_at, sign):
+    # sign = +1 で追加、-1 で取り消し。集計行は 0 件になったら消す
+    area = report_area(address)
+    day = (created_at or "")[:10]
+    conn.executemany(
+        "INSERT INTO tag_stats (tag_id, area, day, n) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (tag_id, area, day) DO UPDATE SET n = n + excluded.n",
+        [(t, area, day, sign) for t in tag_ids],
+    )
+    if sign < 0:
+        # 減らした行だけを主キーで見る（表全体は走査しない）
+        conn.executemany(
+            "DELETE FROM tag_stats WHERE tag_id = ? AND area = ? AND day = ? AND n <= 0",
+            [(t, area, day) for t in tag_ids],
+        )
+    if lat is not None and lon is not None:
+        ci, cj = math.floor(lat / TAG_CELL_DEG), math.floor(lon / TAG_CELL_DEG)
+        conn.executemany(
+            "INSERT INTO tag_cells (tag_id, cell_i, cell_j, day, n) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (tag_id, cell_i, cell_j, day) DO UPDATE SET n = n + excluded.n",
+            [(t, ci, cj, day, sign) for t in tag_ids],
+        )
+        if sign < 0:
+            conn.executemany(
+                "DELETE FROM tag_cells WHERE tag_id = ? AND cell_i = ? AND cell_j = ? AND day = ? AND n <= 0",
+                [(t, ci, cj, day) for t in tag_ids],
+            )
+
+
+def _set_report_tags(conn, report_id, tags_text):
+    # 投稿のタグを tags_text に置き換え、集計を差分だけ更新する
+    row = conn.execute("SELECT address, lat, lon, created_at FROM reports WHERE id = ?", (report_id,)).fetchone()
+    if row is None:
+        return
+    old = [r[0] for r in conn.execute("SELECT tag_id FROM report_tags WHERE report_id = ?", (report_id,))]
+    names = split_tags(tags_text)
+    new = _tag_ids(conn, names) if names else []
+    removed = [t for t in old if t not in new]
+    added = [t for t in new if t not in old]
+    if removed:
+        conn.executemany("DELETE FROM report_tags WHERE report_id = ? AND tag_id = ?", [(report_id, t) for t in removed])
+        _count_tags(conn, removed, *row, sign=-1)
+    if added:
+        conn.executemany("INSERT INTO report_tags (report_id, tag_id) VALUES (?, ?)", [(report_id, t) for t in added])
+        _count_tags(conn, added, *row, sign=1)
+
+
+def _migrate_tags(conn):
+    # reports.tags から全部作り直す（件数の多い DB でも 1 トランザクション）
+    for table in ("report_tags", "tag_stats", "tag_cells"):
+        conn.execute(f"DELETE FROM {table}")
+    rows = conn.execute("SELECT id, tags FROM reports WHERE tags IS NOT NULL AND tags != ''").fetchall()
+    for report_id, tags_text in rows:
+        _set_report_tags(conn, report_id, tags_text)
+    return len(rows)
+
+
+def migrate_tags():
+    return write(_migrate_tags)
+
+
+def _add_tags_bulk(conn, rows):
+    # 新しい投稿 [(id, tags, address, lat, lon, created_at), ...] のタグと集計をまとめて書く
+    names = sorted({t for r in rows for t in split_tags(r[1])})
+    ids = {}
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        conn.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(n,) for n in chunk])
+        ids.update(conn.execute(f"SELECT name, id FROM tags WHERE name IN ({', '.join('?' * len(chunk))})", chunk))
+    links, stats, cells = [], Counter(), Counter()
+    for report_id, tags_text, address, lat, lon, created_at in rows:
+        area = report_area(address)
+        day = (created_at or "")[:10]
+        for name in split_tags(tags_text):
+            tag_id = ids[name]
+            links.append((report_id, tag_id))
+            stats[(tag_id, area, day)] += 1
+            if lat is not None and lon is not None:
+                cells[(tag_id, math.floor(lat / TAG_CELL_DEG), math.floor(lon / TAG_CELL_DEG), day)] += 1
+    conn.executemany("INSERT INTO report_tags (report_id, tag_id) VALUES (?, ?)", links)
+    conn.executemany(
+        "INSERT INTO tag_stats (tag_id, area, day, n) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (tag_id, area, day) DO UPDATE SET n = n + excluded.n",
+        [(*key, n) for key, n in stats.items()],
+    )
+    conn.executemany(
+        "INSERT INTO tag_cells (tag_id, cell_i, cell_j, day, n) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (tag_id, cell_i, cell_j, day) DO UPDATE SET n = n + excluded.n",
+        [(*key, n) for key, n in cells.items()],
+    )
+
+
+def _init_search(cur):
+    # 本文・住所・タグの全文検索（FTS5 trigram、日本語も分かち書きなしで部分一致できる）。
+    # reports を外部コンテンツにするので文字列は二重に持たない
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'reports_fts'")
+    created = cur.fetchone() is None
+    try:
+        cur.executescript("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+            text, address, tags, content='reports', content_rowid='id', tokenize='trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS reports_fts_ai AFTER INSERT ON reports BEGIN
+            INSERT INTO reports_fts(rowid, text, address, tags) VALUES (new.id, new.text, new.address, new.tags);
+        END;
+        CREATE TRIGGER IF NOT EXISTS reports_fts_ad AFTER DELETE ON reports BEGIN
+            INSERT INTO reports_fts(reports_fts, rowid, text, address, tags)
+            VALUES ('delete', old.id, old.text, old.address, old.tags);
+        END;
+        CREATE TRIGGER IF NOT EXISTS reports_fts_au AFTER UPDATE OF text, address, tags ON reports BEGIN
+            INSERT INTO reports_fts(reports_fts, rowid, text, address, tags)
+            VALUES ('delete', old.id, old.text, old.address, old.tags);
+            INSERT INTO reports_fts(rowid, text, address, tags) VALUES (new.id, new.text, new.address, new.tags);
+        END;
+        """)
+    except sqlite3.OperationalError:
+        # FTS5 / trigram のない SQLite（3.34 未満など）。search_reports は LIKE で動く
+        return
+    if created:
+        cur.execute("INSERT INTO reports_fts(reports_fts) VALUES ('rebuild')")
+
+
+def has_search_index():
+    cur = get_connection().cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'reports_fts'")
+    return cur.fetchone() is not None
+
+
+def rebuild_search_index():
+    # 既存の投稿から作り直す（トリガー導入前の DB や、索引が壊れたとき）
+    def rebuild(conn):
+        conn.execute("INSERT INTO reports_fts(reports_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO reports_fts(reports_fts) VALUES ('optimize')")
+        return conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+    return write(rebuild)
+
+# ---------- ユーザー認証 ----------
+def signup(username, email, password):
+    try:
+        password_hash = passwords.get_pool().hash(password)
+    except passwords.AuthBusy as e:
+        return False, str(e)
+    try:
+        write(lambda conn: conn.execute(
             "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
             (username, email, password_hash)
-        )
-        conn.commit()
+        ))
         return True, None
     except sqlite3.IntegrityError as e:
         if "username" in str(e).lower():
@@ -29,78 +476,242 @@ def signup(username, email, password):
         if "email" in str(e).lower():
             return False, "そのメールアドレスは既に使われています"
         return False, "登録に失敗しました"
-    finally:
-        conn.close()
 
-def login(email_or_username, password):
-    conn = get_connection()
-    cur = conn.cursor()
+def login(email_or_username, password, ip=None):
+    # 失敗が続いているアカウント・IP、ハッシュ計算のプールが埋まっているときは passwords.AuthBusy
+    passwords.check_throttle(email_or_username, ip)
+    cur = get_connection().cursor()
     cur.execute(
         "SELECT id, username, email, password_hash FROM users WHERE email = ? OR username = ?",
         (email_or_username, email_or_username)
     )
     row = cur.fetchone()
-    conn.close()
-    if not row:
+    pool = passwords.get_pool()
+    # 該当ユーザーがいなくても照合と同じ時間をかける（応答時間でユーザーの有無がわからないように）。
+    # その場合は照合の結果によらず失敗
+    if not pool.verify(password, row[3] if row else None) or row is None:
+        passwords.login_failed(email_or_username, ip)
         return None
     uid, username, email, pw = row
-    if bcrypt.checkpw(password.encode(), pw):
-        return {"id": uid, "username": username, "email": email}
-    return None
+    passwords.login_succeeded(email_or_username)
+    if pool.needs_rehash(pw):
+        # コスト（NIGHTWALK_BCRYPT_ROUNDS）が変わっていれば裏で作り直す
+        pool.rehash_later(password, lambda new: write(lambda conn: conn.execute(
+            "UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?", (new, uid, pw)
+        )))
+    return {"id": uid, "username": username, "email": email}
 
 # ---------- 掲示板 ----------
 def save_report(user, text, address, lat, lon, post_type=None, tags=None, image_path=None, polarity=None):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO reports (user_id, username, text, address, lat, lon, post_type, tags, image_path, polarity, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (
-            user["id"] if user else None,
-            user["username"] if user else None,
-            text,
-            address,
-            lat,
-            lon,
-            post_type,
-            tags,
-            image_path,
-            polarity,
-            datetime.utcnow().isoformat(),
-        ),
+    params = (
+        user["id"] if user else None,
+        user["username"] if user else None,
+        text,
+        address,
+        lat,
+        lon,
+        post_type,
+        tags,
+        image_path,
+        polarity,
+        datetime.utcnow().isoformat(),
     )
-    rid = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return rid
+
+    def insert(conn):
+        rid = conn.execute(REPORT_INSERT, params).lastrowid
+        if tags:
+            _set_report_tags(conn, rid, tags)
+        return rid
+    return write(insert)
+
+def _report_dict(r):
+    return {
+        "id": r[0],
+        "user_id": r[1],
+        "username": r[2],
+        "text": r[3],
+        "address": r[4],
+        "lat": r[5],
+        "lon": r[6],
+        "post_type": r[7],
+        "tags": r[8],
+        "image_path": r[9],
+        "polarity": r[10],
+        "created_at": r[11],
+    }
 
 def load_reports():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, user_id, username, text, address, lat, lon, post_type, tags, image_path, polarity, created_at FROM reports ORDER BY created_at DESC")
+    # 全件（集計・エクスポート用）。画面の一覧は load_reports_page を使う
+    cur = get_connection().cursor()
+    cur.execute(f"SELECT {REPORT_COLUMNS} FROM reports ORDER BY created_at DESC, id DESC")
+    return [_report_dict(r) for r in cur.fetchall()]
+
+def iter_reports(since=None, until=None, batch=BULK_BATCH):
+    # 全件を id 順に batch 件ずつ読む（書き出し用。表全体をメモリに載せない）
+    where, params = ["id > ?"], [-1]
+    if since:
+        where.append("created_at >= ?")
+        params.append(since)
+    if until:
+        where.append("created_at < ?")
+        params.append(until)
+    sql = f"SELECT {REPORT_COLUMNS} FROM reports WHERE {' AND '.join(where)} ORDER BY id LIMIT ?"
+    cur = get_connection().cursor()
+    while True:
+        rows = cur.execute(sql, params + [batch]).fetchall()
+        for r in rows:
+            yield _report_dict(r)
+        if len(rows) < batch:
+            return
+        params[0] = rows[-1][0]
+
+def load_reports_page(limit=PAGE_SIZE, before=None):
+    # 新しい順に limit 件。before は前のページの next_cursor（(created_at, id)）。
+    # OFFSET を使わず索引の位置から読むので、何ページ目でも表の大きさに関係なく一定のコスト
+    cur = get_connection().cursor()
+    if before is None:
+        cur.execute(
+            f"SELECT {REPORT_COLUMNS} FROM reports ORDER BY created_at DESC, id DESC LIMIT ?",
+            (limit + 1,)
+        )
+    else:
+        cur.execute(
+            f"SELECT {REPORT_COLUMNS} FROM reports WHERE (created_at, id) < (?, ?) "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            (before[0], before[1], limit + 1)
+        )
     rows = cur.fetchall()
-    conn.close()
-    reports = []
-    for r in rows:
-        reports.append({
-            "id": r[0],
-            "user_id": r[1],
-            "username": r[2],
-            "text": r[3],
-            "address": r[4],
-            "lat": r[5],
-            "lon": r[6],
-            "post_type": r[7],
-            "tags": r[8],
-            "image_path": r[9],
-            "polarity": r[10],
-            "created_at": r[11],
-        })
-    return reports
+    reports = [_report_dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = reports[-1]
+        next_cursor = (last["created_at"], last["id"])
+    return reports, next_cursor
+
+
+# ---------- 位置で探す ----------
+# R*Tree の座標は 32bit 浮動小数で外側に丸められるので、reports の lat/lon で絞り直す
+_BBOX_WHERE = (
+    "t.max_lat >= ? AND t.min_lat <= ? AND t.max_lon >= ? AND t.min_lon <= ? "
+    "AND r.lat BETWEEN ? AND ? AND r.lon BETWEEN ? AND ?"
+)
+
+
+def _bbox_params(south, west, north, east):
+    return (south, north, west, east, south, north, west, east)
+
+
+def count_reports_in_bbox(south, west, north, east):
+    cur = get_connection().cursor()
+    cur.execute(
+        f"SELECT COUNT(*) FROM reports_rtree t JOIN reports r ON r.id = t.id WHERE {_BBOX_WHERE}",
+        _bbox_params(south, west, north, east)
+    )
+    return cur.fetchone()[0]
+
+
+def reports_in_bbox(south, west, north, east, limit=None):
+    # 範囲内の投稿を新しい順に
+    cols = ", ".join(f"r.{c.strip()}" for c in REPORT_COLUMNS.split(","))
+    sql = (
+        f"SELECT {cols} FROM reports_rtree t JOIN reports r ON r.id = t.id WHERE {_BBOX_WHERE} "
+        "ORDER BY r.created_at DESC, r.id DESC"
+    )
+    params = _bbox_params(south, west, north, east)
+    if limit is not None:
+        sql += " LIMIT ?"
+        params += (limit,)
+    cur = get_connection().cursor()
+    cur.execute(sql, params)
+    return [_report_dict(r) for r in cur.fetchall()]
+
+
+def reports_near(lat, lon, radius_m, limit=None):
+    # 半径 radius_m 以内の投稿を近い順に（distance_m 付き）
+    dlat = radius_m / M_PER_DEG
+    dlon = radius_m / (M_PER_DEG * max(math.cos(math.radians(lat)), 1e-6))
+    near = []
+    for r in reports_in_bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon):
+        d = _distance_m(lat, lon, r["lat"], r["lon"])
+        if d <= radius_m:
+            r["distance_m"] = d
+            near.append(r)
+    near.sort(key=lambda r: r["distance_m"])
+    return near[:limit] if limit is not None else near
+
+
+def _distance_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * 6371008.8 * math.asin(math.sqrt(a))
+
+
+def report_clusters(south, west, north, east, cell_deg):
+    # 範囲内の投稿を cell_deg 度四方のセルに集計する: [(lat, lon, 件数, 悪い方向の件数), ...]
+    # lat/lon はセル内の投稿の重心
+    cur = get_connection().cursor()
+    cur.execute(
+        "SELECT AVG(r.lat), AVG(r.lon), COUNT(*), SUM(r.polarity = '悪い方向') "
+        f"FROM reports_rtree t JOIN reports r ON r.id = t.id WHERE {_BBOX_WHERE} "
+        "GROUP BY CAST((r.lat + 90) / ? AS INTEGER), CAST((r.lon + 180) / ? AS INTEGER)",
+        _bbox_params(south, west, north, east) + (cell_deg, cell_deg)
+    )
+    return [(lat, lon, n, bad or 0) for lat, lon, n, bad in cur.fetchall()]
+
+
+# ---------- 全文検索 ----------
+def _like_pattern(term):
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def search_reports(query, bbox=None, since=None, until=None, limit=50):
+    # 空白区切りの語をすべて含む投稿（本文・住所・タグ）。bbox = (south, west, north, east)、
+    # since / until は created_at と同じ ISO 形式の文字列。
+    # 3 文字以上の語があれば FTS5 で引いて bm25 の順、短い語だけなら新しい順
+    terms = query.split()
+    long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN]
+    short_terms = [t for t in terms if len(t) < TRIGRAM_MIN]
+    use_fts = bool(long_terms) and has_search_index()
+    if not use_fts:
+        short_terms = terms
+
+    cols = ", ".join(f"r.{c.strip()}" for c in REPORT_COLUMNS.split(","))
+    where, params = [], []
+    if use_fts:
+        sql = f"SELECT {cols} FROM reports_fts JOIN reports r ON r.id = reports_fts.rowid"
+        where.append("reports_fts MATCH ?")
+        params.append(" ".join('"' + t.replace('"', '""') + '"' for t in long_terms))
+        order = f"bm25(reports_fts, {', '.join(map(str, SEARCH_WEIGHTS))}), r.created_at DESC"
+    else:
+        sql = f"SELECT {cols} FROM reports r"
+        order = "r.created_at DESC, r.id DESC"
+    for t in short_terms:
+        where.append("(r.text LIKE ? ESCAPE '\\' OR r.address LIKE ? ESCAPE '\\' OR r.tags LIKE ? ESCAPE '\\')")
+        params += [_like_pattern(t)] * 3
+    if bbox is not None:
+        south, west, north, east = bbox
+        where.append(
+            "r.id IN (SELECT id FROM reports_rtree WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?) "
+            "AND r.lat BETWEEN ? AND ? AND r.lon BETWEEN ? AND ?"
+        )
+        params += [south, north, west, east, south, north, west, east]
+    if since is not None:
+        where.append("r.created_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("r.created_at < ?")
+        params.append(until)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order} LIMIT ?"
+    params.append(limit)
+    cur = get_connection().cursor()
+    cur.execute(sql, params)
+    return [_report_dict(r) for r in cur.fetchall()]
 
 
 def update_report_with_meta(report_id, post_type=None, tags=None, image_path=None, polarity=None):
-    conn = get_connection()
-    cur = conn.cursor()
     updates = []
     params = []
     if post_type is not None:
@@ -116,36 +727,263 @@ def update_report_with_meta(report_id, post_type=None, tags=None, image_path=Non
         updates.append("polarity = ?")
         params.append(polarity)
     if not updates:
-        conn.close()
         return
     params.append(report_id)
     sql = f"UPDATE reports SET {', '.join(updates)} WHERE id = ?"
+
+    def update(conn):
+        conn.execute(sql, params)
+        if tags is not None:
+            _set_report_tags(conn, report_id, tags)
+    write(update)
+
+
+# ---------- 一括取り込み ----------
+def _insert_reports(conn, rows):
+    # rows は REPORT_INSERT の並び。書き込みスレッドの中なので、last より後の id はすべてこの rows
+    last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM reports").fetchone()[0]
+    conn.executemany(REPORT_INSERT, rows)
+    ids = [r[0] for r in conn.execute("SELECT id FROM reports WHERE id > ? ORDER BY id", (last,))]
+    _add_tags_bulk(conn, [(rid, r[7], r[3], r[4], r[5], r[10]) for rid, r in zip(ids, rows) if r[7]])
+    return len(rows)
+
+
+def _import_state(conn):
+    # 取り込み中なら外した索引・トリガーの定義などを settings から返す
+    row = conn.execute("SELECT value FROM settings WHERE key = 'importing'").fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _defer_indexes(conn):
+    # 索引・トリガーを外し、戻すのに要るもの（定義、その時点の最大の id と変更ログの位置）を settings に残して返す。
+    # 前の取り込みが戻さずに終わっていれば、その記録をそのまま引き継ぐ
+    state = _import_state(conn)
+    if state is None:
+        saved = conn.execute(
+            f"SELECT name, type, sql FROM sqlite_master WHERE name IN ({', '.join('?' * len(DEFERRED_INDEXES))})",
+            DEFERRED_INDEXES,
+        ).fetchall()
+        state = {
+            "first_id": conn.execute("SELECT COALESCE(MAX(id), 0) FROM reports").fetchone()[0],
+            "changes_head": _changes_head(conn),
+            "saved": saved,
+        }
+        conn.execute("INSERT INTO settings (key, value) VALUES ('importing', ?)", (json.dumps(state),))
+    for name, kind, _ in state["saved"]:
+        conn.execute(f"DROP {kind.upper()} IF EXISTS {name}")
+    return state
+
+
+def _restore_indexes(conn, state):
+    # first_id より後の投稿（取り込んだ分と、その間に投稿された分）をまとめて索引に入れてから元に戻す。
+    # 途中でトリガーが作り直されていても二重に入れないよう、入っていないものだけを足す
+    first_id = state["first_id"]
+    names = {name for name, _, _ in state["saved"]}
+    if "reports_rtree_ai" in names:
+        conn.execute(
+            "INSERT OR IGNORE INTO reports_rtree SELECT id, lat, lat, lon, lon FROM reports "
+            "WHERE id > ? AND lat IS NOT NULL AND lon IS NOT NULL",
+            (first_id,)
+        )
+    if "reports_fts_ai" in names:
+        # 外部コンテンツの FTS5 は reports_fts 自体を引くと reports の行が返るので、索引済みかは docsize で見る
+        conn.execute(
+            "INSERT INTO reports_fts(rowid, text, address, tags) SELECT id, text, address, tags FROM reports "
+            "WHERE id > ? AND NOT EXISTS (SELECT 1 FROM reports_fts_docsize d WHERE d.id = reports.id)",
+            (first_id,)
+        )
+    if "report_changes_ai" in names:
+        conn.execute(
+            "INSERT INTO report_changes (report_id) SELECT id FROM reports "
+            "WHERE id > ? AND id NOT IN (SELECT report_id FROM report_changes WHERE seq > ?)",
+            (first_id, state["changes_head"])
+        )
+    for _, kind, sql in state["saved"]:
+        # sqlite_master の定義は IF NOT EXISTS が外れている
+        conn.execute(re.sub(rf"^CREATE {kind.upper()} ", f"CREATE {kind.upper()} IF NOT EXISTS ", sql, flags=re.I))
+    conn.execute("DELETE FROM settings WHERE key = 'importing'")
+
+
+def import_reports(batches, defer_indexes=True):
+    # batches は行（REPORT_INSERT の並び）のリストを順に返すイテラブル。1 バッチを 1 トランザクションで書き、件数を返す。
+    # 取り込み中は settings の importing が立ち、init_db は外した索引・トリガーを作らない。
+    # 途中で止まっても外した索引は戻す（プロセスごと落ちたときは python auth_db.py restore-import）
+    deferred = write(_defer_indexes) if defer_indexes else None
+    total = 0
+    try:
+        for rows in batches:
+            if rows:
+                total += write(lambda conn, rows=rows: _insert_reports(conn, rows))
+    finally:
+        if deferred is not None:
+            write(lambda conn: _restore_indexes(conn, deferred))
+    return total
+
+
+def restore_import():
+    # 落ちた取り込みが外したままの索引・トリガーを戻す。戻すものがなければ False
+    def restore(conn):
+        state = _import_state(conn)
+        if state is None:
+            return False
+        _restore_indexes(conn, state)
+        return True
+    return write(restore)
+
+
+# ---------- タグの集計 ----------
+def _since_day(days):
+    return (datetime.utcnow() - timedelta(days=days)).date().isoformat() if days else None
+
+
+def tag_counts(area=None, days=None, limit=None):
+    # タグごとの件数（多い順）: [(タグ, 件数), ...]。area は report_area() の地域名、days は直近の日数
+    where, params = [], []
+    if area is not None:
+        where.append("s.area = ?")
+        params.append(area)
+    if days:
+        where.append("s.day >= ?")
+        params.append(_since_day(days))
+    sql = "SELECT t.name, SUM(s.n) AS total FROM tag_stats s JOIN tags t ON t.id = s.tag_id"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " GROUP BY s.tag_id ORDER BY total DESC, t.name"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    cur = get_connection().cursor()
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def tag_area_counts(tag, days=None):
+    # あるタグの地域ごとの件数（多い順）: [(地域, 件数), ...]
+    sql = (
+        "SELECT s.area, SUM(s.n) AS total FROM tag_stats s JOIN tags t ON t.id = s.tag_id "
+        "WHERE t.name = ?"
+    )
+    params = [tag]
+    if days:
+        sql += " AND s.day >= ?"
+        params.append(_since_day(days))
+    sql += " GROUP BY s.area ORDER BY total DESC"
+    cur = get_connection().cursor()
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def tag_areas():
+    cur = get_connection().cursor()
+    cur.execute("SELECT area, SUM(n) AS total FROM tag_stats WHERE area != '' GROUP BY area ORDER BY total DESC")
+    return [r[0] for r in cur.fetchall()]
+
+
+def tag_cell_counts(tags=None, days=None, bbox=None):
+    # 地図セルごとのタグ件数: [(タグ, セル中心 lat, セル中心 lon, 件数, 最新の日), ...]
+    # セル数は投稿数ではなく、投稿のある場所の数で決まる
+    where, params = [], []
+    if tags:
+        where.append(f"t.name IN ({', '.join('?' * len(tags))})")
+        params += list(tags)
+    if days:
+        where.append("c.day >= ?")
+        params.append(_since_day(days))
+    if bbox is not None:
+        south, west, north, east = bbox
+        where.append("c.cell_i BETWEEN ? AND ? AND c.cell_j BETWEEN ? AND ?")
+        params += [
+            math.floor(south / TAG_CELL_DEG), math.floor(north / TAG_CELL_DEG),
+            math.floor(west / TAG_CELL_DEG), math.floor(east / TAG_CELL_DEG),
+        ]
+    sql = (
+        "SELECT t.name, c.cell_i, c.cell_j, SUM(c.n), MAX(c.day) FROM tag_cells c JOIN tags t ON t.id = c.tag_id"
+    )
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " GROUP BY c.tag_id, c.cell_i, c.cell_j"
+    cur = get_connection().cursor()
     cur.execute(sql, params)
-    conn.commit()
-    conn.close()
-
-
-def detect_polarity(text, tags_text=None):
-    # 簡易ルールベース判定: ポジティブ語/ネガティブ語のカウントで判定
-    positive = ["安全", "明る", "広い", "問題ない", "安心", "見通し良"]
-    negative = ["暗", "怖", "危", "怪しい", "人通り少", "危険", "狭い"]
-    score = 0
-    txt = (text or "").lower()
-    for w in positive:
-        if w in txt:
-            score += 1
-    for w in negative:
-        if w in txt:
-            score -= 1
-    if tags_text:
-        for t in (tags_text or "").split(','):
-            tt = t.strip()
-            if not tt:
-                continue
-            for w in positive:
-                if w in tt:
-                    score += 1
-            for w in negative:
-                if w in tt:
-                    score -= 1
-    return "良い方向" if score >= 0 else "悪い方向"
+    return [
+        (name, (i + 0.5) * TAG_CELL_DEG, (j + 0.5) * TAG_CELL_DEG, n, day)
+        for name, i, j, n, day in cur.fetchall()
+    ]
+
+
+# ---------- ルート検索への反映 ----------
+def _changes_head(conn):
+    # 最後に記録した seq（prune で空になっていても AUTOINCREMENT の値は残る）
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'report_changes'").fetchone()
+    return row[0] if row else 0
+
+
+def signal_reports(since):
+    # コストに使う投稿（created_at が since 以降で位置のあるもの）と、その時点の変更ログの位置
+    conn = get_connection()
+    conn.execute("BEGIN")
+    try:
+        cursor = _changes_head(conn)
+        rows = conn.execute(
+            f"SELECT {SIGNAL_COLUMNS} FROM reports "
+            "WHERE created_at >= ? AND lat IS NOT NULL AND lon IS NOT NULL",
+            (since,)
+        ).fetchall()
+    finally:
+        conn.execute("COMMIT")
+    return cursor, rows
+
+
+def report_changes_since(cursor, limit=CHANGES_MAX):
+    # cursor より後に追加・変更・削除された投稿: (新しい cursor, 変わった id, 今の行)。
+    # 削除された投稿は id だけで行がない。limit 件で打ち切るので、戻った cursor で続けて呼ぶ。
+    # cursor の直後の記録が prune で消えていれば (None, [], [])（signal_reports から読み直す）
+    conn = get_connection()
+    conn.execute("BEGIN")
+    try:
+        oldest = conn.execute("SELECT MIN(seq) FROM report_changes").fetchone()[0] or _changes_head(conn) + 1
+        if oldest > cursor + 1:
+            return None, [], []
+        changes = conn.execute(
+            "SELECT seq, report_id FROM report_changes WHERE seq > ? ORDER BY seq LIMIT ?", (cursor, limit)
+        ).fetchall()
+        ids = sorted({rid for _, rid in changes})
+        rows = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows += conn.execute(
+                f"SELECT {SIGNAL_COLUMNS} FROM reports WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+    finally:
+        conn.execute("COMMIT")
+    return (changes[-1][0] if changes else cursor), ids, rows
+
+
+def prune_report_changes(keep=CHANGES_KEEP):
+    # 新しい keep 件だけ残して消す。消した件数を返す
+    def prune(conn):
+        head = _changes_head(conn)
+        return conn.execute("DELETE FROM report_changes WHERE seq <= ?", (head - keep,)).rowcount
+    return write(prune)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="掲示板 DB の保守")
+    parser.add_argument(
+        "command", choices=["reindex", "migrate-tags", "restore-import"],
+        help="reindex: 全文検索インデックスを作り直す / migrate-tags: タグ表と集計表を作り直す / "
+             "restore-import: 途中で落ちた一括取り込みの索引とトリガーを戻す",
+    )
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+    DB_PATH = args.db
+    init_db()
+    if args.command == "reindex":
+        print(f"reindexed {rebuild_search_index()} reports")
+    elif args.command == "migrate-tags":
+        print(f"migrated tags of {migrate_tags()} reports")
+    elif args.command == "restore-import":
+        if restore_import():
+            # 取り込み中は作らなかった分（トリガーなど）もここで作る
+            init_db()
+            print("restored indexes and triggers")
+        else:
+            print("no unfinished import")
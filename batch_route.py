@@ -0,0 +1,163 @@
+# batch_route.py
+# OD ペア CSV をまとめて安全ルート検索する
+#
+#   python batch_route.py od.csv --place "さいたま市, 埼玉, Japan" --out routes.csv --workers 8
+#
+# 入力 CSV は origin,destination（住所）または orig_lat,orig_lon,dest_lat,dest_lon の列を持つ。
+# CSR グラフとコスト配列は共有メモリに置き、各ワーカーは同じ出発地の OD を 1 回の探索でまとめて処理する。
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from parallel_costs import CostPool
+from routing_engine import NoRouteError, RoutingEngine, select_path_edges, walk_predecessors
+from shared_graph import SharedArrays, attach, routing_arrays
+
+_arrays = None
+_handles = None
+_graph = None
+
+
+def _init_worker(spec):
+    global _arrays, _handles, _graph
+    _arrays, _handles = attach(spec)
+    n = len(_arrays["indptr"]) - 1
+    _graph = csr_matrix(
+        (_arrays["slot_safety"], _arrays["indices"], _arrays["indptr"]),
+        shape=(n, n),
+    )
+
+
+def _route_from(task):
+    src, jobs = task
+    _, pred = dijkstra(_graph, directed=True, indices=src, return_predecessors=True)
+    a = _arrays
+    rows = []
+    for row_id, dst in jobs:
+        try:
+            path = walk_predecessors(pred, src, dst)
+        except NoRouteError as e:
+            rows.append((row_id, np.nan, np.nan, np.nan, str(e)))
+            continue
+        edges = select_path_edges(
+            a["indptr"], a["indices"], a["pair_order"], a["pair_start"], a["safety_cost"], path
+        )
+        length = float(a["edge_length"][edges].sum())
+        safety = float(a["safety_cost"][edges].sum())
+        danger = safety / length if length > 0 else np.nan
+        rows.append((row_id, length, safety, danger, ""))
+    return rows
+
+
+def read_od(path, engine):
+    df = pd.read_csv(path)
+    if {"orig_lat", "orig_lon", "dest_lat", "dest_lon"} <= set(df.columns):
+        orig = df[["orig_lat", "orig_lon"]].to_numpy(dtype=np.float64)
+        dest = df[["dest_lat", "dest_lon"]].to_numpy(dtype=np.float64)
+        return df, orig, dest
+    if not {"origin", "destination"} <= set(df.columns):
+        raise ValueError("CSV には origin,destination か orig_lat,orig_lon,dest_lat,dest_lon の列が必要です")
+
+    # 同じ住所は 1 回だけジオコードする
+    coords = {}
+    for addr in pd.unique(pd.concat([df["origin"], df["destination"]]).dropna()):
+        try:
+            coords[addr] = engine.resolve(addr)
+        except Exception as e:
+            print(f"ジオコード失敗: {addr}: {e}", file=sys.stderr)
+    nan = (np.nan, np.nan)
+    orig = np.array([coords.get(a, nan) for a in df["origin"]], dtype=np.float64)
+    dest = np.array([coords.get(a, nan) for a in df["destination"]], dtype=np.float64)
+    return df, orig, dest
+
+
+def snap(area, latlon):
+    out = np.full(len(latlon), -1, dtype=np.int64)
+    ok = ~np.isnan(latlon).any(axis=1)
+    if ok.any():
+        xs, ys = area.to_proj.transform(latlon[ok, 1], latlon[ok, 0])
+        _, idx = area.node_tree.query(np.column_stack([xs, ys]))
+        out[ok] = idx
+    return out
+
+
+def make_tasks(orig_nodes, dest_nodes, chunk):
+    by_origin = {}
+    for row_id, (o, d) in enumerate(zip(orig_nodes, dest_nodes)):
+        if o >= 0 and d >= 0:
+            by_origin.setdefault(int(o), []).append((row_id, int(d)))
+    tasks = []
+    for src, jobs in by_origin.items():
+        for i in range(0, len(jobs), chunk):
+            tasks.append((src, jobs[i:i + chunk]))
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OD ペアの一括安全ルート検索")
+    parser.add_argument("od_csv")
+    parser.add_argument("--place", default=None, help="検索エリア（省略時は OD 全体を囲むタイルを読む）")
+    parser.add_argument("--out", default="routes.csv")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--cost-workers", type=int, default=0, help="エッジのコスト計算に使うプロセス数（0 なら並列化しない）")
+    parser.add_argument("--chunk", type=int, default=500, help="1 タスクあたりの目的地数の上限")
+    parser.add_argument("--no-pois", action="store_true", help="街灯・コンビニ・交番を使わない（犯罪のみ）")
+    args = parser.parse_args()
+
+    cost_pool = CostPool(args.cost_workers, min_edges=0)
+    engine = RoutingEngine(max_areas=1, cost_pool=cost_pool)
+    t0 = time.perf_counter()
+    df, orig, dest = read_od(args.od_csv, engine)
+    points = np.concatenate([orig, dest])
+    points = points[~np.isnan(points).any(axis=1)]
+    if not args.place and len(points) == 0:
+        sys.exit("座標のある OD がありません")
+    area = engine.coverage(points.tolist(), args.place)
+    costs, warnings = engine.area_costs(area.place, with_pois=not args.no_pois)
+    cost_pool.close()
+    for w in warnings:
+        print(w, file=sys.stderr)
+    orig_nodes = snap(area, orig)
+    dest_nodes = snap(area, dest)
+    tasks = make_tasks(orig_nodes, dest_nodes, args.chunk)
+    print(
+        f"準備完了: nodes={area.n_nodes} edges={area.n_edges} pairs={len(df)} "
+        f"origins={len(set(t[0] for t in tasks))} ({time.perf_counter() - t0:.1f}s)",
+        file=sys.stderr,
+    )
+
+    length = np.full(len(df), np.nan)
+    safety = np.full(len(df), np.nan)
+    danger = np.full(len(df), np.nan)
+    error = np.where((orig_nodes < 0) | (dest_nodes < 0), "ジオコード失敗", "").astype(object)
+
+    t1 = time.perf_counter()
+    with SharedArrays(routing_arrays(area, costs)) as shared:
+        with ProcessPoolExecutor(
+            max_workers=args.workers, initializer=_init_worker, initargs=(shared.spec,)
+        ) as pool:
+            for rows in pool.map(_route_from, tasks):
+                for row_id, ln, sc, dg, err in rows:
+                    length[row_id], safety[row_id], danger[row_id] = ln, sc, dg
+                    error[row_id] = err
+    elapsed = time.perf_counter() - t1
+
+    df["length_m"] = np.round(length, 1)
+    df["safety_cost"] = np.round(safety, 1)
+    df["danger_score"] = np.round(danger, 4)
+    df["error"] = error
+    df.to_csv(args.out, index=False)
+
+    routed = int(np.isfinite(length).sum())
+    rate = routed / elapsed if elapsed > 0 else float("inf")
+    print(f"{routed}/{len(df)} ルート, {elapsed:.2f}s, {rate:.1f} routes/s → {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
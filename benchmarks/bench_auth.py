@@ -0,0 +1,124 @@
+# benchmarks/bench_auth.py
+# ログインのレイテンシ・スループットと、ログイン集中時に他の処理（ページの再実行）がどれだけ遅れるか
+#
+#   python benchmarks/bench_auth.py                      # 32 件同時ログイン、コスト 12
+#   python benchmarks/bench_auth.py --logins 64 --rounds 10,12 --workers 2
+#
+# legacy: 呼び出したスレッドでそのまま bcrypt を計算する（以前の auth_db.login と同じ）
+# pool:   現在の auth_db.login（passwords.HashPool で同時計算数を制限）
+# 集中している間、別スレッドで小さな Python の処理（ページの再実行の代わり）を繰り返し、その所要時間を測る。
+# 最後に、1 アカウントへの総当たり（パスワード違い）で実際に bcrypt を計算した回数を比べる。
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bcrypt  # noqa: E402
+import numpy as np  # noqa: E402
+
+import auth_db  # noqa: E402
+import passwords  # noqa: E402
+
+
+def legacy_login(name, password):
+    row = auth_db.get_connection().execute(
+        "SELECT id, username, email, password_hash FROM users WHERE username = ?", (name,)
+    ).fetchone()
+    if row and bcrypt.checkpw(password.encode(), row[3]):
+        return {"id": row[0], "username": row[1], "email": row[2]}
+    return None
+
+
+def probe():
+    # ページの再実行 1 回分くらいの Python の処理
+    return sum(i * i for i in range(100_000))
+
+
+def burst(login, users, n):
+    # n 件を同時に投げ、ログインと probe の所要時間を集める
+    latencies, errors, probes = [], [], []
+    stop = threading.Event()
+
+    def one(i):
+        name = users[i % len(users)]
+        t0 = time.perf_counter()
+        try:
+            ok = login(name, "password") is not None
+        except passwords.AuthBusy:
+            ok = False
+        latencies.append(time.perf_counter() - t0)
+        if not ok:
+            errors.append(name)
+
+    def run_probe():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            probe()
+            probes.append(time.perf_counter() - t0)
+
+    prober = threading.Thread(target=run_probe)
+    prober.start()
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    stop.set()
+    prober.join()
+    return np.array(latencies), len(errors), np.array(probes), wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ログイン（bcrypt）のベンチマーク")
+    parser.add_argument("--logins", type=int, default=32, help="同時に投げるログインの数")
+    parser.add_argument("--rounds", default="10,12", help="カンマ区切りの bcrypt コスト")
+    parser.add_argument("--workers", type=int, default=None, help="ハッシュ計算のスレッド数（既定は CPU 数、最大 4）")
+    parser.add_argument("--attempts", type=int, default=100, help="総当たりの試行回数")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    for _ in range(20):
+        probe()
+    idle = (time.perf_counter() - t0) / 20
+    print(f"probe (単独): {idle * 1000:.1f} ms")
+
+    for rounds in (int(r) for r in args.rounds.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            auth_db.DB_PATH = str(Path(tmp) / "users.db")
+            auth_db.init_db()
+            pool = passwords._pool = passwords.HashPool(workers=args.workers, rounds=rounds)
+            users = [f"user{i}" for i in range(8)]
+            for name in users:
+                auth_db.signup(name, f"{name}@example.com", "password")
+
+            print(f"\n== cost {rounds} ({pool.workers} hash workers, 待ち {pool.workers * passwords.PENDING_PER_WORKER} 件まで)")
+            print(f"{'mode':<8}{'p50 ms':>9}{'p95 ms':>9}{'logins/s':>10}{'busy':>6}{'probe p50':>11}{'probe p95':>11}")
+            for mode, login in (("legacy", legacy_login), ("pool", auth_db.login)):
+                lat, busy, probes, wall = burst(login, users, args.logins)
+                print(f"{mode:<8}{np.median(lat) * 1000:>9.0f}{np.percentile(lat, 95) * 1000:>9.0f}"
+                      f"{(len(lat) - busy) / wall:>10.1f}{busy:>6}"
+                      f"{np.median(probes) * 1000:>11.1f}{np.percentile(probes, 95) * 1000:>11.1f}")
+
+            # 総当たり: 制限なしなら毎回 bcrypt を計算する
+            hashes = pool.completed
+            t0 = time.perf_counter()
+            refused = 0
+            for _ in range(args.attempts):
+                try:
+                    auth_db.login("user0", "wrong", ip="203.0.113.7")
+                except passwords.AuthBusy:
+                    refused += 1
+            print(f"総当たり {args.attempts} 回: bcrypt {pool.completed - hashes} 回（制限なしなら {args.attempts} 回）, "
+                  f"{refused} 回は照合せずに拒否, {time.perf_counter() - t0:.1f}s")
+            passwords._accounts = passwords.LoginThrottle(passwords.ACCOUNT_MAX_FAILURES)
+            passwords._ips = passwords.LoginThrottle(passwords.IP_MAX_FAILURES)
+
+
+if __name__ == "__main__":
+    main()
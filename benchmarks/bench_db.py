@@ -0,0 +1,159 @@
+# benchmarks/bench_db.py
+# 掲示板 DB（auth_db）の同時読み書きスループット
+#
+#   python benchmarks/bench_db.py                          # 読み 8 + 書き 4 スレッド、10 秒ずつ
+#   python benchmarks/bench_db.py --readers 16 --writers 8 --seed-reports 20000
+#
+# legacy: 呼び出しごとに connect → commit → close（ロールバックジャーナル）。以前の auth_db と同じ
+# pooled: 現在の auth_db（スレッドごとの接続 + WAL + 書き込みスレッドのグループコミット + キーセットページング）
+import argparse
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+
+import auth_db  # noqa: E402
+
+USER = {"id": 1, "username": "bench"}
+READ_SQL = (
+    "SELECT id, user_id, username, text, address, lat, lon, post_type, tags, image_path, polarity, created_at "
+    "FROM reports ORDER BY created_at DESC"
+)
+INSERT_SQL = (
+    "INSERT INTO reports (user_id, username, text, address, lat, lon, post_type, tags, image_path, polarity, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def report_row(i):
+    return (
+        USER["id"], USER["username"], f"テスト投稿 {i}", f"地点 {i}", 35.9 + i % 100 * 1e-4, 139.6,
+        "コメントとタグ", "暗い", None, "悪い方向", datetime.utcnow().isoformat(),
+    )
+
+
+# -----------------------
+# --- legacy（比較用） ---
+# -----------------------
+def legacy_read():
+    conn = sqlite3.connect(auth_db.DB_PATH, check_same_thread=False)
+    rows = conn.execute(READ_SQL).fetchall()
+    conn.close()
+    return rows[:50]
+
+
+def legacy_write(i):
+    conn = sqlite3.connect(auth_db.DB_PATH, check_same_thread=False)
+    rid = conn.execute(INSERT_SQL, report_row(i)).lastrowid
+    conn.commit()
+    conn.close()
+    return rid
+
+
+def pooled_read():
+    return auth_db.load_reports_page()[0]
+
+
+def pooled_write(i):
+    row = report_row(i)
+    return auth_db.save_report(USER, *row[2:6], post_type=row[6], tags=row[7], polarity=row[9])
+
+
+# -----------------------
+# --- 計測 ---
+# -----------------------
+def run(mode, readers, writers, duration):
+    read, write = (legacy_read, legacy_write) if mode == "legacy" else (pooled_read, pooled_write)
+    latencies = defaultdict(list)
+    errors = defaultdict(Counter)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    counter = iter(range(10**9))
+
+    def user(op):
+        local, errs = [], Counter()
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            try:
+                read() if op == "read" else write(next(counter))
+            except sqlite3.Error as e:
+                errs[str(e)] += 1
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies[op].extend(local)
+            errors[op].update(errs)
+
+    threads = [threading.Thread(target=user, args=("read",)) for _ in range(readers)]
+    threads += [threading.Thread(target=user, args=("write",)) for _ in range(writers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    rows = {}
+    for op in ("read", "write"):
+        ms = np.array(latencies[op] or [0.0]) * 1000
+        n_err = sum(errors[op].values())
+        rows[op] = {
+            "count": len(latencies[op]),
+            "ops_per_s": len(latencies[op]) / elapsed,
+            "errors": n_err,
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "error_kinds": dict(errors[op]),
+        }
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="掲示板 DB の同時読み書きベンチマーク")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--seed-reports", type=int, default=2000)
+    parser.add_argument("--modes", default="legacy,pooled")
+    args = parser.parse_args()
+
+    print(f"readers={args.readers} writers={args.writers} duration={args.duration}s seed={args.seed_reports}")
+    print(f"{'mode':<8}{'op':<7}{'count':>8}{'ops/s':>10}{'err':>6}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)")
+    for mode in args.modes.split(","):
+        with tempfile.TemporaryDirectory() as tmp:
+            auth_db.DB_PATH = str(Path(tmp) / "users.db")
+            if mode == "legacy":
+                # 以前と同じロールバックジャーナルの DB を作る
+                conn = sqlite3.connect(auth_db.DB_PATH)
+                conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, email TEXT UNIQUE, password_hash BLOB)")
+                conn.execute("CREATE TABLE reports (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, username TEXT, text TEXT, address TEXT, lat REAL, lon REAL, post_type TEXT, tags TEXT, image_path TEXT, polarity TEXT, created_at TEXT)")
+                conn.commit()
+                conn.close()
+            else:
+                auth_db.init_db()
+            conn = sqlite3.connect(auth_db.DB_PATH)
+            conn.executemany(INSERT_SQL, (report_row(i) for i in range(args.seed_reports)))
+            conn.commit()
+            conn.close()
+
+            rows = run(mode, args.readers, args.writers, args.duration)
+            for op, r in rows.items():
+                print(f"{mode:<8}{op:<7}{r['count']:>8}{r['ops_per_s']:>10.1f}{r['errors']:>6}"
+                      f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}")
+                for kind, n in r["error_kinds"].items():
+                    print(f"{'':<15}{n:>8}  {kind}")
+            if mode == "pooled":
+                stats = auth_db.writer_stats()
+                print(f"{'':<15}group commit: {stats['writes']} writes / {stats['commits']} commits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/bench_images.py
+# 掲示板 1 ページ分の画像の転送量（元画像 vs サムネイル）とサムネイル作成時間
+#
+#   python benchmarks/bench_images.py
+#   python benchmarks/bench_images.py --posts 20 --size 4032x3024
+#
+# 写真に近い合成画像（グラデーション + ノイズ）と uploads/ にある実際の投稿画像を使う。
+# 保存先とサムネイルは一時ディレクトリに置き換えるので、uploads/ と static/thumbs/ には書き込まない。
+import argparse
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import images  # noqa: E402
+
+
+def synthetic_photo(width, height, fmt, seed):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([
+        128 + 100 * np.sin(x / (width / 3) + seed),
+        128 + 100 * np.cos(y / (height / 2) + seed),
+        128 + 60 * np.sin((x + y) / (width / 5)),
+    ], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投稿画像のサムネイルのベンチマーク")
+    parser.add_argument("--posts", type=int, default=20, help="1 ページの画像付き投稿数")
+    parser.add_argument("--size", default="3024x4032", help="合成写真のサイズ")
+    args = parser.parse_args()
+    width, height = map(int, args.size.split("x"))
+
+    samples = [synthetic_photo(width, height, "JPEG" if i % 2 else "PNG", i) for i in range(4)]
+    # 実行したディレクトリではなくリポジトリの uploads/ から読む
+    real_dir = images.BASE_DIR / images.UPLOAD_DIR
+    real = [p.read_bytes() for p in sorted(real_dir.glob("*")) if p.suffix.lower() in (".png", ".jpg", ".jpeg")]
+    uploads = (real + samples) * (args.posts // len(real + samples) + 1)
+    uploads = uploads[: args.posts]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images.UPLOAD_DIR = Path(tmp) / "uploads"
+        images.THUMB_DIR = Path(tmp) / "thumbs"
+        images.UPLOAD_DIR.mkdir()
+
+        times, paths = [], []
+        for data in uploads:
+            t0 = time.perf_counter()
+            paths.append(images.store_upload(data))
+            times.append(time.perf_counter() - t0)
+        stored = len(list(images.UPLOAD_DIR.iterdir()))
+
+        original = sum(len(d) for d in uploads)
+        thumbs = sum(images.thumbnail_path(p).stat().st_size for p in paths)
+        print(f"{args.posts} posts ({len(real)} real + {len(samples)} synthetic {width}x{height}, repeated)")
+        print(f"stored files: {stored} (重複を除いた数)")
+        print(f"store_upload: median {np.median(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms")
+        print(f"page weight: originals {original / 2**20:.1f} MB -> thumbnails {thumbs / 2**10:.0f} KB "
+              f"({original / thumbs:.0f}x smaller, {images.THUMB_EXT})")
+        # 実際に保存した画像ごと（--posts が画像の種類より少なければ、その分だけ）
+        real_names = {images.content_name(d) for d in real}
+        for path, data in dict(zip(paths, uploads)).items():
+            label = "real" if images.content_name(data) in real_names else "synthetic"
+            thumb = images.thumbnail_path(path).stat().st_size
+            print(f"  {label:<10}{len(data) / 2**10:>9.0f} KB -> {thumb / 2**10:>5.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# benchmarks/bench_import.py
+# 投稿の一括取り込み・書き出し（report_io.py）の速度
+#
+#   python benchmarks/bench_import.py                    # 20 万行
+#   python benchmarks/bench_import.py --rows 1000000
+#
+# 比較として、save_report を 1 行ずつ呼ぶ場合（--per-row 行で測って 1 行あたりを出す）と、
+# 索引を外さずに executemany する場合（--no-defer-rows 行）も測る。
+# 取り込み後に、範囲検索・全文検索・タグ集計が取り込んだ行を数えていることを確認する。
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+
+import auth_db  # noqa: E402
+import report_io  # noqa: E402
+from bench_report_map import CENTER  # noqa: E402
+from bench_search import PHRASES, TAGS, WARDS  # noqa: E402
+
+
+def write_jsonl(path, n, rng):
+    start = datetime.utcnow() - timedelta(days=365)
+    pts = CENTER + rng.normal(0, 0.1, size=(n, 2))
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            rec = {
+                "text": PHRASES[i % len(PHRASES)],
+                "address": f"さいたま市{WARDS[i % len(WARDS)]}{i % 97}丁目",
+                "lat": round(float(pts[i, 0]), 6),
+                "lon": round(float(pts[i, 1]), 6),
+                "post_type": "コメントとタグ",
+                "tags": ",".join(TAGS[j] for j in rng.choice(len(TAGS), 2, replace=False)),
+                "created_at": (start + timedelta(seconds=int(rng.integers(0, 365 * 86400)))).isoformat(),
+            }
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+
+def fresh_db(tmp, name):
+    auth_db.DB_PATH = str(Path(tmp) / f"{name}.db")
+    auth_db.init_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投稿の一括取り込み・書き出しのベンチマーク")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--per-row", type=int, default=2000)
+    parser.add_argument("--no-defer-rows", type=int, default=50_000)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / "reports.jsonl"
+        write_jsonl(src, args.rows, rng)
+        print(f"{args.rows} rows, {src.stat().st_size / 2**20:.0f} MB")
+
+        # 1 行ずつ save_report（以前の唯一の方法）
+        fresh_db(tmp, "per_row")
+        recs = [report_io.to_row(rec) for _, rec in report_io.read_records(open(src, encoding="utf-8"), "jsonl")
+                if _ < args.per_row + 1]
+        t0 = time.perf_counter()
+        for r in recs:
+            auth_db.save_report(None, *r[2:6], post_type=r[6], tags=r[7], polarity=r[9])
+        per_row = (time.perf_counter() - t0) / len(recs)
+        print(f"save_report 1 行ずつ: {1 / per_row:,.0f} rows/s（{args.rows} 行なら約 {per_row * args.rows / 60:.1f} 分）")
+
+        head = Path(tmp) / "head.jsonl"
+        with open(src, encoding="utf-8") as f, open(head, "w", encoding="utf-8") as out:
+            for _, line in zip(range(args.no_defer_rows), f):
+                out.write(line)
+        fresh_db(tmp, "no_defer")
+        t0 = time.perf_counter()
+        stats = report_io.import_file(head, classify=True, defer_indexes=False)
+        dt = time.perf_counter() - t0
+        print(f"一括（索引を外さない）: {stats['imported'] / dt:,.0f} rows/s（{stats['imported']} 行）")
+
+        fresh_db(tmp, "bulk")
+        t0 = time.perf_counter()
+        stats = report_io.import_file(src, classify=True)
+        dt = time.perf_counter() - t0
+        print(f"一括（索引を最後に作る）: {stats['imported'] / dt:,.0f} rows/s, {dt:.1f}s "
+              f"(imported {stats['imported']}, skipped {stats['skipped']}, classified {stats['classified']})")
+
+        south, west = CENTER[0] - 1, CENTER[1] - 1
+        print("check: bbox", auth_db.count_reports_in_bbox(south, west, south + 2, west + 2),
+              "/ search 人通り", len(auth_db.search_reports("人通り", limit=args.rows)),
+              "/ tags", sum(n for _, n in auth_db.tag_counts()),
+              "/ changes", auth_db.report_changes_since(0, limit=args.rows + 1)[0])
+
+        out = str(Path(tmp) / "export.jsonl")
+        t0 = time.perf_counter()
+        n = report_io.export_file(out)
+        dt = time.perf_counter() - t0
+        # メモリは別に測る（tracemalloc を有効にすると遅くなる）
+        tracemalloc.start()
+        report_io.export_file(out)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"書き出し: {n} rows, {n / dt:,.0f} rows/s, peak {peak / 2**20:.1f} MB (Python の確保量)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/bench_map_layers.py
+# POI レイヤーの HTML サイズと生成時間を、旧実装（folium マーカーを 1 つずつ作る）と比較する
+#
+#   python benchmarks/bench_map_layers.py --lamps 5000 --stores 200 --kobans 30
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import folium  # noqa: E402
+from folium.plugins import MarkerCluster  # noqa: E402
+
+from map_layers import add_poi_layers  # noqa: E402
+
+CENTER = (35.906, 139.624)
+
+
+def synthetic_pois(n_lamps, n_stores, n_kobans, seed=0):
+    rnd = random.Random(seed)
+
+    def points(n, tags_fn):
+        return [
+            (CENTER[0] + rnd.uniform(-0.03, 0.03), CENTER[1] + rnd.uniform(-0.03, 0.03), tags_fn(i))
+            for i in range(n)
+        ]
+
+    return {
+        "street_lamps": points(n_lamps, lambda i: {"highway": "street_lamp"} if i % 3 else {}),
+        "convenience_stores": points(n_stores, lambda i: {"name": f"コンビニ{i}", "brand": "ブランド"}),
+        "kobans": points(n_kobans, lambda i: {"name": f"交番{i}"}),
+    }
+
+
+def legacy_layers(m, pois):
+    # 旧 app.py の描画方法
+    cluster = MarkerCluster(name="street_lamps")
+    for lat, lon, info in pois["street_lamps"]:
+        popup_text = ", ".join([f"{k}: {v}" for k, v in info.items()]) if info else ""
+        folium.CircleMarker(
+            location=[lat, lon], radius=2, color="yellow", fill=True, fill_opacity=0.9,
+            popup=popup_text or "街灯",
+        ).add_to(cluster)
+    m.add_child(cluster)
+    for kind, icon, color in (("convenience_stores", "shopping-cart", "blue"), ("kobans", "shield", "darkblue")):
+        c = MarkerCluster(name=kind)
+        for lat, lon, tags in pois[kind]:
+            folium.Marker(
+                location=[lat, lon], popup=tags.get("name", ""),
+                icon=folium.Icon(color=color, icon=icon, prefix="fa"),
+            ).add_to(c)
+        m.add_child(c)
+
+
+def measure(build, pois, repeat):
+    times, size = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        m = folium.Map(location=CENTER, zoom_start=15)
+        build(m, pois)
+        html = m.get_root().render()
+        times.append(time.perf_counter() - t0)
+        size = len(html.encode("utf-8"))
+    return min(times), size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lamps", type=int, default=5000)
+    parser.add_argument("--stores", type=int, default=200)
+    parser.add_argument("--kobans", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pois = synthetic_pois(args.lamps, args.stores, args.kobans)
+    print(f"lamps={args.lamps} stores={args.stores} kobans={args.kobans}")
+    print(f"{'layer':<10}{'render (s)':>12}{'html (KB)':>12}")
+    results = {}
+    for name, build in (("legacy", legacy_layers), ("compact", add_poi_layers)):
+        sec, size = measure(build, pois, args.repeat)
+        results[name] = (sec, size)
+        print(f"{name:<10}{sec:>12.3f}{size / 1024:>12.1f}")
+    (ls, lb), (cs, cb) = results["legacy"], results["compact"]
+    print(f"speedup x{ls / cs:.1f}, payload x{lb / cb:.1f} smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# benchmarks/bench_parallel_costs.py
+# エッジの安全コスト計算（parallel_costs.CostPool）のワーカー数ごとの速度向上
+#
+#   python benchmarks/bench_parallel_costs.py                        # grid 400x400（約 64 万エッジ）、1/2/4 ワーカー
+#   python benchmarks/bench_parallel_costs.py --workers 1,2,4,8 --size 600
+#
+# 直列（compute_safety_costs）との比を表示し、結果が一致することも確認する。
+# 各ワーカー数で 1 回目はワーカー起動と木の構築を含むので、別に cold として表示する。
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+import osmnx as ox  # noqa: E402
+
+from parallel_costs import CostPool  # noqa: E402
+from routing_engine import AreaGraph, build_poi_trees, compute_safety_costs  # noqa: E402
+from synthetic import grid_graph, planar_graph, point_cloud, synthetic_pois  # noqa: E402
+
+
+def best_of(fn, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return result, min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="並列コスト計算のワーカー数別ベンチマーク")
+    parser.add_argument("--graph", choices=("grid", "planar"), default="grid")
+    parser.add_argument("--size", type=int, default=400, help="grid は 1 辺のノード数、planar はノード数")
+    parser.add_argument("--workers", default="1,2,4", help="カンマ区切りのワーカー数")
+    parser.add_argument("--chunks-per-worker", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    G = grid_graph(args.size) if args.graph == "grid" else planar_graph(args.size)
+    n_nodes = G.number_of_nodes()
+    area = AreaGraph("bench", ox.project_graph(G), G)
+    # 県全域を想定して犯罪・POI を密にする
+    area.set_crime_points(point_cloud(G, n_nodes // 4, clusters=200, seed=1))
+    pois = synthetic_pois(G, n_nodes, n_nodes // 50 + 5, n_nodes // 500 + 3, seed=2)
+    poi_trees = build_poi_trees(area, pois)
+    print(
+        f"{args.graph} nodes={area.n_nodes} edges={area.n_edges} crime={area.crime_tree.n} "
+        f"lamps={len(pois['street_lamps'])} cpus={os.cpu_count()}"
+    )
+
+    expected, serial = best_of(lambda: compute_safety_costs(area, poi_trees), args.repeat)
+    print(f"{'workers':>8}{'cold(s)':>10}{'best(s)':>10}{'speedup':>9}")
+    print(f"{'serial':>8}{'':>10}{serial:>10.3f}{1.0:>9.2f}")
+    for n in (int(w) for w in args.workers.split(",")):
+        pool = CostPool(n, min_edges=0, chunks_per_worker=args.chunks_per_worker)
+        t0 = time.perf_counter()
+        first = pool.costs(area, poi_trees)
+        cold = time.perf_counter() - t0
+        costs, best = best_of(lambda: pool.costs(area, poi_trees), args.repeat)
+        pool.close()
+        if not (np.allclose(first, expected) and np.allclose(costs, expected)):
+            sys.exit(f"workers={n}: 直列の結果と一致しません")
+        print(f"{n:>8}{cold:>10.3f}{best:>10.3f}{serial / best:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# benchmarks/bench_pipeline.py
+# ルート検索パイプラインの段階別ベンチマーク（合成データ・オフライン）
+#
+#   python benchmarks/bench_pipeline.py                   # small / medium を計測して baselines.json と比較
+#   python benchmarks/bench_pipeline.py --sizes all       # large も含める
+#   python benchmarks/bench_pipeline.py --save-baseline   # 今回の結果を基準値として保存
+#   python benchmarks/bench_pipeline.py --check           # 基準値より THRESHOLD 倍以上遅い段階があれば終了コード 1
+#
+# 各段階は --repeat 回実行した最小時間と、tracemalloc で測ったピークメモリを報告する。
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import folium  # noqa: E402
+import numpy as np  # noqa: E402
+import osmnx as ox  # noqa: E402
+from folium.plugins import HeatMap  # noqa: E402
+
+from heatmap import CrimeHeatmap  # noqa: E402
+from map_layers import add_poi_layers  # noqa: E402
+from overlay import danger_overlay_geojson, overlay_style  # noqa: E402
+from routing_engine import (  # noqa: E402
+    AreaGraph,
+    build_poi_trees,
+    compute_safety_costs,
+    route_metrics,
+    shortest_path,
+)
+from synthetic import grid_graph, planar_graph, point_cloud, synthetic_pois  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines.json"
+THRESHOLD = 1.25
+
+CASES = {
+    "grid-s": ("small", lambda: grid_graph(50)),
+    "planar-s": ("small", lambda: planar_graph(2_500)),
+    "grid-m": ("medium", lambda: grid_graph(150)),
+    "planar-m": ("medium", lambda: planar_graph(20_000)),
+    "grid-l": ("large", lambda: grid_graph(300)),
+    "planar-l": ("large", lambda: planar_graph(90_000)),
+}
+
+N_ROUTES = 20
+N_SNAP = 10_000
+
+
+def measure(fn, repeat):
+    # 時間は最小値、メモリは 1 回分のピーク（tracemalloc は遅くなるので別に実行）
+    times = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, min(times), peak
+
+
+def run_case(name, build, repeat, seed=0):
+    G = build()
+    n_nodes = G.number_of_nodes()
+    crime = point_cloud(G, max(300, n_nodes // 10), seed=seed + 1)
+    pois = synthetic_pois(G, n_nodes // 4, n_nodes // 100 + 5, n_nodes // 1000 + 3, seed=seed + 2)
+    rng = np.random.default_rng(seed)
+    stages = {}
+
+    def stage(label, fn):
+        result, sec, peak = measure(fn, repeat)
+        stages[label] = {"sec": sec, "peak_mb": peak / 2**20}
+        return result
+
+    G_proj = stage("project", lambda: ox.project_graph(G))
+    area = stage("index", lambda: AreaGraph(name, G_proj, G))
+    area.set_crime_points(crime)
+
+    snap_pts = np.column_stack([
+        rng.uniform(area.node_lat.min(), area.node_lat.max(), N_SNAP),
+        rng.uniform(area.node_lon.min(), area.node_lon.max(), N_SNAP),
+    ])
+
+    def snap():
+        xs, ys = area.to_proj.transform(snap_pts[:, 1], snap_pts[:, 0])
+        return area.node_tree.query(np.column_stack([xs, ys]))[1]
+
+    nodes = stage("snapping", snap)
+    costs = stage("costing", lambda: compute_safety_costs(area, build_poi_trees(area, pois)))
+
+    od = nodes[: N_ROUTES * 2].reshape(-1, 2)
+    paths = stage("routing", lambda: [shortest_path(area, costs, int(o), int(d)) for o, d in od])
+    routes = stage("danger_scoring", lambda: [route_metrics(area, p, costs, costs, zoom=15) for p in paths])
+
+    heatmap = CrimeHeatmap(crime, "bench")
+    route = max(routes, key=lambda r: len(r["nodes"]))
+    bbox = area.bbox_around(route["nodes"])
+
+    def serialize():
+        m = folium.Map(location=route["latlon"][0], zoom_start=15)
+        HeatMap(heatmap.cells(15, bbox), radius=25, blur=18, min_opacity=0.4).add_to(m)
+        folium.GeoJson(danger_overlay_geojson(area, costs, bbox), style_function=overlay_style).add_to(m)
+        folium.PolyLine(route["latlon"], color="red").add_to(m)
+        add_poi_layers(m, pois)
+        return len(folium.Figure().add_child(m).render().encode("utf-8"))
+
+    payload = stage("map_serialization", serialize)
+    return {
+        "nodes": area.n_nodes,
+        "edges": area.n_edges,
+        "payload_kb": round(payload / 1024, 1),
+        "stages": stages,
+    }
+
+
+def compare(results, baseline):
+    regressions = []
+    for case, res in results.items():
+        base = baseline.get("cases", {}).get(case)
+        if not base:
+            continue
+        for label, st in res["stages"].items():
+            b = base["stages"].get(label)
+            if not b or b["sec"] <= 0:
+                continue
+            ratio = st["sec"] / b["sec"]
+            st["vs_baseline"] = round(ratio, 2)
+            if ratio > THRESHOLD and st["sec"] - b["sec"] > 0.005:
+                regressions.append(f"{case}/{label}: {b['sec']:.4f}s → {st['sec']:.4f}s (x{ratio:.2f})")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'case':<10}{'stage':<20}{'sec':>10}{'peak MB':>10}{'vs base':>10}")
+    for case, res in results.items():
+        print(f"{case:<10}nodes={res['nodes']} edges={res['edges']} map={res['payload_kb']}KB")
+        for label, st in res["stages"].items():
+            vs = f"x{st['vs_baseline']:.2f}" if "vs_baseline" in st else "-"
+            print(f"{'':<10}{label:<20}{st['sec']:>10.4f}{st['peak_mb']:>10.1f}{vs:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ルート検索パイプラインのベンチマーク（合成データ）")
+    parser.add_argument("--sizes", default="small,medium", help="small,medium,large または all")
+    parser.add_argument("--cases", default=None, help="計測するケース名（カンマ区切り）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="退行があれば終了コード 1")
+    parser.add_argument("--json", default=None, help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    sizes = {"small", "medium", "large"} if args.sizes == "all" else set(args.sizes.split(","))
+    names = args.cases.split(",") if args.cases else [n for n, (size, _) in CASES.items() if size in sizes]
+
+    results = {}
+    for name in names:
+        print(f"running {name} ...", file=sys.stderr)
+        results[name] = run_case(name, CASES[name][1], args.repeat)
+
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    regressions = compare(results, baseline)
+    print_table(results)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "cases": results,
+    }
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.save_baseline:
+        merged = baseline.get("cases", {})
+        merged.update(results)
+        report["cases"] = merged
+        BASELINE_PATH.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+        print(f"saved baseline → {BASELINE_PATH}")
+
+    if regressions:
+        print("\n退行の可能性:")
+        for r in regressions:
+            print(f"  {r}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/bench_report_map.py
+# 投稿の範囲検索（R*Tree）と地図レイヤー生成の速度
+#
+#   python benchmarks/bench_report_map.py                  # 20 万件
+#   python benchmarks/bench_report_map.py --reports 1000000
+#
+# ズームごとに画面 1 枚分（1000x450 px）の範囲をランダムに取り、
+# 件数・範囲内の投稿・半径検索・セル集計・folium レイヤー生成の時間を表示する。
+# 比較として、全件を読んで Python で範囲を絞る場合（以前の唯一の方法）も測る。
+import argparse
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import folium  # noqa: E402
+import numpy as np  # noqa: E402
+
+import auth_db  # noqa: E402
+from map_layers import add_report_layer, report_cell_deg  # noqa: E402
+
+CENTER = (35.8617, 139.6455)
+INSERT_SQL = (
+    "INSERT INTO reports (user_id, username, text, address, lat, lon, post_type, tags, image_path, polarity, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def seed(n, rng):
+    # 県全域（約 ±0.3 度）に、駅周辺へ集中した分布で置く
+    hubs = CENTER + rng.normal(0, 0.12, size=(40, 2))
+    hub = rng.integers(0, len(hubs), n)
+    pts = hubs[hub] + rng.normal(0, 0.01, size=(n, 2))
+    now = datetime.utcnow().isoformat()
+    polarity = np.where(rng.random(n) < 0.6, "悪い方向", "良い方向")
+    conn = sqlite3.connect(auth_db.DB_PATH)
+    conn.executemany(INSERT_SQL, (
+        (1, "bench", f"投稿 {i}", f"地点 {i}", float(lat), float(lon), "コメントのみ", "", None, str(p), now)
+        for i, ((lat, lon), p) in enumerate(zip(pts, polarity))
+    ))
+    conn.commit()
+    conn.close()
+    return pts
+
+
+def viewport(center, zoom, width=1000, height=450):
+    deg_per_px = 360 / (256 * 2 ** zoom)
+    dlon = width / 2 * deg_per_px
+    dlat = height / 2 * deg_per_px * np.cos(np.radians(center[0]))
+    return (center[0] - dlat, center[1] - dlon, center[0] + dlat, center[1] + dlon)
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return result, float(np.median(times)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投稿の範囲検索と地図レイヤーのベンチマーク")
+    parser.add_argument("--reports", type=int, default=200_000)
+    parser.add_argument("--zooms", default="11,13,15,17")
+    parser.add_argument("--views", type=int, default=10, help="ズームごとの範囲の数")
+    parser.add_argument("--radius", type=float, default=300, help="半径検索の半径 (m)")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        auth_db.DB_PATH = str(Path(tmp) / "users.db")
+        auth_db.init_db()
+        t0 = time.perf_counter()
+        pts = seed(args.reports, rng)
+        print(f"seeded {args.reports} reports ({time.perf_counter() - t0:.1f}s, R*Tree はトリガーで同時に更新)")
+
+        _, scan_ms = timed(lambda: [
+            r for r in auth_db.load_reports() if CENTER[0] - 0.01 <= r["lat"] <= CENTER[0] + 0.01
+        ], 1)
+        print(f"全件読み込み + Python で絞り込み: {scan_ms:.0f} ms")
+
+        print(f"{'zoom':>5}{'in view':>9}{'count':>9}{'bbox':>9}{'near':>9}{'cluster':>9}{'layer':>9}  (ms, median)")
+        for zoom in (int(z) for z in args.zooms.split(",")):
+            rows = []
+            for center in pts[rng.integers(0, len(pts), args.views)]:
+                bbox = viewport(center, zoom)
+                n, t_count = timed(lambda: auth_db.count_reports_in_bbox(*bbox), 3)
+                _, t_bbox = timed(lambda: auth_db.reports_in_bbox(*bbox, limit=500), 3)
+                _, t_near = timed(lambda: auth_db.reports_near(center[0], center[1], args.radius), 3)
+                _, t_cluster = timed(lambda: auth_db.report_clusters(*bbox, report_cell_deg(zoom)), 3)
+                _, t_layer = timed(lambda: add_report_layer(folium.Map(location=list(center)), bbox, zoom), 3)
+                rows.append((n, t_count, t_bbox, t_near, t_cluster, t_layer))
+            med = np.median(np.array(rows), axis=0)
+            print(f"{zoom:>5}{med[0]:>9.0f}" + "".join(f"{v:>9.1f}" for v in med[1:]))
+
+
+if __name__ == "__main__":
+    main()
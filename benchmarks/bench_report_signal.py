@@ -0,0 +1,105 @@
+# benchmarks/bench_report_signal.py
+# 掲示板の投稿レイヤー（report_signal.ReportSignal）の作成・検索ごと・差分更新の速度
+#
+#   python benchmarks/bench_report_signal.py                      # grid 300x300（約 36 万エッジ）、投稿 5 万件
+#   python benchmarks/bench_report_signal.py --size 500 --reports 200000
+#
+# 新しい投稿の反映（差分）と、エリアの加減点を全部作り直す場合を比べ、結果が一致することも確認する。
+import argparse
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+import osmnx as ox  # noqa: E402
+
+import auth_db  # noqa: E402
+from bench_report_map import INSERT_SQL  # noqa: E402
+from report_signal import TAG_WEIGHTS, ReportSignal  # noqa: E402
+from routing_engine import AreaGraph  # noqa: E402
+from synthetic import grid_graph  # noqa: E402
+
+
+def seed(area, n, rng):
+    # グラフの範囲内に、直近 180 日の投稿を置く
+    south, west, north, east = area.bounds()
+    lat = rng.uniform(south, north, n)
+    lon = rng.uniform(west, east, n)
+    tags = list(TAG_WEIGHTS)
+    now = datetime.utcnow()
+    rows = []
+    for i in range(n):
+        created = (now - timedelta(seconds=int(rng.integers(0, 180 * 86400)))).isoformat()
+        polarity = "悪い方向" if rng.random() < 0.6 else "良い方向"
+        rows.append((1, "bench", f"投稿 {i}", "", float(lat[i]), float(lon[i]), "コメントとタグ",
+                     tags[i % len(tags)], None, polarity, created))
+    conn = sqlite3.connect(auth_db.DB_PATH)
+    conn.executemany(INSERT_SQL, rows)
+    conn.commit()
+    conn.close()
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="掲示板の投稿レイヤーのベンチマーク")
+    parser.add_argument("--size", type=int, default=300, help="grid の 1 辺のノード数")
+    parser.add_argument("--reports", type=int, default=50_000)
+    parser.add_argument("--new", type=int, default=20, help="差分で反映する新しい投稿の数")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    G = grid_graph(args.size)
+    area = AreaGraph("bench", ox.project_graph(G), G)
+    print(f"graph: {area.n_edges} edges")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        auth_db.DB_PATH = str(Path(tmp) / "users.db")
+        auth_db.init_db()
+        seed(area, args.reports, rng)
+
+        signal = ReportSignal(sync_interval=0)
+        n, ms = timed(lambda: signal.sync(force=True))
+        print(f"初回の読み込み: {n} reports, {ms:.0f} ms")
+        _, ms = timed(lambda: signal.edge_adjust(area))
+        print(f"エリアの初回（中点の木 + 全投稿の配分）: {ms:.0f} ms")
+        times = [timed(lambda: signal.edge_adjust(area))[1] for _ in range(5)]
+        print(f"検索ごと（変更なし）: {np.median(times):.1f} ms")
+
+        south, west, north, east = area.bounds()
+        user = {"id": 1, "username": "bench"}
+        times = []
+        for i in range(args.new):
+            lat, lon = rng.uniform(south, north), rng.uniform(west, east)
+            auth_db.save_report(user, "暗くて怖い", "", lat, lon, tags="街灯なし,人通り少ない", polarity="悪い方向")
+            _, ms = timed(lambda: signal.edge_adjust(area))
+            times.append(ms)
+        print(f"新しい投稿 1 件ごと（差分の読み込み + 周りのエッジだけ更新 + 検索）: median {np.median(times):.1f} ms")
+        # 削除と判定の付け直しも差分で反映される
+        conn = sqlite3.connect(auth_db.DB_PATH)
+        conn.execute("DELETE FROM reports WHERE id % 97 = 0")
+        conn.execute("UPDATE reports SET polarity = '良い方向' WHERE id % 89 = 0")
+        conn.commit()
+        conn.close()
+        n, ms = timed(lambda: signal.sync(force=True))
+        print(f"削除・変更 {n} 件の反映: {ms:.0f} ms")
+
+        incremental = signal.edge_adjust(area)
+        fresh = ReportSignal(sync_interval=0)
+        rebuilt, ms = timed(lambda: fresh.edge_adjust(area))
+        print(f"全部作り直す場合: {ms:.0f} ms")
+        print(f"差分と作り直しの結果が一致: {np.allclose(incremental, rebuilt, atol=1e-6)}"
+              f"（加減点のあるエッジ {int(np.count_nonzero(rebuilt))} 本）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# benchmarks/bench_search.py
+# 投稿の全文検索（FTS5 trigram）の速度
+#
+#   python benchmarks/bench_search.py                      # 20 万件
+#   python benchmarks/bench_search.py --reports 1000000
+#
+# 語の長さ（trigram で引ける 3 文字以上か）、範囲・期間の絞り込みの組み合わせごとに中央値を表示する。
+# 比較として、全件を読んで Python で部分一致を探す場合も測る。
+# 最後にタグ集計（集計表の読み出し）と、全件を読んでタグを数える場合を比べる。
+import argparse
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+
+import auth_db  # noqa: E402
+from bench_report_map import CENTER, INSERT_SQL, viewport  # noqa: E402
+
+PHRASES = [
+    "この道は暗くて怖かった", "街灯が少ない", "人通りが少なく危険", "コンビニがあって安心", "見通しが悪い角",
+    "公園の横は夜になると真っ暗", "駅前は明るい", "歩道が狭い", "不審者を見かけた", "自転車が多い",
+]
+TAGS = ["暗い", "明るい", "街灯あり", "街灯なし", "人通り少ない", "歩道なし", "深夜に危険", "駐輪場暗い"]
+WARDS = ["大宮区", "浦和区", "南区", "北区", "見沼区", "中央区", "桜区", "緑区", "岩槻区", "西区"]
+
+QUERIES = [
+    ("3文字以上", "人通り", {}),
+    ("3文字以上 x2", "公園 真っ暗", {}),
+    ("2文字", "暗い", {}),
+    ("3文字 + 範囲", "人通り", {"bbox": True}),
+    ("2文字 + 範囲", "暗い", {"bbox": True}),
+    ("3文字 + 7日", "不審者", {"since": 7}),
+    ("住所", "見沼区", {}),
+]
+
+
+def seed(n, rng):
+    start = datetime.utcnow() - timedelta(days=365)
+    pts = CENTER + rng.normal(0, 0.1, size=(n, 2))
+    rows = []
+    for i in range(n):
+        text = "。".join(PHRASES[j] for j in rng.choice(len(PHRASES), 2, replace=False))
+        tags = ",".join(TAGS[j] for j in rng.choice(len(TAGS), 2, replace=False))
+        address = f"さいたま市{WARDS[i % len(WARDS)]}{i % 97}丁目"
+        created = (start + timedelta(seconds=int(rng.integers(0, 365 * 86400)))).isoformat()
+        rows.append((1, "bench", text, address, float(pts[i, 0]), float(pts[i, 1]), "コメントとタグ", tags, None, None, created))
+    conn = sqlite3.connect(auth_db.DB_PATH)
+    conn.executemany(INSERT_SQL, rows)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投稿の全文検索ベンチマーク")
+    parser.add_argument("--reports", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        auth_db.DB_PATH = str(Path(tmp) / "users.db")
+        auth_db.init_db()
+        t0 = time.perf_counter()
+        seed(args.reports, rng)
+        print(f"seeded {args.reports} reports ({time.perf_counter() - t0:.1f}s, 索引はトリガーで同時に更新)")
+        t0 = time.perf_counter()
+        auth_db.rebuild_search_index()
+        print(f"reindex: {time.perf_counter() - t0:.1f}s")
+        t0 = time.perf_counter()
+        auth_db.migrate_tags()
+        print(f"migrate-tags: {time.perf_counter() - t0:.1f}s")
+
+        t0 = time.perf_counter()
+        hits = [r for r in auth_db.load_reports() if "人通り" in (r["text"] or "")][:50]
+        print(f"全件読み込み + Python で部分一致: {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+        bbox = viewport(CENTER, 14)
+        since = (datetime.utcnow() - timedelta(days=7)).isoformat()
+        print(f"{'case':<16}{'query':<14}{'hits':>6}{'ms':>9}")
+        for label, query, opts in QUERIES:
+            kwargs = {}
+            if opts.get("bbox"):
+                kwargs["bbox"] = bbox
+            if opts.get("since"):
+                kwargs["since"] = since
+            times = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                hits = auth_db.search_reports(query, **kwargs)
+                times.append(time.perf_counter() - t0)
+            print(f"{label:<16}{query:<14}{len(hits):>6}{np.median(times) * 1000:>9.1f}")
+
+        t0 = time.perf_counter()
+        counts = Counter(
+            t for r in auth_db.load_reports() if "浦和区" in (r["address"] or "")
+            for t in auth_db.split_tags(r["tags"])
+        )
+        print(f"タグ集計 全件読み込み + Python: {(time.perf_counter() - t0) * 1000:.0f} ms ({len(counts)} tags)")
+        for label, fn in [
+            ("tag_counts()", lambda: auth_db.tag_counts()),
+            ("tag_counts(area, 30日)", lambda: auth_db.tag_counts(area="浦和区", days=30)),
+            ("tag_area_counts(tag)", lambda: auth_db.tag_area_counts("街灯なし")),
+            ("tag_cell_counts(bbox)", lambda: auth_db.tag_cell_counts(["暗い", "街灯なし"], 90, bbox)),
+        ]:
+            times = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                rows = fn()
+                times.append(time.perf_counter() - t0)
+            print(f"{label:<30}{len(rows):>6}{np.median(times) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
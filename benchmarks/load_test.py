@@ -0,0 +1,229 @@
+# benchmarks/load_test.py
+# ルート検索と掲示板（閲覧・投稿）を混ぜた同時アクセスの負荷試験
+# Overpass / Nominatim はローカルスタブ（stub_osm.py）、DB は一時ディレクトリの SQLite を使う。
+#
+#   python benchmarks/load_test.py --users 16 --duration 30
+#   python benchmarks/load_test.py --users 32 --mix route=1,read=8,post=2 --od hotspot --stub-latency 0.2
+#   python benchmarks/load_test.py --od-csv od.csv   # origin,destination 列（住所は「地点 <番号>」）
+#
+# 1 プロセスに RoutingEngine を 1 つ置き（Streamlit の st.cache_resource と同じ）、ユーザーはスレッドで模擬する。
+# 操作ごとのスループット・p50/p95/p99 レイテンシ・エラー率を表示する。
+import argparse
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import auth_db  # noqa: E402
+import metrics  # noqa: E402
+from polarity import detect_polarity  # noqa: E402
+from routing_engine import RoutingEngine  # noqa: E402
+from stub_osm import PLACE_NAME, StubOSM, address  # noqa: E402
+from synthetic import grid_graph, planar_graph, point_cloud  # noqa: E402
+
+REPORT_TEXTS = [
+    ("この道は暗くて怖かった", "暗い,人通り少ない"),
+    ("街灯が多くて明るい", "明るい,街灯あり"),
+    ("夜は人通りが少なく危険", "夜は少ない,深夜に危険"),
+    ("コンビニがあって安心", "明るい"),
+    ("", "歩道なし,狭い"),
+]
+
+
+# -----------------------
+# --- 準備 ---
+# -----------------------
+def seed_db(n_users, n_reports, stub, rng):
+    users = []
+    for i in range(n_users):
+        name, password = f"loaduser{i}", f"password{i}"
+        auth_db.signup(name, f"{name}@example.com", password)
+        users.append(auth_db.login(name, password))
+    for _ in range(n_reports):
+        post_report(rng.choice(users), stub, rng)
+    return users
+
+
+def post_report(user, stub, rng):
+    i = rng.randrange(len(stub.nodes))
+    text, tags = rng.choice(REPORT_TEXTS)
+    return auth_db.save_report(
+        user, text, address(i), float(stub.lat[i]), float(stub.lon[i]),
+        post_type="コメントとタグ", tags=tags, polarity=detect_polarity(text, tags),
+    )
+
+
+# -----------------------
+# --- OD 分布 ---
+# -----------------------
+def od_sampler(kind, n_nodes, od_csv=None, hubs=8, seed=0):
+    rng = np.random.default_rng(seed)
+    if od_csv:
+        df = pd.read_csv(od_csv)
+        pairs = list(zip(df["origin"], df["destination"]))
+        return lambda r: r.choice(pairs)
+    if kind == "uniform":
+        return lambda r: (address(r.randrange(n_nodes)), address(r.randrange(n_nodes)))
+    # hotspot: 駅のような少数の拠点に発着が集中する（拠点の人気は Zipf 分布）
+    hub_nodes = rng.choice(n_nodes, hubs, replace=False).tolist()
+    weights = [1 / (k + 1) for k in range(hubs)]
+
+    def sample(r):
+        def endpoint():
+            if r.random() < 0.7:
+                return address(r.choices(hub_nodes, weights)[0])
+            return address(r.randrange(n_nodes))
+        return endpoint(), endpoint()
+
+    return sample
+
+
+# -----------------------
+# --- 負荷生成 ---
+# -----------------------
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, op, sec, error=None):
+        with self._lock:
+            self.latencies[op].append(sec)
+            if error:
+                self.errors[op][error] += 1
+
+
+def run_user(ops, weights, deadline, think, recorder, seed):
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        op = rng.choices(list(ops), weights)[0]
+        t0 = time.perf_counter()
+        error = None
+        try:
+            ops[op](rng)
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)[:60]}"
+        recorder.record(op, time.perf_counter() - t0, error)
+        if think:
+            time.sleep(rng.expovariate(1 / think))
+
+
+def summarize(recorder, elapsed):
+    rows = {}
+    for op, values in sorted(recorder.latencies.items()):
+        ms = np.array(values) * 1000
+        n_err = sum(recorder.errors[op].values())
+        rows[op] = {
+            "count": len(values),
+            "ops_per_s": round(len(values) / elapsed, 2),
+            "error_rate": round(n_err / len(values), 4),
+            "p50_ms": round(float(np.percentile(ms, 50)), 1),
+            "p95_ms": round(float(np.percentile(ms, 95)), 1),
+            "p99_ms": round(float(np.percentile(ms, 99)), 1),
+            "max_ms": round(float(ms.max()), 1),
+            "errors": dict(recorder.errors[op]),
+        }
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ルート検索 + 掲示板の負荷試験（スタブ使用）")
+    parser.add_argument("--users", type=int, default=8, help="同時ユーザー数（スレッド）")
+    parser.add_argument("--duration", type=float, default=20, help="計測時間（秒）")
+    parser.add_argument("--mix", default="route=2,read=6,post=1", help="操作の比率")
+    parser.add_argument("--think", type=float, default=0.0, help="操作間の平均待ち時間（秒）")
+    parser.add_argument("--od", choices=("uniform", "hotspot"), default="hotspot")
+    parser.add_argument("--od-csv", default=None)
+    parser.add_argument("--graph", choices=("grid", "planar"), default="grid")
+    parser.add_argument("--size", type=int, default=60, help="grid は 1 辺のノード数、planar はノード数")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="スタブ API の応答遅延（秒）")
+    parser.add_argument("--seed-reports", type=int, default=500, help="開始時の投稿数")
+    parser.add_argument("--accounts", type=int, default=8, help="投稿に使うアカウント数")
+    parser.add_argument("--json", default=None, help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    mix = {k: float(v) for k, v in (item.split("=") for item in args.mix.split(","))}
+    G = grid_graph(args.size) if args.graph == "grid" else planar_graph(args.size)
+    stub = StubOSM(G, latency=args.stub_latency).start()
+    stub.install()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        auth_db.DB_PATH = str(tmp / "users.db")
+        auth_db.init_db()
+        crime_csv = tmp / "crime.csv"
+        pd.DataFrame(point_cloud(G, max(300, len(stub.nodes) // 10)), columns=["lat", "lon"]).to_csv(crime_csv, index=False)
+
+        rng = random.Random(0)
+        print(f"seeding {args.accounts} accounts / {args.seed_reports} reports ...", file=sys.stderr)
+        accounts = seed_db(args.accounts, args.seed_reports, stub, rng)
+
+        engine = RoutingEngine(crime_csv=crime_csv)
+        t0 = time.perf_counter()
+        engine.area(PLACE_NAME)
+        cold = time.perf_counter() - t0
+        print(f"graph cold load {cold:.2f}s ({len(stub.nodes)} nodes)", file=sys.stderr)
+
+        sample_od = od_sampler(args.od, len(stub.nodes), args.od_csv)
+        ops = {
+            "route": lambda r: engine.search(*sample_od(r), PLACE_NAME),
+            "read": lambda r: auth_db.load_reports_page(),
+            "post": lambda r: post_report(r.choice(accounts), stub, r),
+        }
+        ops = {k: v for k, v in ops.items() if mix.get(k, 0) > 0}
+        weights = [mix[k] for k in ops]
+
+        recorder = Recorder()
+        deadline = time.perf_counter() + args.duration
+        threads = [
+            threading.Thread(target=run_user, args=(ops, weights, deadline, args.think, recorder, i))
+            for i in range(args.users)
+        ]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        n_reports = len(auth_db.load_reports())
+        db_writer = auth_db.writer_stats()
+
+    stub.stop()
+    rows = summarize(recorder, elapsed)
+    total = sum(r["count"] for r in rows.values())
+    print(f"users={args.users} duration={elapsed:.1f}s total={total} ({total / elapsed:.1f} ops/s) reports={n_reports}")
+    print(f"{'op':<8}{'count':>8}{'ops/s':>9}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for op, r in rows.items():
+        print(f"{op:<8}{r['count']:>8}{r['ops_per_s']:>9.2f}{r['error_rate'] * 100:>7.1f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}")
+        for error, n in r["errors"].items():
+            print(f"{'':<8}{n:>8}  {error}")
+    counters = metrics.snapshot()["counters"]
+    print("caches:", {k: v for k, v in sorted(counters.items()) if "cache" in k})
+    print("stub requests:", stub.requests)
+    print("db writer:", db_writer)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "args": vars(args),
+            "cold_load_s": round(cold, 3),
+            "elapsed_s": round(elapsed, 3),
+            "ops": rows,
+            "counters": counters,
+            "stub_requests": stub.requests,
+            "db_writer": db_writer,
+        }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# benchmarks/stub_osm.py
+# 負荷試験用のローカル Overpass / Nominatim スタブ
+# 合成グラフ（synthetic.py）を OSM の JSON 形式で返すので、osmnx と routing_engine をそのまま通せる。
+#
+#   stub = StubOSM(grid_graph(60), latency=0.05).start()
+#   stub.install()   # osmnx / routing_engine の接続先をスタブに向ける
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote_plus, urlparse
+
+import numpy as np
+
+from synthetic import bounds, synthetic_pois
+
+BBOX_RE = re.compile(r"\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)")
+POLY_RE = re.compile(r'poly:"([-\d. ]+)"')
+PLACE_NAME = "合成市, 埼玉, Japan"
+
+
+def address(node):
+    # スタブのジオコーダが解決できる住所表記
+    return f"地点 {node}"
+
+
+class StubOSM:
+    def __init__(self, G, latency=0.0, pois=None, seed=0):
+        self.G = G
+        self.latency = latency
+        self.nodes = list(G.nodes)
+        self.lat = np.array([G.nodes[n]["y"] for n in self.nodes])
+        self.lon = np.array([G.nodes[n]["x"] for n in self.nodes])
+        n = len(self.nodes)
+        self.pois = pois or synthetic_pois(G, n // 4, n // 100 + 5, n // 1000 + 3, seed=seed + 2)
+        self.requests = {"overpass": 0, "nominatim": 0}
+        self._lock = threading.Lock()
+        self._graph_body = self._graph_elements(np.ones(len(self.nodes), dtype=bool))
+        self.server = None
+
+    # --- レスポンス ---
+    def _graph_elements(self, inside):
+        # inside のノードに触れる way と、その両端のノードを返す（Overpass の way(poly) と同じ）
+        index = {n: i for i, n in enumerate(self.nodes)}
+        seen, ways, used = set(), [], set()
+        for u, v in self.G.edges():
+            key = (min(u, v), max(u, v))
+            if key in seen:
+                continue
+            seen.add(key)
+            if inside[index[u]] or inside[index[v]]:
+                used.update((index[u], index[v]))
+                ways.append({
+                    "type": "way",
+                    "id": len(seen),
+                    "nodes": [index[u] + 1, index[v] + 1],
+                    "tags": {"highway": "footway"},
+                })
+        elements = [
+            {"type": "node", "id": i + 1, "lat": float(self.lat[i]), "lon": float(self.lon[i])}
+            for i in sorted(used)
+        ]
+        return json.dumps({"elements": elements + ways}).encode("utf-8")
+
+    def _poi_elements(self, query):
+        if "street_lamp" in query:
+            points = self.pois["street_lamps"]
+        elif "convenience" in query:
+            points = self.pois["convenience_stores"]
+        elif "police" in query:
+            points = self.pois["kobans"]
+        else:
+            points = []
+        m = BBOX_RE.search(query)
+        if m:
+            south, west, north, east = map(float, m.groups())
+            points = [p for p in points if south <= p[0] <= north and west <= p[1] <= east]
+        elements = [
+            {"type": "node", "id": i + 1, "lat": lat, "lon": lon, "tags": tags}
+            for i, (lat, lon, tags) in enumerate(points)
+        ]
+        return json.dumps({"elements": elements}, ensure_ascii=False).encode("utf-8")
+
+    def overpass(self, query):
+        if "highway" in query and "street_lamp" not in query:
+            m = POLY_RE.search(query)
+            if not m:
+                return self._graph_body
+            coords = np.array(m.group(1).split(), dtype=np.float64).reshape(-1, 2)
+            south, west = coords.min(axis=0)
+            north, east = coords.max(axis=0)
+            inside = (self.lat >= south) & (self.lat <= north) & (self.lon >= west) & (self.lon <= east)
+            return self._graph_elements(inside)
+        return self._poi_elements(query)
+
+    def nominatim(self, params):
+        q = params.get("q", [""])[0]
+        south, west, north, east = bounds(self.G)
+        pad = 0.001
+        south, west, north, east = south - pad, west - pad, north + pad, east + pad
+        if "polygon_geojson" in params:
+            ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+            result = {
+                "place_id": 1, "osm_type": "relation", "osm_id": 1,
+                "lat": str((south + north) / 2), "lon": str((west + east) / 2),
+                "boundingbox": [str(south), str(north), str(west), str(east)],
+                "class": "boundary", "type": "administrative", "place_rank": 16,
+                "importance": 1.0, "display_name": q,
+                "geojson": {"type": "Polygon", "coordinates": [ring]},
+            }
+            return json.dumps([result], ensure_ascii=False).encode("utf-8")
+        m = re.match(r"地点 (\d+)", q)
+        i = int(m.group(1)) if m else zlib.crc32(q.encode("utf-8"))
+        i %= len(self.nodes)
+        result = {"lat": str(self.lat[i]), "lon": str(self.lon[i]), "display_name": q, "importance": 0.5}
+        return json.dumps([result], ensure_ascii=False).encode("utf-8")
+
+    # --- サーバー ---
+    def start(self, host="127.0.0.1", port=0):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, body):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.endswith("/search"):
+                    with stub._lock:
+                        stub.requests["nominatim"] += 1
+                    self._reply(stub.nominatim(parse_qs(url.query)))
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                # osmnx はフォーム（data=...）、routing_engine はクエリ本文をそのまま送る
+                query = unquote_plus(raw[5:]) if raw.startswith("data=") else raw
+                with stub._lock:
+                    stub.requests["overpass"] += 1
+                self._reply(stub.overpass(query))
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def install(self):
+        import osmnx as ox
+
+        import routing_engine
+
+        ox.settings.overpass_url = f"{self.url}/api"
+        ox.settings.nominatim_url = f"{self.url}/"
+        ox.settings.overpass_rate_limit = False
+        ox.settings.use_cache = False
+        ox.settings.log_console = False
+        routing_engine.OVERPASS_URLS = [f"{self.url}/api/interpreter"]
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,89 @@
+# benchmarks/synthetic.py
+# ネットワークに繋がずに使える合成データ（歩行者グラフ・犯罪点・POI）
+# 座標はさいたま市付近の緯度経度。乱数は seed 固定なので毎回同じデータになる。
+import networkx as nx
+import numpy as np
+from scipy.spatial import Delaunay
+
+CENTER = (35.906, 139.624)
+# 緯度・経度 1 度あたりのおおよその距離 (m)
+M_PER_DEG_LAT = 110_950.0
+M_PER_DEG_LON = 90_180.0
+
+
+def _to_latlon(x, y):
+    lat = CENTER[0] + np.asarray(y) / M_PER_DEG_LAT
+    lon = CENTER[1] + np.asarray(x) / M_PER_DEG_LON
+    return lat, lon
+
+
+def _graph(lat, lon, pairs, seed):
+    # 双方向の MultiDiGraph（osmnx の walk グラフと同じ形）を作る
+    rng = np.random.default_rng(seed)
+    G = nx.MultiDiGraph(crs="EPSG:4326")
+    for i in range(len(lat)):
+        G.add_node(i, y=float(lat[i]), x=float(lon[i]))
+    dy = (lat[pairs[:, 0]] - lat[pairs[:, 1]]) * M_PER_DEG_LAT
+    dx = (lon[pairs[:, 0]] - lon[pairs[:, 1]]) * M_PER_DEG_LON
+    # 実際の道路は直線より少し長い
+    length = np.hypot(dx, dy) * rng.uniform(1.0, 1.15, len(pairs))
+    for (u, v), ln in zip(pairs.tolist(), length.tolist()):
+        G.add_edge(u, v, length=ln)
+        G.add_edge(v, u, length=ln)
+    return G
+
+
+def grid_graph(n_side, step=80.0, jitter=8.0, seed=0):
+    rng = np.random.default_rng(seed)
+    ij = np.indices((n_side, n_side)).reshape(2, -1).T
+    x = ij[:, 0] * step + rng.normal(0, jitter, len(ij))
+    y = ij[:, 1] * step + rng.normal(0, jitter, len(ij))
+    idx = np.arange(n_side * n_side).reshape(n_side, n_side)
+    pairs = np.concatenate([
+        np.column_stack([idx[:-1, :].ravel(), idx[1:, :].ravel()]),
+        np.column_stack([idx[:, :-1].ravel(), idx[:, 1:].ravel()]),
+    ])
+    lat, lon = _to_latlon(x - x.mean(), y - y.mean())
+    return _graph(lat, lon, pairs, seed)
+
+
+def planar_graph(n_nodes, density=150.0, seed=0):
+    # ランダム点の Delaunay 三角形分割から長すぎる辺を除いた平面グラフ
+    rng = np.random.default_rng(seed)
+    side = np.sqrt(n_nodes) * density / np.sqrt(2)
+    pts = rng.uniform(-side / 2, side / 2, (n_nodes, 2))
+    tri = Delaunay(pts)
+    s = tri.simplices
+    pairs = np.concatenate([s[:, [0, 1]], s[:, [1, 2]], s[:, [0, 2]]])
+    pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+    d = np.hypot(*(pts[pairs[:, 0]] - pts[pairs[:, 1]]).T)
+    pairs = pairs[d < np.percentile(d, 90)]
+    lat, lon = _to_latlon(pts[:, 0], pts[:, 1])
+    return _graph(lat, lon, pairs, seed)
+
+
+def bounds(G):
+    lat = np.array([d["y"] for _, d in G.nodes(data=True)])
+    lon = np.array([d["x"] for _, d in G.nodes(data=True)])
+    return lat.min(), lon.min(), lat.max(), lon.max()
+
+
+def point_cloud(G, n, clusters=20, spread=0.002, seed=1):
+    # 繁華街のような塊をいくつか持つ点群 [(lat, lon), ...]
+    rng = np.random.default_rng(seed)
+    south, west, north, east = bounds(G)
+    centers = np.column_stack([rng.uniform(south, north, clusters), rng.uniform(west, east, clusters)])
+    which = rng.integers(0, clusters, n)
+    pts = centers[which] + rng.normal(0, spread, (n, 2))
+    return [tuple(p) for p in pts.tolist()]
+
+
+def synthetic_pois(G, n_lamps, n_stores, n_kobans, seed=2):
+    def with_tags(points, tags):
+        return [(lat, lon, tags) for lat, lon in points]
+
+    return {
+        "street_lamps": with_tags(point_cloud(G, n_lamps, 60, 0.003, seed), {"highway": "street_lamp"}),
+        "convenience_stores": with_tags(point_cloud(G, n_stores, 30, 0.004, seed + 1), {"name": "コンビニ"}),
+        "kobans": with_tags(point_cloud(G, n_kobans, 10, 0.005, seed + 2), {"name": "交番"}),
+    }
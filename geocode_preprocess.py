@@ -1,18 +1,31 @@
 import pandas as pd
 import osmnx as ox
-import glob
+import hashlib
+import json
+import logging
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data/"
+OUT_PATH = DATA_DIR / "crime_geocoded.csv"
+# 元データ CSV ごとの内容ハッシュ（変わったファイルがあるときだけ作り直す）
+MANIFEST_PATH = DATA_DIR / "crime_sources.json"
 
-results = []
+# アプリの定期更新から毎回呼ばれるので、変更なし・進捗は debug にする
+logger = logging.getLogger("nightwalk.crime")
 
-csv_files = glob.glob(str(DATA_DIR / "*.csv"))
 
-for csv_path in csv_files:
-    print(f"processing: {csv_path}")
+def file_hash(path):
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest()[:12]
 
+
+def source_files(data_dir=DATA_DIR):
+    out_name = OUT_PATH.name
+    return sorted(p for p in Path(data_dir).glob("*.csv") if p.name != out_name)
+
+
+def read_addresses(csv_path):
     df = None
     for enc in ("utf-8", "shift_jis", "cp932"):
         try:
@@ -22,33 +35,72 @@ for csv_path in csv_files:
             pass
 
     if df is None:
-        print("  -> encoding error, skip")
-        continue
+        logger.warning("%s: encoding error, skip", csv_path)
+        return None
 
     if "市区町村（発生地）" not in df.columns or "町丁目（発生地）" not in df.columns:
-        print("  -> invalid columns, skip")
-        continue
+        logger.warning("%s: invalid columns, skip", csv_path)
+        return None
 
     df["address"] = (
         df["市区町村（発生地）"].astype(str)
         + df["町丁目（発生地）"].astype(str)
     )
+    return list(df["address"].dropna().unique())
 
-    for address in df["address"].dropna().unique():
-        try:
-            lat, lon = ox.geocode(address)
+
+def refresh_crime_csv(data_dir=DATA_DIR, out_path=OUT_PATH, manifest_path=MANIFEST_PATH, geocode=ox.geocode):
+    # 元データが変わっていなければ何もしない。変わっていれば、新しい住所だけをジオコードする
+    sources = {p.name: file_hash(p) for p in source_files(data_dir)}
+    manifest_path = Path(manifest_path)
+    out_path = Path(out_path)
+    old = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    if old == sources and out_path.exists():
+        logger.debug("変更なし")
+        return False
+
+    # 既存の結果を住所 → 座標のキャッシュとして使う
+    known = {}
+    if out_path.exists():
+        prev = pd.read_csv(out_path)
+        known = {a: (lat, lon) for a, lat, lon in zip(prev["address"], prev["lat"], prev["lon"])}
+
+    results = []
+    seen = set()
+    for name in sources:
+        logger.debug("processing: %s%s", name, "" if old.get(name) == sources[name] else " (new/changed)")
+        addresses = read_addresses(Path(data_dir) / name)
+        if addresses is None:
+            continue
+        for address in addresses:
+            if address in seen:
+                continue
+            seen.add(address)
+            if address not in known:
+                try:
+                    known[address] = geocode(address)
+                except Exception:
+                    continue
+            lat, lon = known[address]
             results.append({
                 "address": address,
                 "lat": lat,
                 "lon": lon
             })
-        except Exception:
-            continue
 
-# 重複除去
-out_df = pd.DataFrame(results).drop_duplicates(subset=["address"])
+    # 途中で読まれても壊れたファイルが見えないよう、書き終えてから置き換える
+    tmp = out_path.with_suffix(".csv.tmp")
+    pd.DataFrame(results, columns=["address", "lat", "lon"]).to_csv(tmp, index=False)
+    os.replace(tmp, out_path)
+    tmp = manifest_path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(sources, indent=2, ensure_ascii=False))
+    os.replace(tmp, manifest_path)
+
+    logger.info("saved: %s (%d addresses)", out_path, len(results))
+    return True
 
-out_path = DATA_DIR / "crime_geocoded.csv"
-out_df.to_csv(out_path, index=False)
 
-print(f"saved: {out_path}")
+if __name__ == "__main__":
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(logging.DEBUG)
+    refresh_crime_csv()
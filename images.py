@@ -0,0 +1,122 @@
+# images.py
+# 掲示板の投稿画像: 内容ハッシュで重複を除いて保存し、一覧用のサムネイルを作る
+#
+#   python images.py backfill   # サムネイルのない既存の画像（uploads/ 以下）にまとめて作る
+#
+# 元画像は uploads/<sha256 先頭 20 桁>.<拡張子>、サムネイルは static/thumbs/<同じ名前>.webp。
+# static/ は Streamlit の静的配信（.streamlit/config.toml の enableStaticServing）で
+# app/static/thumbs/... として配信されるので、一覧では <img loading="lazy"> で遅延読み込みできる。
+import argparse
+import hashlib
+import io
+from pathlib import Path
+
+from PIL import Image, ImageOps, features
+
+from auth_db import UPLOAD_DIR
+
+BASE_DIR = Path(__file__).parent
+THUMB_DIR = BASE_DIR / "static" / "thumbs"
+THUMB_URL = "app/static/thumbs"
+THUMB_PX = 480
+THUMB_QUALITY = 70
+# WebP を書けない Pillow なら JPEG
+THUMB_EXT = ".webp" if features.check("webp") else ".jpg"
+ALLOWED_FORMATS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp", "GIF": ".gif"}
+# これより大きい画像は受け付けない（展開後のピクセル数）
+MAX_PIXELS = 40_000_000
+
+
+def content_name(data):
+    return hashlib.sha256(data).hexdigest()[:20]
+
+
+def open_image(data):
+    # 壊れたファイルや画像でないファイルは ValueError
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.verify()
+        img = Image.open(io.BytesIO(data))
+    except Exception as e:
+        raise ValueError(f"画像として読み込めません: {e}")
+    if img.format not in ALLOWED_FORMATS:
+        raise ValueError(f"対応していない画像形式です: {img.format}")
+    if img.width * img.height > MAX_PIXELS:
+        raise ValueError("画像が大きすぎます")
+    return img
+
+
+def make_thumbnail(img, out_path):
+    # スマホ写真の向き（EXIF）を反映し、長辺 THUMB_PX に縮小する
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((THUMB_PX, THUMB_PX), Image.LANCZOS)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+    if THUMB_EXT == ".jpg" and img.mode == "RGBA":
+        img = img.convert("RGB")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    img.save(tmp, format="WEBP" if THUMB_EXT == ".webp" else "JPEG", quality=THUMB_QUALITY, method=4)
+    tmp.replace(out_path)
+    return out_path
+
+
+def local_path(image_path):
+    # Windows で保存された投稿は uploads\xxx.png の形で入っている
+    return Path(str(image_path).replace("\\", "/"))
+
+
+def thumbnail_path(image_path):
+    return THUMB_DIR / (local_path(image_path).stem + THUMB_EXT)
+
+
+def store_upload(data):
+    # 保存した元画像のパスを返す。同じ内容の画像が既にあれば、それを使う
+    img = open_image(data)
+    name = content_name(data)
+    path = UPLOAD_DIR / (name + ALLOWED_FORMATS[img.format])
+    if not path.exists():
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+    thumb = thumbnail_path(path)
+    if not thumb.exists():
+        make_thumbnail(img, thumb)
+    return str(path)
+
+
+def ensure_thumbnail(image_path):
+    # 一覧表示用。サムネイルがなければ作る（以前の uuid 名の画像も含む）。作れなければ None
+    thumb = thumbnail_path(image_path)
+    if thumb.exists():
+        return thumb
+    try:
+        with Image.open(local_path(image_path)) as img:
+            return make_thumbnail(img, thumb)
+    except Exception:
+        return None
+
+
+def thumbnail_url(image_path):
+    thumb = ensure_thumbnail(image_path)
+    return f"{THUMB_URL}/{thumb.name}" if thumb else None
+
+
+def backfill(upload_dir=UPLOAD_DIR):
+    made = skipped = 0
+    for path in sorted(Path(upload_dir).iterdir()):
+        if path.suffix.lower() not in set(ALLOWED_FORMATS.values()) | {".jpeg"}:
+            continue
+        if thumbnail_path(path).exists():
+            skipped += 1
+        elif ensure_thumbnail(path):
+            made += 1
+    return made, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="投稿画像のサムネイル")
+    parser.add_argument("command", choices=["backfill"])
+    args = parser.parse_args()
+    made, skipped = backfill()
+    print(f"created {made} thumbnails ({skipped} already existed)")
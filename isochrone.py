@@ -0,0 +1,55 @@
+# isochrone.py
+# 安全到達圏：出発地から safety_cost の予算内で歩けるエッジを求める
+# 複数の予算を 1 回の探索（上限 = 最大予算）でまとめて計算する。
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from metrics import span
+
+BAND_COLORS = ["#1a9850", "#91cf60", "#fee08b", "#fc8d59", "#d73027"]
+
+
+def compute_isochrone(engine, origin, place, budgets, with_pois=True):
+    budgets = sorted(float(b) for b in budgets if float(b) > 0)
+    if not budgets:
+        raise ValueError("予算を 1 つ以上指定してください")
+    origin_latlon = engine.resolve(origin)
+    # place が無ければ最大予算ぶんの範囲のタイルを読む（コストは長さ以下にもなるので端で切れることがある）
+    area = engine.coverage([origin_latlon], place, pad=budgets[-1])
+    costs, warnings = engine.area_costs(area.place, with_pois=with_pois)
+    src = area.nearest_node(origin_latlon)
+
+    with span("isochrone.search", budget=budgets[-1]) as sp:
+        dist = dijkstra(area.csr(costs), directed=True, indices=src, limit=budgets[-1])
+        sp.set(reached=int(np.isfinite(dist).sum()))
+    # エッジの終点まで予算内に収まるものを到達可能とし、収まる最小の予算帯に振り分ける
+    reach = dist[area.edge_u] + costs
+    band = np.searchsorted(np.array(budgets), reach, side="left")
+    band[~np.isfinite(reach)] = len(budgets)
+    return {
+        "origin": origin_latlon,
+        "budgets": budgets,
+        "edge_band": band,
+        "area": area,
+        "warnings": warnings,
+    }
+
+
+def isochrone_geojson(iso, precision=5):
+    # 予算帯ごとに 1 つの MultiLineString にまとめ、座標は丸めてペイロードを抑える
+    area = iso["area"]
+    features = []
+    for i, budget in enumerate(iso["budgets"]):
+        edges = area.one_way_edges(np.flatnonzero(iso["edge_band"] == i))
+        if len(edges) == 0:
+            continue
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "MultiLineString", "coordinates": area.edge_lines(edges, precision)},
+            "properties": {
+                "budget": budget,
+                "edges": int(len(edges)),
+                "color": BAND_COLORS[min(i, len(BAND_COLORS) - 1)],
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
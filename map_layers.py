@@ -0,0 +1,151 @@
+# map_layers.py
+# 街灯・コンビニ・交番をブラウザ側で描画するレイヤー
+# Python 側ではマーカーを 1 つずつ作らず、[lat, lon, ラベル番号] の配列とラベル表だけを送る。
+# ポップアップの中身はクリックされたときに JS 側で組み立てる。
+import html
+import json
+
+import folium
+from folium.plugins import FastMarkerCluster
+
+import auth_db
+
+COORD_PRECISION = 6
+
+CLUSTER_OPTIONS = {"chunkedLoading": True, "maxClusterRadius": 50}
+
+# 掲示板の投稿: 表示範囲内がこの件数以下なら 1 件ずつ、超えたらサーバー側でセルに集計して送る
+REPORT_MAX_MARKERS = 500
+REPORT_CELL_PX = 48
+
+
+def lamp_label(tags):
+    if not tags:
+        return "街灯"
+    return ", ".join(f"{k}: {v}" for k, v in tags.items())
+
+
+def store_label(tags):
+    return f"{tags.get('name', 'コンビニ')} {tags.get('brand', '')}".strip()
+
+
+def koban_label(tags):
+    return tags.get("name", "交番")
+
+
+def compact_rows(points, label_fn):
+    # 同じラベルは 1 回だけ送る（街灯のタグはほとんど同じ）
+    labels, index, rows = [], {}, []
+    for lat, lon, tags in points:
+        label = html.escape(label_fn(tags))
+        i = index.get(label)
+        if i is None:
+            i = index[label] = len(labels)
+            labels.append(label)
+        rows.append([round(lat, COORD_PRECISION), round(lon, COORD_PRECISION), i])
+    return rows, labels
+
+
+def _callback(labels, make_marker):
+    # FastMarkerCluster の callback にクロージャを渡し、ラベル表は 1 回だけ評価させる
+    return """(function () {
+        var labels = %s;
+        var renderer = L.canvas({padding: 0.5});
+        return function (row) {
+            var marker = %s;
+            marker.bindPopup(function () { return labels[row[2]]; });
+            return marker;
+        };
+    })()""" % (json.dumps(labels, ensure_ascii=False), make_marker)
+
+
+LAMP_MARKER = (
+    "L.circleMarker(new L.LatLng(row[0], row[1]), "
+    "{renderer: renderer, radius: 2, color: 'yellow', fill: true, fillOpacity: 0.9})"
+)
+
+
+def _icon_marker(icon, color):
+    return (
+        "L.marker(new L.LatLng(row[0], row[1]), {icon: L.AwesomeMarkers.icon("
+        f"{{icon: '{icon}', prefix: 'fa', markerColor: '{color}'}})}})"
+    )
+
+
+POI_LAYERS = [
+    ("street_lamps", "街灯", lamp_label, LAMP_MARKER),
+    ("convenience_stores", "コンビニ", store_label, _icon_marker("shopping-cart", "blue")),
+    ("kobans", "交番", koban_label, _icon_marker("shield", "darkblue")),
+]
+
+
+def add_poi_layers(m, pois):
+    for kind, name, label_fn, make_marker in POI_LAYERS:
+        points = pois.get(kind) or []
+        if not points:
+            continue
+        rows, labels = compact_rows(points, label_fn)
+        FastMarkerCluster(
+            rows,
+            callback=_callback(labels, make_marker),
+            name=name,
+            **CLUSTER_OPTIONS,
+        ).add_to(m)
+
+
+# -----------------------
+# --- 掲示板の投稿 ---
+# -----------------------
+def report_label(r):
+    text = (r["text"] or r["tags"] or "").strip()
+    if len(text) > 60:
+        text = text[:60] + "…"
+    created = (r["created_at"] or "")[:16].replace("T", " ")
+    return f"{html.escape(text)}<br><small>{html.escape(r['address'] or '')} {created}</small>"
+
+
+REPORT_MARKER = (
+    "L.circleMarker(new L.LatLng(row[0], row[1]), "
+    "{renderer: renderer, radius: 6, weight: 1, color: row[3] ? 'crimson' : 'seagreen', fillOpacity: 0.8})"
+)
+
+
+def report_cell_deg(zoom):
+    return 360 / (256 * 2 ** zoom) * REPORT_CELL_PX
+
+
+def add_report_layer(m, bbox, zoom, max_markers=REPORT_MAX_MARKERS):
+    # bbox (south, west, north, east) 内の投稿だけを R*Tree で取り出して送る
+    south, west, north, east = bbox
+    n = auth_db.count_reports_in_bbox(south, west, north, east)
+    if n == 0:
+        return 0
+    if n <= max_markers:
+        labels, rows = [], []
+        for r in auth_db.reports_in_bbox(south, west, north, east):
+            rows.append([
+                round(r["lat"], COORD_PRECISION), round(r["lon"], COORD_PRECISION),
+                len(labels), int(r["polarity"] == "悪い方向"),
+            ])
+            labels.append(report_label(r))
+        FastMarkerCluster(
+            rows,
+            callback=_callback(labels, REPORT_MARKER),
+            name=f"投稿 ({n})",
+            **CLUSTER_OPTIONS,
+        ).add_to(m)
+        return n
+    # 多いときはセルごとの件数だけ（色は「悪い方向」の割合）
+    layer = folium.FeatureGroup(name=f"投稿 ({n})")
+    for lat, lon, count, bad in auth_db.report_clusters(south, west, north, east, report_cell_deg(zoom)):
+        folium.CircleMarker(
+            location=[round(lat, COORD_PRECISION), round(lon, COORD_PRECISION)],
+            radius=min(6 + 3 * len(str(count)), 24),
+            weight=1,
+            color="crimson" if bad * 2 > count else "seagreen",
+            fill=True,
+            fill_opacity=0.6,
+            tooltip=f"{count} 件（悪い方向 {bad} 件）",
+        ).add_to(layer)
+    layer.add_to(m)
+    return n
@@ -0,0 +1,60 @@
+# memory.py
+# 常駐データ（グラフ配列・KD 木・POI・コスト配列）のメモリ使用量の見積もり
+#
+#   NIGHTWALK_MEMORY_BUDGET=1.5G streamlit run app.py
+#
+# 予算を超えると RoutingEngine が最も長く使われていないエリアから追い出す。
+import os
+import sys
+
+import numpy as np
+
+UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30}
+
+# cKDTree の内部ノード 1 個あたりのおおよそのサイズ (bytes)
+KDTREE_NODE_BYTES = 72
+
+
+def parse_size(text):
+    # "512M" / "1.5G" / "1048576" → バイト数（空なら None = 無制限）
+    if text is None or text == "":
+        return None
+    if isinstance(text, (int, float)):
+        return int(text)
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1] if text and text[-1] in UNITS else ""
+    return int(float(text[: len(text) - len(unit)]) * UNITS[unit])
+
+
+def format_size(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.2f}GB"
+
+
+def array_bytes(*arrays):
+    return sum(a.nbytes for a in arrays if isinstance(a, np.ndarray))
+
+
+def tree_bytes(tree):
+    if tree is None:
+        return 0
+    return tree.data.nbytes + tree.indices.nbytes + tree.size * KDTREE_NODE_BYTES
+
+
+def poi_bytes(pois):
+    # [(lat, lon, tags), ...] のリスト。タグの辞書が大半を占める
+    total = 0
+    for points in pois.values():
+        total += sys.getsizeof(points)
+        for point in points:
+            tags = point[2] if len(point) > 2 else {}
+            total += sys.getsizeof(point) + 2 * sys.getsizeof(0.0) + sys.getsizeof(tags)
+            total += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in tags.items())
+    return total
+
+
+def default_budget():
+    return parse_size(os.environ.get("NIGHTWALK_MEMORY_BUDGET"))
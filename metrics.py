@@ -0,0 +1,145 @@
+# metrics.py
+# 処理段階ごとの計測（入れ子のタイミングスパン・カウンタ・件数やサイズの属性）
+#
+#   with span("search", place=place):
+#       with span("graph.load") as sp:
+#           ...
+#           sp.set(nodes=n, edges=m)
+#       count("area_cache.miss")
+#
+# ルートのスパンが終わるたびに JSON 1 行の構造化ログを出し、段階ごとの所要時間を集計する。
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger("nightwalk.metrics")
+
+# 段階ごとに保持する直近の所要時間の件数（p50 / p95 の計算用）
+WINDOW = 1000
+
+_current = contextvars.ContextVar("nightwalk_span", default=None)
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_durations = defaultdict(lambda: deque(maxlen=WINDOW))
+_recent = deque(maxlen=20)
+
+
+class Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.children = []
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        d = {"name": self.name, "ms": round((self.duration or 0) * 1000, 2)}
+        if self.attrs:
+            d["attrs"] = self.attrs
+        if self.error:
+            d["error"] = self.error
+        if self.children:
+            d["children"] = [c.to_dict() for c in self.children]
+        return d
+
+
+@contextmanager
+def span(name, **attrs):
+    parent = _current.get()
+    sp = Span(name, attrs)
+    token = _current.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.error = type(e).__name__
+        raise
+    finally:
+        sp.duration = time.perf_counter() - sp.start
+        _current.reset(token)
+        with _lock:
+            _durations[name].append(sp.duration)
+            if parent is not None:
+                parent.children.append(sp)
+        if parent is None:
+            _finish_root(sp)
+
+
+def annotate(**attrs):
+    # 今のスパンに属性を追加する（スパンの外では何もしない）
+    sp = _current.get()
+    if sp is not None:
+        sp.set(**attrs)
+
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+
+def submit(pool, fn, *args, **kwargs):
+    # スレッドプールでも呼び出し元のスパンの下に記録されるよう contextvars を引き継ぐ
+    ctx = contextvars.copy_context()
+    return pool.submit(ctx.run, fn, *args, **kwargs)
+
+
+def _finish_root(sp):
+    trace = sp.to_dict()
+    with _lock:
+        _recent.append(trace)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": "trace", **trace}, ensure_ascii=False))
+
+
+def last_trace():
+    with _lock:
+        return _recent[-1] if _recent else None
+
+
+def _percentile(sorted_values, q):
+    i = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[i]
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        durations = {k: sorted(v) for k, v in _durations.items() if v}
+    stages = {}
+    for name, values in sorted(durations.items()):
+        stages[name] = {
+            "count": len(values),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2),
+            "p50_ms": round(_percentile(values, 0.5) * 1000, 2),
+            "p95_ms": round(_percentile(values, 0.95) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        }
+    return {"counters": counters, "stages": stages}
+
+
+# --- 別プロセス（route_server のワーカー）の計測結果を取り込む ---
+def drain_counters():
+    with _lock:
+        counters = dict(_counters)
+        _counters.clear()
+    return counters
+
+
+def ingest(trace, counters=None):
+    def walk(node):
+        _durations[node["name"]].append(node["ms"] / 1000)
+        for child in node.get("children", []):
+            walk(child)
+
+    with _lock:
+        walk(trace)
+        _recent.append(trace)
+        for name, n in (counters or {}).items():
+            _counters[name] += n
@@ -0,0 +1,61 @@
+# overlay.py
+# 道路ごとの危険度オーバーレイ（safety_cost / length で色分け）
+# 表示範囲内のエッジだけを、危険度クラスごとに線分結合・簡略化・座標量子化した GeoJSON にする。
+import numpy as np
+import shapely
+
+from metrics import annotate
+
+# safety_cost / length の区切り（1.0 = 補正なし）
+DANGER_BINS = [0.5, 0.9, 1.1, 2.0, 4.0]
+DANGER_CLASSES = [
+    ("とても安全", "#1a9850"),
+    ("安全", "#91cf60"),
+    ("普通", "#d9d9d9"),
+    ("やや危険", "#fdae61"),
+    ("危険", "#f46d43"),
+    ("とても危険", "#a50026"),
+]
+
+
+def danger_levels(area, costs):
+    ratio = costs / np.maximum(area.edge_length, 1e-6)
+    return np.digitize(ratio, DANGER_BINS)
+
+
+def danger_overlay_geojson(area, costs, bbox, precision=5, tolerance=1e-5, skip_neutral=False, max_edges=20000):
+    edges = area.one_way_edges(area.edges_in_bbox(bbox))
+    # 表示範囲が広すぎるときは「普通」を省いてペイロードを抑える
+    if len(edges) > max_edges:
+        skip_neutral = True
+    levels = danger_levels(area, costs)[edges]
+    features = []
+    for level, (label, color) in enumerate(DANGER_CLASSES):
+        if skip_neutral and level == 2:
+            continue
+        sel = edges[levels == level]
+        if len(sel) == 0:
+            continue
+        # 隣り合う線分をつないでから簡略化し、頂点数を減らす
+        segments = shapely.linestrings(area.edge_coords(sel))
+        lines = shapely.line_merge(shapely.multilinestrings(segments))
+        lines = shapely.simplify(lines, tolerance)
+        xy, part = shapely.get_coordinates(shapely.get_parts(lines), return_index=True)
+        xy = np.round(xy, precision)
+        splits = np.flatnonzero(np.diff(part)) + 1
+        coords = [c.tolist() for c in np.split(xy, splits)]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "MultiLineString", "coordinates": coords},
+            "properties": {"level": level, "label": label, "color": color, "edges": int(len(sel))},
+        })
+    annotate(overlay_edges=int(len(edges)))
+    return {"type": "FeatureCollection", "features": features}
+
+
+def overlay_style(feature):
+    return {
+        "color": feature["properties"]["color"],
+        "weight": 3,
+        "opacity": 0.75,
+    }
@@ -1,12 +1,15 @@
 import streamlit as st
-from pathlib import Path
-import uuid
+import pandas as pd
+from datetime import datetime, timedelta
 import streamlit.components.v1 as components
 import folium
 
 from sidebar import render_sidebar
-from auth_db import load_reports, save_report, UPLOAD_DIR
-from utils import geocode_cached, detect_polarity
+from auth_db import init_db, load_reports_page, save_report, search_reports, tag_areas, tag_counts
+from images import local_path, store_upload, thumbnail_url
+from map_layers import add_report_layer
+from polarity import detect_polarity
+from utils import geocode_cached
 
 
 
@@ -30,6 +33,7 @@ st.markdown(
 
 
 render_sidebar()
+init_db()
 st.title("📝 夜道掲示板 - 投稿と確認")
 
 # ユーザー認証
@@ -325,13 +329,9 @@ if report_submit:
             # 画像があれば保存
             image_path = None
             if uploaded_file is not None:
+                # 同じ画像は 1 つだけ保存し、一覧用のサムネイルもここで作る
                 try:
-                    ext = Path(uploaded_file.name).suffix
-                    fname = f"{uuid.uuid4().hex}{ext}"
-                    out_path = UPLOAD_DIR / fname
-                    with open(out_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    image_path = str(out_path)
+                    image_path = store_upload(uploaded_file.getvalue())
                 except Exception as e:
                     st.warning(f"画像の保存に失敗しました: {e}")
 
@@ -359,33 +359,127 @@ if report_submit:
                 st.error("投稿の保存中にエラーが発生しました。")
                 st.error(str(e))
 
-# --- 投稿一覧 ---
-st.subheader("📍 投稿された怖い場所（掲示板）")
-reports = load_reports()
-if reports:
-    for r in reports[:50]:  # 最新50件表示
-        created = r["created_at"][:19] if r["created_at"] else ""
-        user_label = r["username"] or "匿名"
-        st.markdown(f"**{user_label}** - {created}")
-        # 表示: 投稿タイプ / タグ / 判定
-        meta = []
-        if r.get("post_type"):
-            meta.append(f"タイプ: {r.get('post_type')}")
-        if r.get("tags"):
-            meta.append(f"タグ: {r.get('tags')}")
-        if r.get("polarity"):
-            meta.append(f"判定: {r.get('polarity')}")
-        if meta:
-            st.caption(" | ".join(meta))
-        if r.get("text"):
-            st.write(r["text"])
-        st.caption(r["address"])
-        # 画像があれば表示
-        if r.get("image_path"):
+def render_report(r, key="feed"):
+    created = r["created_at"][:19] if r["created_at"] else ""
+    user_label = r["username"] or "匿名"
+    st.markdown(f"**{user_label}** - {created}")
+    # 表示: 投稿タイプ / タグ / 判定
+    meta = []
+    if r.get("post_type"):
+        meta.append(f"タイプ: {r.get('post_type')}")
+    if r.get("tags"):
+        meta.append(f"タグ: {r.get('tags')}")
+    if r.get("polarity"):
+        meta.append(f"判定: {r.get('polarity')}")
+    if meta:
+        st.caption(" | ".join(meta))
+    if r.get("text"):
+        st.write(r["text"])
+    st.caption(r["address"])
+    # 画像はサムネイルを遅延読み込みし、元画像は求められたときだけ送る
+    if r.get("image_path"):
+        url = thumbnail_url(r["image_path"])
+        if url:
+            st.markdown(
+                f'<img src="{url}" loading="lazy" style="max-width: 350px; width: 100%; border-radius: 4px;">',
+                unsafe_allow_html=True,
+            )
+            if st.checkbox("元のサイズで表示", key=f"{key}_full_image_{r['id']}"):
+                st.image(str(local_path(r["image_path"])))
+        else:
             try:
                 st.image(r.get("image_path"), width=350)
             except Exception:
                 pass
-        st.markdown("---")
+    st.markdown("---")
+
+
+# --- 投稿マップ ---
+st.subheader("🗺️ 投稿マップ")
+st.caption("表示している範囲の投稿だけを読み込みます（多いときは件数でまとめて表示）")
+view = st.session_state.setdefault(
+    "bbs_map_view", {"center": [35.8617, 139.6455], "zoom": 14, "bounds": None}
+)
+report_map = folium.Map(location=view["center"], zoom_start=view["zoom"])
+bounds = view["bounds"]
+if bounds is None:
+    # 初回は中心から画面程度の範囲
+    dlat, dlon = 0.02, 0.03
+    bounds = (view["center"][0] - dlat, view["center"][1] - dlon, view["center"][0] + dlat, view["center"][1] + dlon)
+add_report_layer(report_map, bounds, view["zoom"])
+try:
+    from streamlit_folium import st_folium
+    moved = st_folium(
+        report_map, width=1000, height=450, key="bbs_report_map",
+        returned_objects=["bounds", "zoom", "center"],
+    )
+    b = (moved or {}).get("bounds") or {}
+    if (b.get("_southWest") or {}).get("lat") is not None and (b.get("_northEast") or {}).get("lat") is not None:
+        new_bounds = (b["_southWest"]["lat"], b["_southWest"]["lng"], b["_northEast"]["lat"], b["_northEast"]["lng"])
+        old = view["bounds"]
+        span = max(new_bounds[2] - new_bounds[0], new_bounds[3] - new_bounds[1])
+        # 地図を動かしたら、その範囲で描き直す（描き直しによるわずかなずれでは再実行しない）
+        if old is None or max(abs(x - y) for x, y in zip(new_bounds, old)) > span * 0.1:
+            center = moved.get("center") or {}
+            st.session_state["bbs_map_view"] = {
+                "center": [center.get("lat", view["center"][0]), center.get("lng", view["center"][1])],
+                "zoom": moved.get("zoom") or view["zoom"],
+                "bounds": new_bounds,
+            }
+            st.rerun()
+except ImportError:
+    from streamlit_folium import folium_static
+    folium_static(report_map, width=1000, height=450)
+
+# --- 検索 ---
+st.subheader("🔎 投稿を検索")
+col1, col2, col3 = st.columns([3, 1, 1])
+with col1:
+    query = st.text_input("キーワード（空白区切りで、すべてを含む投稿）", key="bbs_query", placeholder="例: 暗い 公園")
+with col2:
+    period = st.selectbox("期間", ("すべて", "24時間", "7日", "30日"), key="bbs_period")
+with col3:
+    in_view = st.checkbox("地図の表示範囲のみ", key="bbs_in_view")
+if query.strip():
+    days = {"24時間": 1, "7日": 7, "30日": 30}.get(period)
+    since = (datetime.utcnow() - timedelta(days=days)).isoformat() if days else None
+    hits = search_reports(query, bbox=bounds if in_view else None, since=since)
+    st.caption(f"{len(hits)} 件" + ("（上位 50 件）" if len(hits) >= 50 else ""))
+    for r in hits:
+        render_report(r, key="search")
+
+# --- タグの集計（投稿時に更新される集計表を読むだけ） ---
+with st.expander("📊 タグの集計"):
+    col1, col2 = st.columns(2)
+    with col1:
+        stats_area = st.selectbox("地域", ["すべて"] + tag_areas(), key="tag_stats_area")
+    with col2:
+        stats_period = st.selectbox("期間", ("すべて", "7日", "30日", "90日"), key="tag_stats_period")
+    counts = tag_counts(
+        area=None if stats_area == "すべて" else stats_area,
+        days={"7日": 7, "30日": 30, "90日": 90}.get(stats_period),
+        limit=15,
+    )
+    if counts:
+        st.bar_chart(pd.DataFrame(counts, columns=["タグ", "件数"]).set_index("タグ"), horizontal=True)
+    else:
+        st.write("該当するタグはありません。")
+
+# --- 投稿一覧 ---
+st.subheader("📍 投稿された怖い場所（掲示板）")
+# 「さらに読み込む」で 1 ページずつ増やす。各ページは前のページの最後の投稿から索引で読む
+pages = st.session_state.setdefault("bbs_pages", 1)
+reports, cursor = [], None
+for _ in range(pages):
+    page, cursor = load_reports_page(before=cursor)
+    reports.extend(page)
+    if cursor is None:
+        break
+if reports:
+    for r in reports:
+        render_report(r)
+    if cursor is not None and st.button("さらに読み込む", key="bbs_more"):
+        st.session_state["bbs_pages"] = pages + 1
+        st.rerun()
 else:
     st.write("まだ投稿はありません。")
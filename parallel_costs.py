@@ -0,0 +1,167 @@
+# parallel_costs.py
+# エッジの安全コストを区間に分け、プロセスプールで並列に計算する
+#
+#   pool = CostPool(workers=4)
+#   engine = RoutingEngine(cost_pool=pool)   # 大きなエリアの area_costs / safety_route がプールを使う
+#
+# エッジ中点・長さ・犯罪点・POI 点と出力配列は共有メモリ（shared_graph.SharedArrays）に置き、
+# ワーカーへ渡すのは spec と区間 (start, stop) だけ。cKDTree は共有メモリに置けないので、
+# 各ワーカーが共有された点から 1 ジョブにつき 1 回だけ作り、同じジョブの区間すべてで使い回す。
+# costs() が終わると共有メモリは消すので、全ワーカーに 1 つずつ _release を送って木と接続も捨てさせる。
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from routing_engine import edge_safety_costs
+from shared_graph import SharedArrays, attach
+
+POI_KINDS = ("street_lamps", "convenience_stores", "kobans")
+# これより小さいエリアは共有メモリの準備の方が高くつくので、呼び出し側のスレッドで計算する
+PARALLEL_MIN_EDGES = 200_000
+# _release が全ワーカーに行き渡るのを待つ最長時間（秒）
+RELEASE_TIMEOUT = 10
+# ワーカーに知らせる、終わったジョブの数（_release が届かなかったワーカーも次の区間で捨てる）
+DONE_KEYS = 64
+
+# 共有メモリの名前 -> 接続と木
+_jobs = {}
+_barrier = None
+
+
+def default_workers():
+    # NIGHTWALK_COST_WORKERS=4 のように指定（0 / 未設定なら並列化しない）
+    return int(os.environ.get("NIGHTWALK_COST_WORKERS", "0") or 0)
+
+
+# -----------------------
+# --- ワーカー側 ---
+# -----------------------
+def _init_worker(barrier):
+    global _barrier
+    _barrier = barrier
+
+
+def _drop_jobs(done):
+    # 呼び出し側で終わったジョブの接続と木を捨てる
+    for key in [k for k in _jobs if k in done]:
+        for shm in _jobs.pop(key)["handles"]:
+            shm.close()
+
+
+def _job(spec, done):
+    _drop_jobs(done)
+    key = spec["out"][0]
+    job = _jobs.get(key)
+    if job is None:
+        arrays, handles = attach(spec, writable=("out",))
+        trees = {
+            name[len("points_"):]: cKDTree(arrays[name])
+            for name in spec if name.startswith("points_")
+        }
+        job = _jobs[key] = {"arrays": arrays, "handles": handles, "trees": trees}
+    return job
+
+
+def _release(done):
+    _drop_jobs(done)
+    # 全員がここに揃うまで待つので、同時に送った _release はワーカーごとに 1 つずつ行き渡る
+    try:
+        _barrier.wait(RELEASE_TIMEOUT)
+    except threading.BrokenBarrierError:
+        _barrier.reset()
+    return len(_jobs)
+
+
+def _cost_chunk(spec, done, start, stop):
+    job = _job(spec, done)
+    a, trees = job["arrays"], job["trees"]
+    a["out"][start:stop] = edge_safety_costs(
+        a["edge_mid"][start:stop], a["edge_length"][start:stop], trees.get("crime"), trees
+    )
+    return stop - start
+
+
+def _ping(_=None):
+    return os.getpid()
+
+
+# -----------------------
+# --- 呼び出し側 ---
+# -----------------------
+class CostPool:
+    def __init__(self, workers=None, min_edges=PARALLEL_MIN_EDGES, chunks_per_worker=4):
+        self.workers = default_workers() if workers is None else workers
+        self.min_edges = min_edges
+        self.chunks_per_worker = chunks_per_worker
+        self._pool = None
+        # 終わったジョブ（共有メモリの名前）。ワーカーはこれらの木を捨てる
+        self._done = deque(maxlen=DONE_KEYS)
+        self._lock = threading.Lock()
+        if self.workers > 0:
+            # fork だと Streamlit / HTTP サーバーのスレッドやロックまで複製されるので spawn
+            ctx = multiprocessing.get_context("spawn")
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=ctx,
+                initializer=_init_worker, initargs=(ctx.Barrier(self.workers),),
+            )
+
+    def worth(self, area):
+        return self._pool is not None and area.n_edges >= self.min_edges
+
+    def warm(self):
+        # ワーカーの起動（routing_engine の import）を先に済ませる
+        if self._pool is not None:
+            list(self._pool.map(_ping, range(self.workers)))
+
+    def _done_keys(self):
+        with self._lock:
+            return frozenset(self._done)
+
+    def costs(self, area, poi_trees, chunks=None):
+        n = area.n_edges
+        arrays = {
+            "edge_mid": area.edge_mid,
+            "edge_length": area.edge_length,
+            "out": np.zeros(n, dtype=np.float64),
+        }
+        trees = {"crime": area.crime_tree, **{k: poi_trees.get(k) for k in POI_KINDS}}
+        for kind, tree in trees.items():
+            if tree is not None and tree.n:
+                arrays[f"points_{kind}"] = tree.data
+        chunks = chunks or self.workers * self.chunks_per_worker
+        bounds = np.linspace(0, n, min(chunks, max(n, 1)) + 1).astype(np.int64)
+        with SharedArrays(arrays) as shared:
+            try:
+                done = self._done_keys()
+                futures = [
+                    self._pool.submit(_cost_chunk, shared.spec, done, int(start), int(stop))
+                    for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+                ]
+                for f in futures:
+                    f.result()
+                result, handles = attach({"out": shared.spec["out"]})
+                out = result.pop("out").copy()
+                for shm in handles:
+                    shm.close()
+            finally:
+                with self._lock:
+                    self._done.append(shared.spec["out"][0])
+                self.release()
+        return out
+
+    def release(self):
+        # 終わったジョブの木と接続を全ワーカーで捨てさせる（待たずに返る）
+        if self._pool is None:
+            return []
+        done = self._done_keys()
+        return [self._pool.submit(_release, done) for _ in range(self.workers)]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,207 @@
+# passwords.py
+# パスワードのハッシュ（bcrypt）と、ログイン失敗の制限
+#
+# bcrypt は CPU を使い切る処理なので、専用スレッドのプール（同時に HASH_WORKERS 件まで）で計算する。
+# 待ちも最大 PENDING_PER_WORKER 件/スレッドまでとし、溢れたら AuthBusy（ログインが集中しても
+# ページの再実行や検索に回す CPU を残す）。bcrypt は計算中に GIL を離すのでスレッドで足りる。
+#
+# コスト（ラウンド数）は NIGHTWALK_BCRYPT_ROUNDS（既定 12）。変えると、古いコストのハッシュは
+# 次のログイン成功時に裏で作り直す（needs_rehash）。
+# 失敗が続いたアカウント・IP は、照合せずに一定時間断る（総当たりでプールを埋められないように）。
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+logger = logging.getLogger("nightwalk.auth")
+
+DEFAULT_ROUNDS = 12
+PENDING_PER_WORKER = 16
+# プールが埋まっているとき、空きを待つ最長時間（秒）
+QUEUE_WAIT = 5.0
+# この回数までの失敗は待ちなし。超えると 1, 2, 4, ... 秒（最長 THROTTLE_MAX_DELAY）断る
+ACCOUNT_MAX_FAILURES = 5
+IP_MAX_FAILURES = 20
+THROTTLE_WINDOW = 15 * 60
+THROTTLE_MAX_DELAY = 15 * 60
+THROTTLE_MAX_KEYS = 100_000
+
+
+class AuthBusy(RuntimeError):
+    pass
+
+
+def bcrypt_rounds():
+    return int(os.environ.get("NIGHTWALK_BCRYPT_ROUNDS", DEFAULT_ROUNDS))
+
+
+def default_workers():
+    value = os.environ.get("NIGHTWALK_HASH_WORKERS")
+    if value:
+        return max(1, int(value))
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+def hash_rounds(password_hash):
+    # "$2b$12$..." の 12
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode("utf-8")
+    try:
+        return int(password_hash.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# -----------------------
+# --- ハッシュ計算のプール ---
+# -----------------------
+class HashPool:
+    def __init__(self, workers=None, rounds=None, max_pending=None):
+        self.workers = workers or default_workers()
+        self.rounds = rounds or bcrypt_rounds()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nightwalk-hash")
+        self._slots = threading.BoundedSemaphore(max_pending or self.workers * PENDING_PER_WORKER)
+        self.completed = 0
+        self.rejected = 0
+        self._dummy = None
+
+    def submit(self, fn, *args, wait=QUEUE_WAIT):
+        acquired = self._slots.acquire(timeout=wait) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            self.rejected += 1
+            raise AuthBusy("ログインが混み合っています。しばらくしてから再試行してください")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        self.completed += 1
+        self._slots.release()
+
+    def hash(self, password):
+        return self.submit(_hash, password, self.rounds).result()
+
+    def verify(self, password, password_hash):
+        # password_hash が None（該当ユーザーなし）でも同じ時間をかける。
+        # 比べる相手はプロセスごとに作る乱数のハッシュ（呼び出し側は結果によらず失敗にすること）
+        if password_hash is None:
+            if self._dummy is None:
+                self._dummy = self.hash(secrets.token_hex(16))
+            password_hash = self._dummy
+        return self.submit(_verify, password, password_hash).result()
+
+    def needs_rehash(self, password_hash):
+        return hash_rounds(password_hash) != self.rounds
+
+    def rehash_later(self, password, on_done):
+        # 新しいコストで作り直し、on_done(新しいハッシュ) を呼ぶ。混んでいれば今回は見送る
+        def run():
+            try:
+                on_done(_hash(password, self.rounds))
+            except Exception as e:
+                logger.warning("パスワードの再ハッシュに失敗: %s", e)
+        try:
+            self.submit(run, wait=0)
+        except AuthBusy:
+            pass
+
+    def stats(self):
+        return {"workers": self.workers, "rounds": self.rounds, "completed": self.completed, "rejected": self.rejected}
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds))
+
+
+def _verify(password, password_hash):
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode("utf-8")
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), password_hash)
+    except ValueError:
+        return False
+
+
+# -----------------------
+# --- ログイン失敗の制限 ---
+# -----------------------
+class LoginThrottle:
+    def __init__(self, max_failures, window=THROTTLE_WINDOW, max_delay=THROTTLE_MAX_DELAY):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_delay = max_delay
+        # key -> [失敗回数, 最後の失敗時刻, この時刻まで断る]
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def retry_after(self, key, now=None):
+        # 断る残り秒数（0 なら照合してよい）
+        now = now or time.time()
+        with self._lock:
+            entry = self._failures.get(key)
+            if entry is None:
+                return 0
+            if now - entry[1] > self.window:
+                del self._failures[key]
+                return 0
+            return max(0, entry[2] - now)
+
+    def failed(self, key, now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self._failures.get(key)
+            if entry is None or now - entry[1] > self.window:
+                entry = self._failures[key] = [0, now, 0]
+            entry[0] += 1
+            entry[1] = now
+            over = entry[0] - self.max_failures
+            if over > 0:
+                entry[2] = now + min(self.max_delay, 2 ** (over - 1))
+            if len(self._failures) > THROTTLE_MAX_KEYS:
+                self._prune(now)
+
+    def succeeded(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def _prune(self, now):
+        for key in [k for k, e in self._failures.items() if now - e[1] > self.window]:
+            del self._failures[key]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_accounts = LoginThrottle(ACCOUNT_MAX_FAILURES)
+_ips = LoginThrottle(IP_MAX_FAILURES)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashPool()
+        return _pool
+
+
+def check_throttle(account, ip=None):
+    wait = max(_accounts.retry_after(account.lower()), _ips.retry_after(ip) if ip else 0)
+    if wait > 0:
+        raise AuthBusy(f"ログインの失敗が続いたため制限中です。{int(wait) + 1} 秒後に再試行してください")
+
+
+def login_failed(account, ip=None):
+    _accounts.failed(account.lower())
+    if ip:
+        _ips.failed(ip)
+
+
+def login_succeeded(account):
+    _accounts.succeeded(account.lower())
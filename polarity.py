@@ -0,0 +1,141 @@
+# polarity.py
+# 投稿のポジネガ判定（本文とタグの語を重み付きで数える）
+#
+#   python polarity.py reclassify            # 語彙が変わっていれば reports.polarity を全件付け直す
+#   python polarity.py reclassify --force    # 変わっていなくても付け直す
+#
+# 語彙は data/polarity_lexicon.json（{"positive": {語: 重み}, "negative": {語: 重み}, "threshold": 0}）。
+# 全ての語を 1 つの正規表現にまとめ、本文とタグを 1 回の走査で判定する。
+# 重なる語（「危」と「危険」など）は長い方だけが一致する。
+import argparse
+import hashlib
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
+
+import auth_db
+
+BASE_DIR = Path(__file__).parent
+LEXICON_PATH = BASE_DIR / "data" / "polarity_lexicon.json"
+GOOD, BAD = "良い方向", "悪い方向"
+DEFAULT_LEXICON = {
+    "positive": {"安全": 1, "明る": 1, "広い": 1, "問題ない": 1, "安心": 1, "見通し良": 1},
+    # 「危険」は以前「危」と二重に数えていたので、判定が変わらないよう重み 2
+    "negative": {"暗": 1, "怖": 1, "危": 1, "怪しい": 1, "人通り少": 1, "危険": 2, "狭い": 1},
+    "threshold": 0,
+}
+# 本文とタグの区切り。本文は改行を含むことがあるので NUL を使う（入力中の NUL は取り除く）
+SEPARATOR = "\x00"
+RECLASSIFY_BATCH = 2000
+
+
+class PolarityClassifier:
+    def __init__(self, lexicon):
+        self.weights = {}
+        for w, v in lexicon.get("positive", {}).items():
+            self.weights[w.lower()] = self.weights.get(w.lower(), 0) + float(v)
+        for w, v in lexicon.get("negative", {}).items():
+            self.weights[w.lower()] = self.weights.get(w.lower(), 0) - float(v)
+        self.threshold = float(lexicon.get("threshold", 0))
+        words = sorted((w for w in self.weights if w), key=len, reverse=True)
+        self.pattern = re.compile("|".join(map(re.escape, words))) if words else None
+        # 語彙が変わったかどうかの判定に使う
+        body = json.dumps([sorted(self.weights.items()), self.threshold], ensure_ascii=False)
+        self.version = hashlib.sha1(body.encode("utf-8")).hexdigest()[:12]
+
+    def score(self, text, tags_text=None):
+        # 本文とタグごとに、同じ語は 1 回だけ数える
+        if self.pattern is None:
+            return 0.0
+        segments = [(text or "").lower()] + [t.strip().lower() for t in (tags_text or "").split(",") if t.strip()]
+        joined = SEPARATOR.join(s.replace(SEPARATOR, "") for s in segments)
+        seen = set()
+        segment = 0
+        last = 0
+        for m in self.pattern.finditer(joined):
+            segment += joined.count(SEPARATOR, last, m.start())
+            last = m.start()
+            seen.add((segment, m.group()))
+        return sum(self.weights[w] for _, w in seen)
+
+    def classify(self, text, tags_text=None):
+        return GOOD if self.score(text, tags_text) >= self.threshold else BAD
+
+
+def load_lexicon(path=LEXICON_PATH):
+    path = Path(path)
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return DEFAULT_LEXICON
+
+
+@lru_cache(maxsize=4)
+def _classifier(path, mtime):
+    return PolarityClassifier(load_lexicon(path))
+
+
+def get_classifier(path=LEXICON_PATH):
+    # 語彙ファイルを書き換えたら次の呼び出しから新しい語彙を使う
+    path = Path(path)
+    return _classifier(str(path), path.stat().st_mtime if path.exists() else None)
+
+
+def detect_polarity(text, tags_text=None):
+    return get_classifier().classify(text, tags_text)
+
+
+# -----------------------
+# --- 全件の付け直し ---
+# -----------------------
+def _stored_version(conn):
+    row = conn.execute("SELECT value FROM settings WHERE key = 'polarity_lexicon'").fetchone()
+    return row[0] if row else None
+
+
+def reclassify_reports(classifier=None, force=False, batch=RECLASSIFY_BATCH):
+    # reports を id 順に batch 件ずつ読み、判定が変わった行だけを 1 トランザクションで更新する。
+    # 語彙のバージョンを settings に残すので、変わっていなければ何もしない。戻り値は (読んだ件数, 更新した件数)
+    classifier = classifier or get_classifier()
+
+    def run(conn):
+        if not force and _stored_version(conn) == classifier.version:
+            return 0, 0
+        scanned = changed = 0
+        last_id = -1
+        while True:
+            rows = conn.execute(
+                "SELECT id, text, tags, polarity FROM reports WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch)
+            ).fetchall()
+            if not rows:
+                break
+            updates = []
+            for rid, text, tags, old in rows:
+                label = classifier.classify(text, tags)
+                if label != old:
+                    updates.append((label, rid))
+            conn.executemany("UPDATE reports SET polarity = ? WHERE id = ?", updates)
+            scanned += len(rows)
+            changed += len(updates)
+            last_id = rows[-1][0]
+        conn.execute(
+            "INSERT INTO settings (key, value) VALUES ('polarity_lexicon', ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (classifier.version,),
+        )
+        return scanned, changed
+
+    return auth_db.write(run)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="投稿のポジネガ判定")
+    parser.add_argument("command", choices=["reclassify"])
+    parser.add_argument("--force", action="store_true", help="語彙が変わっていなくても付け直す")
+    parser.add_argument("--lexicon", default=str(LEXICON_PATH))
+    parser.add_argument("--db", default=auth_db.DB_PATH)
+    args = parser.parse_args()
+    auth_db.DB_PATH = args.db
+    auth_db.init_db()
+    scanned, changed = reclassify_reports(get_classifier(args.lexicon), force=args.force)
+    print(f"reclassified: {changed} of {scanned} reports changed")
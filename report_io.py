@@ -0,0 +1,218 @@
+# report_io.py
+# 掲示板の投稿の一括取り込み・書き出し（CSV / JSONL）
+#
+#   python report_io.py import patrol.csv --source 防犯パトロール --classify
+#   python report_io.py import city.jsonl --geocode      # 座標のない行は住所からジオコードする
+#   python report_io.py export reports.jsonl --since 2024-01-01
+#   python report_io.py export - --format csv > reports.csv
+#
+# 取り込む列: text, address, lat, lon, post_type, tags, polarity, created_at, username（書き出しは id, image_path も）。
+# 取り込みは BULK_BATCH 行ずつ executemany で 1 トランザクションにし、その間は新着順・範囲検索・全文検索の
+# 索引とトリガーを外して最後にまとめて反映する（auth_db.import_reports）。
+# 書き出しは id 順に BULK_BATCH 行ずつ読むので、表の大きさに関係なくメモリは一定。
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import auth_db
+from polarity import BAD, GOOD, get_classifier
+from utils import geocode_cached
+
+BASE_DIR = Path(__file__).parent
+CRIME_CSV = BASE_DIR / "data" / "crime_geocoded.csv"
+EXPORT_FIELDS = ["id", "username", "text", "address", "lat", "lon", "post_type", "tags", "image_path", "polarity", "created_at"]
+# 表示する不正な行の数
+MAX_ERRORS = 20
+
+
+def file_format(path, fmt=None):
+    fmt = fmt or Path(path).suffix.lstrip(".").lower()
+    if fmt in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    if fmt == "csv":
+        return "csv"
+    raise ValueError(f"形式がわかりません: {path}（--format csv / jsonl を指定してください）")
+
+
+def read_records(f, fmt):
+    # (行番号, 辞書) を 1 行ずつ返す
+    if fmt == "csv":
+        for i, rec in enumerate(csv.DictReader(f), start=2):
+            yield i, rec
+        return
+    for i, line in enumerate(f, start=1):
+        if line.strip():
+            yield i, json.loads(line)
+
+
+def _float(value):
+    if value is None or str(value).strip() == "":
+        return None
+    return float(value)
+
+
+def _created_at(value):
+    # ISO 形式（2024-05-01T21:30:00、2024/05/01 21:30 も可）。タイムゾーン付きは UTC に直す
+    if value is None or str(value).strip() == "":
+        return datetime.utcnow().isoformat()
+    dt = datetime.fromisoformat(str(value).strip().replace("/", "-"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat()
+
+
+def to_row(rec, source=None):
+    # 1 件を auth_db.REPORT_INSERT の並びにする。不正な行は ValueError
+    text = (rec.get("text") or "").strip()
+    address = (rec.get("address") or "").strip()
+    tags = rec.get("tags")
+    if isinstance(tags, list):
+        tags = ",".join(str(t) for t in tags)
+    tags = ",".join(auth_db.split_tags(tags))
+    lat, lon = _float(rec.get("lat")), _float(rec.get("lon"))
+    if (lat is None) != (lon is None):
+        raise ValueError("lat と lon の片方しかありません")
+    if lat is not None and not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"座標が範囲外です: {lat}, {lon}")
+    if not text and not tags:
+        raise ValueError("text も tags もありません")
+    if not address and lat is None:
+        raise ValueError("address も座標もありません")
+    polarity = (rec.get("polarity") or "").strip() or None
+    if polarity not in (None, GOOD, BAD):
+        raise ValueError(f"polarity は {GOOD} / {BAD} のどちらかです: {polarity}")
+    return (
+        None, (rec.get("username") or "").strip() or source, text, address, lat, lon,
+        (rec.get("post_type") or "").strip() or None, tags or None, None, polarity, _created_at(rec.get("created_at")),
+    )
+
+
+class Geocoder:
+    # 住所 → 座標。犯罪データの結果（data/crime_geocoded.csv）と、アプリと同じ geocode_cached を使い、
+    # 同じ住所は 1 回しか問い合わせない（失敗した住所も覚えておく）
+    def __init__(self, crime_csv=CRIME_CSV):
+        self.known = {}
+        self.queried = 0
+        if Path(crime_csv).exists():
+            with open(crime_csv, encoding="utf-8") as f:
+                for r in csv.DictReader(f):
+                    self.known[r["address"]] = (float(r["lat"]), float(r["lon"]))
+
+    def locate(self, address):
+        if address not in self.known:
+            self.queried += 1
+            try:
+                self.known[address] = tuple(geocode_cached(address))
+            except Exception:
+                self.known[address] = None
+        return self.known[address]
+
+
+def import_file(path, fmt=None, source=None, geocode=False, classify=False, batch=auth_db.BULK_BATCH,
+                defer_indexes=True, encoding="utf-8-sig"):
+    fmt = file_format(path, fmt)
+    geocoder = Geocoder() if geocode else None
+    classifier = get_classifier() if classify else None
+    stats = {"read": 0, "imported": 0, "skipped": 0, "geocoded": 0, "classified": 0, "errors": []}
+
+    def skip(line, reason):
+        stats["skipped"] += 1
+        if len(stats["errors"]) < MAX_ERRORS:
+            stats["errors"].append((line, reason))
+
+    def prepare(rows):
+        # 座標のない行のジオコードと、判定のない行の判定（バッチごと）
+        out = []
+        for line, row in rows:
+            if row[4] is None:
+                latlon = geocoder.locate(row[3]) if geocoder else None
+                if latlon is None and geocoder:
+                    skip(line, f"ジオコードできません: {row[3]}")
+                    continue
+                if latlon is not None:
+                    row = row[:4] + latlon + row[6:]
+                    stats["geocoded"] += 1
+            if classifier is not None and row[9] is None:
+                row = row[:9] + (classifier.classify(row[2], row[7]),) + row[10:]
+                stats["classified"] += 1
+            out.append(row)
+        return out
+
+    def batches(f):
+        rows = []
+        for line, rec in read_records(f, fmt):
+            stats["read"] += 1
+            try:
+                rows.append((line, to_row(rec, source)))
+            except (ValueError, TypeError, AttributeError) as e:
+                skip(line, str(e))
+                continue
+            if len(rows) >= batch:
+                yield prepare(rows)
+                rows = []
+        if rows:
+            yield prepare(rows)
+
+    with open(path, encoding=encoding, newline="") as f:
+        stats["imported"] = auth_db.import_reports(batches(f), defer_indexes=defer_indexes)
+    if geocoder:
+        stats["geocode_queries"] = geocoder.queried
+    return stats
+
+
+def export_file(path, fmt=None, since=None, until=None, batch=auth_db.BULK_BATCH):
+    fmt = file_format(path, fmt)
+    f = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+    n = 0
+    try:
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for r in auth_db.iter_reports(since, until, batch):
+                writer.writerow(r)
+                n += 1
+        else:
+            for r in auth_db.iter_reports(since, until, batch):
+                f.write(json.dumps({k: r[k] for k in EXPORT_FIELDS}, ensure_ascii=False) + "\n")
+                n += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="掲示板の投稿の一括取り込み・書き出し")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="CSV / JSONL から取り込む")
+    p_import.add_argument("path")
+    p_import.add_argument("--source", default=None, help="username 列がない行の投稿者名（提供元など）")
+    p_import.add_argument("--geocode", action="store_true", help="座標のない行を住所からジオコードする")
+    p_import.add_argument("--classify", action="store_true", help="polarity のない行を判定する")
+    p_import.add_argument("--no-defer", action="store_true", help="索引を外さずに取り込む（少量の追加向け）")
+    p_import.add_argument("--encoding", default="utf-8-sig", help="CSV の文字コード（自治体のデータは cp932 のことがある）")
+    p_export = sub.add_parser("export", help="CSV / JSONL に書き出す（- なら標準出力）")
+    p_export.add_argument("path")
+    p_export.add_argument("--since", default=None, help="created_at がこれ以降（ISO 形式）")
+    p_export.add_argument("--until", default=None, help="created_at がこれより前（ISO 形式）")
+    for p in (p_import, p_export):
+        p.add_argument("--format", choices=["csv", "jsonl"], default=None, help="省略時は拡張子で決める")
+        p.add_argument("--batch", type=int, default=auth_db.BULK_BATCH)
+        p.add_argument("--db", default=auth_db.DB_PATH)
+    args = parser.parse_args()
+    auth_db.DB_PATH = args.db
+    auth_db.init_db()
+    if args.command == "import":
+        stats = import_file(
+            args.path, args.format, source=args.source, geocode=args.geocode, classify=args.classify,
+            batch=args.batch, defer_indexes=not args.no_defer, encoding=args.encoding,
+        )
+        for line, reason in stats.pop("errors"):
+            print(f"  {line} 行目: {reason}", file=sys.stderr)
+        print(json.dumps(stats, ensure_ascii=False))
+    else:
+        n = export_file(args.path, args.format, since=args.since, until=args.until, batch=args.batch)
+        print(f"exported {n} reports", file=sys.stderr)
@@ -0,0 +1,206 @@
+# report_signal.py
+# 掲示板の投稿をルートの安全コストに反映する（悪い投稿の近くの道は加点、良い投稿の近くは減点）
+#
+#   engine = RoutingEngine(report_signal=ReportSignal())
+#
+# 投稿の重み = 判定（悪い方向 +1 / 良い方向 -1）+ タグの重み（TAG_WEIGHTS）。
+# 半径 REPORT_SIGNAL[0] m 以内のエッジに、距離に応じて（_proximity と同じ形で）配る。
+# 古い投稿は半減期 HALF_LIFE_DAYS で弱め、MAX_AGE_DAYS を過ぎたら外す。
+# 減衰はすべての投稿に同じ割合でかかるので、エッジごとの合計は基準時刻 t0 での値で持ち、読むときに 1 回掛ける。
+#
+# DB を全件読むのは最初の 1 回だけ。以降は auth_db の report_changes（トリガーで記録）から差分を読み、
+# 変わった投稿の周りのエッジだけを足し引きする。検索ではエリアごとの配列を読むだけで DB には触れない。
+# report_changes は PRUNE_INTERVAL ごとに新しい CHANGES_KEEP 件まで削り、それより遅れたら全件から読み直す。
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import auth_db
+from memory import tree_bytes
+
+logger = logging.getLogger("nightwalk.reports")
+
+# 影響半径 m, 係数（重み 1 の投稿の真上で 120 * 3 = 360 m 相当）
+REPORT_SIGNAL = (120, 3)
+# 1 本のエッジへの加減点の上限（投稿が集中した場所が他の要素を押しつぶさないように）
+REPORT_CAP = 2000
+HALF_LIFE_DAYS = 30
+MAX_AGE_DAYS = 180
+# 検索のたびに差分を見に行く最短の間隔（秒）
+SYNC_INTERVAL = 5
+# report_changes を削る間隔（秒）
+PRUNE_INTERVAL = 3600
+POLARITY_WEIGHTS = {"悪い方向": 1.0, "良い方向": -1.0}
+TAG_WEIGHTS = {
+    "暗い": 1.0, "薄暗い": 0.5, "街灯なし": 1.0, "歩道なし": 0.5, "狭い": 0.5,
+    "人通り少ない": 1.0, "夜は少ない": 0.5, "夜間人気がない": 1.0,
+    "深夜に危険": 1.0, "深夜帯に危険": 1.0, "夕方に危険": 0.5, "明け方に危険": 0.5,
+    "危険人物目撃": 2.0, "暴力目撃": 2.0, "ひったくり注意": 1.5, "路上泥酔者": 1.0, "不審物": 1.0,
+    "過去に警察出動あり": 1.0, "視界が悪い": 0.5, "建物で見通し悪い": 0.5, "駐輪場暗い": 0.5,
+    "明るい": -1.0, "街灯あり": -1.0, "人通り多い": -0.5, "広い": -0.5, "歩道あり": -0.5,
+}
+
+
+def report_weight(polarity, tags):
+    return POLARITY_WEIGHTS.get(polarity, 0.0) + sum(TAG_WEIGHTS.get(t, 0.0) for t in auth_db.split_tags(tags))
+
+
+def _timestamp(created_at):
+    # created_at は UTC の ISO 形式（タイムゾーンなし）
+    try:
+        return datetime.fromisoformat(created_at).replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class ReportSignal:
+    def __init__(self, half_life_days=HALF_LIFE_DAYS, max_age_days=MAX_AGE_DAYS, sync_interval=SYNC_INTERVAL,
+                 max_areas=8):
+        self.half_life = half_life_days * 86400
+        self.max_age = max_age_days * 86400
+        self.sync_interval = sync_interval
+        self.max_areas = max_areas
+        self.t0 = time.time()
+        # id -> (lat, lon, t0 での重み, 投稿時刻)
+        self._reports = {}
+        self._expiry = []
+        # place -> {"mid": エッジ中点, "to_proj", "tree": 中点の木, "sum": t0 でのエッジごとの合計}
+        self._areas = OrderedDict()
+        self._cursor = None
+        self._synced = 0.0
+        self._pruned = 0.0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.changes = 0
+
+    def __len__(self):
+        return len(self._reports)
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(tree_bytes(e["tree"]) + e["sum"].nbytes for e in self._areas.values())
+
+    def _scale(self, now=None):
+        return 0.5 ** (((now or time.time()) - self.t0) / self.half_life)
+
+    # --- 投稿の読み込み ---
+    def sync(self, force=False):
+        # 前回から追加・変更・削除された投稿を反映する。反映した件数を返す（別スレッドが反映中なら 0）
+        now = time.monotonic()
+        if not force and now - self._synced < self.sync_interval:
+            return 0
+        if not self._sync_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._synced = now
+            if now - self._pruned >= PRUNE_INTERVAL:
+                self._pruned = now
+                auth_db.prune_report_changes()
+            if self._cursor is None:
+                return self._reload()
+            applied = 0
+            while True:
+                cursor, ids, rows = auth_db.report_changes_since(self._cursor)
+                if cursor is None:
+                    # 読む前に記録が削られた
+                    logger.info("投稿の変更記録が削られたので全件から読み直す")
+                    return self._reload()
+                applied += self._apply(ids, rows)
+                if cursor == self._cursor:
+                    return applied
+                self._cursor = cursor
+        except sqlite3.Error as e:
+            # 投稿の DB がない環境では投稿なしとして扱う
+            logger.warning("投稿の読み込みに失敗: %s", e)
+            return 0
+        finally:
+            self._sync_lock.release()
+
+    def _reload(self):
+        since = (datetime.utcnow() - timedelta(seconds=self.max_age)).isoformat()
+        cursor, rows = auth_db.signal_reports(since)
+        with self._lock:
+            self._reports.clear()
+            self._expiry.clear()
+            for entry in self._areas.values():
+                entry["sum"][:] = 0
+        applied = self._apply([], rows)
+        self._cursor = cursor
+        return applied
+
+    def _apply(self, ids, rows):
+        # ids の投稿の今の寄与を引き、rows（今の値）で足し直す。期限切れの投稿もここで外す
+        now = time.time()
+        added = {}
+        for rid, lat, lon, polarity, tags, created_at in rows:
+            ts = _timestamp(created_at)
+            w = report_weight(polarity, tags)
+            if lat is None or lon is None or ts is None or w == 0 or now - ts > self.max_age:
+                continue
+            added[rid] = (float(lat), float(lon), w * 2 ** ((ts - self.t0) / self.half_life), ts)
+        with self._lock:
+            removed = [self._reports.pop(rid) for rid in ids if rid in self._reports]
+            while self._expiry and self._expiry[0][0] < now - self.max_age:
+                ts, rid = heapq.heappop(self._expiry)
+                if rid in self._reports and self._reports[rid][3] == ts:
+                    removed.append(self._reports.pop(rid))
+            for rid, r in added.items():
+                self._reports[rid] = r
+                heapq.heappush(self._expiry, (r[3], rid))
+            changes = [(lat, lon, -w) for lat, lon, w, _ in removed] + [(lat, lon, w) for lat, lon, w, _ in added.values()]
+            for entry in self._areas.values():
+                _spread(entry, changes)
+            self.changes += len(changes)
+        return len(changes)
+
+    # --- エリアごとの加減点 ---
+    def edge_adjust(self, area):
+        # area のエッジごとの加減点（area.edge_length と同じ並び）。初めてのエリアでは中点の木を作る
+        self.sync()
+        with self._lock:
+            entry = self._areas.get(area.place)
+            if entry is not None and entry["mid"] is area.edge_mid:
+                self._areas.move_to_end(area.place)
+                return self._adjust(entry)
+        entry = {
+            "mid": area.edge_mid,
+            "to_proj": area.to_proj,
+            "tree": cKDTree(area.edge_mid),
+            "sum": np.zeros(area.n_edges),
+        }
+        with self._lock:
+            _spread(entry, [(lat, lon, w) for lat, lon, w, _ in self._reports.values()])
+            self._areas[area.place] = entry
+            while len(self._areas) > self.max_areas:
+                self._areas.popitem(last=False)
+            return self._adjust(entry)
+
+    def _adjust(self, entry):
+        # self._lock を持った状態で呼ぶ
+        return np.clip(entry["sum"] * self._scale(), -REPORT_CAP, REPORT_CAP)
+
+    def drop(self, place):
+        with self._lock:
+            self._areas.pop(place, None)
+
+
+def _spread(entry, changes):
+    # [(lat, lon, t0 での重み), ...] を半径内のエッジの合計に足す
+    if not changes:
+        return
+    lat, lon, w = np.array(changes, dtype=np.float64).T
+    xs, ys = entry["to_proj"].transform(lon, lat)
+    radius, factor = REPORT_SIGNAL
+    pairs = entry["tree"].sparse_distance_matrix(
+        cKDTree(np.column_stack([xs, ys])), radius, output_type="ndarray"
+    )
+    if len(pairs):
+        np.add.at(entry["sum"], pairs["i"], w[pairs["j"]] * (radius - pairs["v"]) * factor)
@@ -0,0 +1,256 @@
+# route_server.py
+# ルート検索エンジンのローカル HTTP/JSON API
+#
+#   python route_server.py --port 8765 --workers 4
+#
+#   POST /route      {"origin": "大宮駅, 埼玉" | [lat, lon], "destination": ..., "place": ..., "mode": "safety", "zoom": 15}
+#   POST /isochrone  {"origin": ..., "place": ..., "budgets": [500, 1000, 2000]}
+#   POST /overlay    {"place": ..., "bbox": [south, west, north, east]}
+#                    place を省略すると、必要な範囲のタイル（tiles.py）だけを読み込んでつなぐ
+#   POST /heatmap    {"zoom": 15, "bbox": [south, west, north, east]}
+#   GET  /health
+#   GET  /metrics    段階ごとの所要時間 (p50/p95)・キャッシュのヒット数など
+#   GET  /memory     ワーカー（どれか 1 つ）に常駐しているグラフ・インデックス・キャッシュのバイト数
+#
+# ワーカープロセスごとに RoutingEngine を 1 つ持ち、グラフ・インデックスを常駐させる。
+# 各ワーカーは --refresh-interval 秒ごとに data/crime_geocoded.csv の変更を確認して差し替える
+# （元 CSV からの作り直しは geocode_preprocess.py で行う）。
+# --reports-db を指定すると、掲示板の投稿（report_signal.py）も安全コストに反映する。
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+from isochrone import compute_isochrone, isochrone_geojson
+import auth_db
+from memory import parse_size
+from overlay import danger_overlay_geojson
+from report_signal import ReportSignal
+from routing_engine import GeocodeError, NoRouteError, RoutingEngine, to_geojson
+
+MODES = ("safety", "shortest")
+
+logger = logging.getLogger("nightwalk.server")
+
+_engine = None
+
+
+def _init_worker(max_areas, memory_budget, refresh_interval, reports_db=None):
+    global _engine
+    report_signal = None
+    if reports_db:
+        auth_db.DB_PATH = reports_db
+        report_signal = ReportSignal()
+    _engine = RoutingEngine(max_areas=max_areas, memory_budget=memory_budget, report_signal=report_signal)
+    if refresh_interval > 0:
+        _engine.start_watcher(interval=refresh_interval)
+
+
+def _memory_report():
+    return {"pid": os.getpid(), **_engine.memory_report()}
+
+
+def _run_job(job, payload):
+    # ワーカー側の計測結果（スパンとカウンタ）も一緒に返し、サーバー側で集計する
+    # 同じプロセスの別スレッド（データ更新の watcher など）のスパンと混ざらないよう、このジョブのスパンを返す
+    with metrics.span(job.__name__.strip("_")) as sp:
+        body = job(payload)
+    return body, sp.to_dict(), metrics.drain_counters()
+
+
+def _route_job(payload):
+    result = _engine.search(
+        payload["origin"],
+        payload["destination"],
+        payload.get("place"),
+        mode=payload.get("mode", "safety"),
+        zoom=payload.get("zoom"),
+    )
+    return to_geojson(result, include_pois=bool(payload.get("pois")))
+
+
+def _isochrone_job(payload):
+    iso = compute_isochrone(_engine, payload["origin"], payload.get("place"), payload["budgets"])
+    body = isochrone_geojson(iso)
+    body["properties"] = {"origin": list(iso["origin"]), "warnings": iso["warnings"]}
+    return body
+
+
+def _overlay_job(payload):
+    bbox = [float(c) for c in payload["bbox"]]
+    area = _engine.coverage([bbox[:2], bbox[2:]], payload.get("place"), pad=0)
+    costs, warnings = _engine.area_costs(area.place)
+    body = danger_overlay_geojson(area, costs, bbox)
+    body["properties"] = {"warnings": warnings}
+    return body
+
+
+def _heatmap_job(payload):
+    bbox = payload.get("bbox")
+    heatmap = _engine.crime_heatmap
+    return {
+        "version": heatmap.version,
+        "zoom": int(payload["zoom"]),
+        "cells": heatmap.cells(int(payload["zoom"]), [float(c) for c in bbox] if bbox else None),
+    }
+
+
+def _validate_route(payload):
+    for key in ("origin", "destination"):
+        if not payload.get(key):
+            return f"{key} を指定してください"
+    if payload.get("mode", "safety") not in MODES:
+        return f"mode は {' / '.join(MODES)} のいずれかです"
+    if payload.get("zoom") is not None and not isinstance(payload["zoom"], int):
+        return "zoom は整数で指定してください"
+    return None
+
+
+def _validate_isochrone(payload):
+    for key in ("origin", "budgets"):
+        if not payload.get(key):
+            return f"{key} を指定してください"
+    try:
+        [float(b) for b in payload["budgets"]]
+    except (TypeError, ValueError):
+        return "budgets は数値のリストで指定してください"
+    return None
+
+
+def _validate_overlay(payload):
+    bbox = payload.get("bbox")
+    if not isinstance(bbox, list) or len(bbox) != 4:
+        return "bbox は [south, west, north, east] で指定してください"
+    return None
+
+
+def _validate_heatmap(payload):
+    try:
+        int(payload.get("zoom"))
+    except (TypeError, ValueError):
+        return "zoom を整数で指定してください"
+    bbox = payload.get("bbox")
+    if bbox is not None and (not isinstance(bbox, list) or len(bbox) != 4):
+        return "bbox は [south, west, north, east] で指定してください"
+    return None
+
+
+ENDPOINTS = {
+    "/route": (_validate_route, _route_job),
+    "/isochrone": (_validate_isochrone, _isochrone_job),
+    "/overlay": (_validate_overlay, _overlay_job),
+    "/heatmap": (_validate_heatmap, _heatmap_job),
+}
+
+
+class RouteHandler(BaseHTTPRequestHandler):
+    pool = None
+    timeout_sec = 300
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return len(data)
+
+    def log_message(self, format, *args):
+        # アクセスログは構造化ログ（nightwalk.server）に出す
+        pass
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self._send_json(200, metrics.snapshot())
+        elif self.path == "/memory":
+            try:
+                self._send_json(200, self.pool.submit(_memory_report).result(timeout=self.timeout_sec))
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path not in ENDPOINTS:
+            self._send_json(404, {"error": "not found"})
+            return
+        validate, job = ENDPOINTS[self.path]
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except Exception:
+            self._send_json(400, {"error": "JSON を解釈できません"})
+            return
+        error = validate(payload)
+        if error:
+            self._send_json(400, {"error": error})
+            return
+
+        started = time.perf_counter()
+        future = self.pool.submit(_run_job, job, payload)
+        status, size = 500, 0
+        try:
+            body, trace, counters = future.result(timeout=self.timeout_sec)
+            metrics.ingest(trace, counters)
+            status, size = 200, self._send_json(200, body)
+        except (GeocodeError, NoRouteError, ValueError) as e:
+            status, size = 422, self._send_json(422, {"error": str(e)})
+        except FutureTimeout:
+            future.cancel()
+            status, size = 504, self._send_json(504, {"error": "タイムアウトしました"})
+        except Exception as e:
+            size = self._send_json(500, {"error": str(e)})
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.count(f"http.{status}")
+            logger.info(json.dumps({
+                "event": "request",
+                "path": self.path,
+                "status": status,
+                "ms": round(elapsed * 1000, 2),
+                "response_bytes": size,
+            }, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NightWalk ルート検索 API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-areas", type=int, default=4, help="ワーカーごとに常駐させるエリア数")
+    parser.add_argument("--memory-budget", type=parse_size, default=None,
+                        help="ワーカーごとのメモリ予算（例: 1.5G）。省略時は NIGHTWALK_MEMORY_BUDGET")
+    parser.add_argument("--timeout", type=int, default=300)
+    parser.add_argument("--refresh-interval", type=int, default=300, help="データ更新の確認間隔（秒、0 で無効）")
+    parser.add_argument("--reports-db", default=None, help="掲示板の DB（users.db）。指定すると投稿をコストに反映する")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(name)s %(message)s")
+    RouteHandler.pool = ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(args.max_areas, args.memory_budget, args.refresh_interval, args.reports_db),
+    )
+    RouteHandler.timeout_sec = args.timeout
+    server = ThreadingHTTPServer((args.host, args.port), RouteHandler)
+    print(f"listening on http://{args.host}:{args.port} (workers={args.workers})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        RouteHandler.pool.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1145 @@
+# routing_engine.py
+# ルート検索パイプライン（ジオコード → グラフ → コスト計算 → ルート → 指標）
+# Streamlit に依存しないので、app.py / route_server.py の両方から使う。
+import copy
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from pathlib import Path
+
+import numpy as np
+import osmnx as ox
+import pandas as pd
+import requests
+import shapely
+from pyproj import CRS, Transformer
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from geocode_preprocess import refresh_crime_csv
+from heatmap import CrimeHeatmap
+from memory import array_bytes, default_budget, poi_bytes, tree_bytes
+from metrics import count, span, submit
+from tiles import TILE_PAD, download_tile, is_tiles_name, parse_tiles_name, stitch, tiles_for, tiles_name, utm_crs
+from utils import geocode_cached
+
+logger = logging.getLogger("nightwalk.engine")
+
+BASE_DIR = Path(__file__).parent
+CRIME_CSV = BASE_DIR / "data" / "crime_geocoded.csv"
+
+OVERPASS_URLS = [
+    "https://overpass.kumi.systems/api/interpreter",
+    "https://lz4.overpass-api.de/api/interpreter",
+    "https://overpass.openstreetmap.ru/api/interpreter"
+]
+
+# 安全コストのパラメータ（影響半径 m, 係数）
+CRIME_PENALTY = (200, 5)
+LAMP_BONUS = (80, 1.5)
+STORE_BONUS = (150, 4)
+KOBAN_BONUS = (300, 8)
+
+# 街灯などを取得するルート周辺の余白 (m)
+ROUTE_BUFFER = 300
+
+# ルート線の簡略化の許容誤差（画面上のピクセル数）
+SIMPLIFY_PX = 1.0
+
+# POI キャッシュの有効期限（秒）。期限切れは古いものを返しつつ裏で取り直す
+POI_TTL = 24 * 3600
+
+
+class GeocodeError(RuntimeError):
+    pass
+
+
+class NoRouteError(RuntimeError):
+    pass
+
+
+class SearchCancelled(RuntimeError):
+    pass
+
+
+# -----------------------
+# --- グラフ取得 ---
+# -----------------------
+def safe_graph_from_place(place):
+    try:
+        # 通常の place → polygon 取得
+        return ox.graph_from_place(place, network_type="walk")
+    except Exception:
+        try:
+            # geocode → bbox 取得
+            geocode = ox.geocode_to_gdf(place)
+            bounds = geocode.total_bounds  # [west, south, east, north]
+            west, south, east, north = bounds
+
+            # ★ OSRMnx v1.1〜1.2 は位置引数の graph_from_bbox を使用する必要がある
+            return ox.graph_from_bbox(north, south, east, west, network_type="walk")
+
+        except Exception as e:
+            raise RuntimeError(f"フォールバック bbox も失敗: {e}")
+
+
+# -----------------------
+# --- 犯罪データ ---
+# -----------------------
+def load_crime_locations(csv_path=CRIME_CSV):
+    csv_path = Path(csv_path)
+    if not csv_path.exists():
+        return []
+    df = pd.read_csv(csv_path)
+    return list(zip(df["lat"], df["lon"]))
+
+
+def file_version(path):
+    # データファイルの内容ハッシュ（キャッシュのキーに使う）
+    path = Path(path)
+    if not path.exists():
+        return "none"
+    return hashlib.sha1(path.read_bytes()).hexdigest()[:12]
+
+
+# -----------------------
+# --- OSM 街灯・コンビニ・交番取得 ---
+# -----------------------
+def _overpass_elements(query):
+    last_error = None
+    for url in OVERPASS_URLS:
+        try:
+            r = requests.post(url, data=query, timeout=180)
+            if r.status_code == 200:
+                return r.json().get("elements", [])
+            last_error = f"{url} → HTTP {r.status_code}"
+        except Exception as e:
+            last_error = f"{url} → {e}"
+    raise RuntimeError(f"Overpass API 取得失敗: {last_error}")
+
+
+def _element_points(elements):
+    points = []
+    for el in elements:
+        lat = el.get("lat") or el.get("center", {}).get("lat")
+        lon = el.get("lon") or el.get("center", {}).get("lon")
+        if lat and lon:
+            points.append((lat, lon, el.get("tags", {})))
+    return points
+
+
+def load_street_lamps_bbox(place):
+    south, west, north, east = place
+    query = f"""
+    [out:json][timeout:120];
+    (
+      node["highway"="street_lamp"]({south},{west},{north},{east});
+      node["man_made"="street_lamp"]({south},{west},{north},{east});
+      node["amenity"="street_lamp"]({south},{west},{north},{east});
+    );
+    out body;
+    """
+    return _element_points(_overpass_elements(query))
+
+
+def load_convenience_stores_bbox(place):
+    south, west, north, east = place
+    query = f"""
+    [out:json][timeout:120];
+    (
+      node["shop"="convenience"]({south},{west},{north},{east});
+      way["shop"="convenience"]({south},{west},{north},{east});
+    );
+    out center;
+    """
+    return _element_points(_overpass_elements(query))
+
+
+def load_koban_bbox(place):
+    south, west, north, east = place
+    query = f"""
+    [out:json][timeout:120];
+    (
+      node["amenity"="police"]({south},{west},{north},{east});
+      way["amenity"="police"]({south},{west},{north},{east});
+      node["police"]({south},{west},{north},{east});
+      way["police"]({south},{west},{north},{east});
+    );
+    out center;
+    """
+    return _element_points(_overpass_elements(query))
+
+
+POI_LOADERS = {
+    "street_lamps": (load_street_lamps_bbox, "街灯"),
+    "convenience_stores": (load_convenience_stores_bbox, "コンビニ"),
+    "kobans": (load_koban_bbox, "交番"),
+}
+
+
+# -----------------------
+# --- エリアグラフ（配列表現） ---
+# -----------------------
+def pack_geometry(geoms, node_x, node_y, edge_u, edge_v):
+    # エッジ形状を 1 本の座標配列 + オフセットに詰める（形状なしのエッジは u→v の直線）
+    missing = np.flatnonzero([g is None for g in geoms])
+    geoms = np.array(geoms, dtype=object)
+    if len(missing):
+        u, v = edge_u[missing], edge_v[missing]
+        geoms[missing] = shapely.linestrings(np.stack([
+            np.column_stack([node_x[u], node_y[u]]),
+            np.column_stack([node_x[v], node_y[v]]),
+        ], axis=1))
+    xy, owner = shapely.get_coordinates(geoms, return_index=True)
+    counts = np.bincount(owner, minlength=len(geoms))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    # 形状が v→u 向きに保存されているエッジは反転しておく
+    first = xy[offsets[:-1]]
+    d_u = np.hypot(first[:, 0] - node_x[edge_u], first[:, 1] - node_y[edge_u])
+    d_v = np.hypot(first[:, 0] - node_x[edge_v], first[:, 1] - node_y[edge_v])
+    for e in np.flatnonzero(d_v < d_u):
+        lo, hi = offsets[e], offsets[e + 1]
+        xy[lo:hi] = xy[lo:hi][::-1]
+    return offsets, xy
+
+
+def graph_arrays(G):
+    # networkx のグラフ → ノード・エッジ配列（座標は G の座標系のまま）
+    nodes = list(G.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+    node_x = np.array([G.nodes[n]["x"] for n in nodes], dtype=np.float64)
+    node_y = np.array([G.nodes[n]["y"] for n in nodes], dtype=np.float64)
+    us, vs, lengths, geoms = [], [], [], []
+    for u, v, data in G.edges(data=True):
+        us.append(index[u])
+        vs.append(index[v])
+        lengths.append(data.get("length", 1))
+        geoms.append(data.get("geometry"))
+    edge_u = np.array(us, dtype=np.int64)
+    edge_v = np.array(vs, dtype=np.int64)
+    geom_offsets, geom_xy = pack_geometry(geoms, node_x, node_y, edge_u, edge_v)
+    return {
+        "node_ids": np.array(nodes),
+        "node_x": node_x,
+        "node_y": node_y,
+        "edge_u": edge_u,
+        "edge_v": edge_v,
+        "edge_length": np.array(lengths, dtype=np.float64),
+        "geom_offsets": geom_offsets,
+        "geom_xy": geom_xy,
+    }
+
+
+class AreaGraph:
+    # 投影済みグラフをノード/エッジ配列と CSR に展開して常駐させる。
+    # 検索ごとの状態は持たない（複数スレッドから読み取り専用で使う）。
+    # networkx のグラフ（G / G_proj）は配列に展開したら保持しない。
+
+    def __init__(self, place, G_proj, G=None):
+        arrays = graph_arrays(G_proj)
+        node_lat = node_lon = None
+        if G is not None:
+            nodes = arrays["node_ids"].tolist()
+            node_lat = np.array([G.nodes[n]["y"] for n in nodes], dtype=np.float64)
+            node_lon = np.array([G.nodes[n]["x"] for n in nodes], dtype=np.float64)
+        self._setup(place, G_proj.graph.get("crs", "EPSG:3857"), arrays, node_lat, node_lon)
+
+    @classmethod
+    def from_arrays(cls, place, crs, arrays, node_lat=None, node_lon=None):
+        # graph_arrays() と同じ形の投影済み配列から作る（タイルをつないだグラフなど）
+        area = cls.__new__(cls)
+        area._setup(place, crs, arrays, node_lat, node_lon)
+        return area
+
+    def _setup(self, place, crs, arrays, node_lat, node_lon):
+        self.place = place
+        self.crs = CRS.from_user_input(crs)
+        self.to_proj = Transformer.from_crs("EPSG:4326", self.crs, always_xy=True)
+        self.to_latlon = Transformer.from_crs(self.crs, "EPSG:4326", always_xy=True)
+
+        self.node_ids = arrays["node_ids"]
+        self.node_x = arrays["node_x"]
+        self.node_y = arrays["node_y"]
+        self.edge_u = arrays["edge_u"]
+        self.edge_v = arrays["edge_v"]
+        self.edge_length = arrays["edge_length"]
+        self.geom_offsets = arrays["geom_offsets"]
+        self.geom_xy = arrays["geom_xy"]
+        if node_lat is None:
+            node_lon, node_lat = self.to_latlon.transform(self.node_x, self.node_y)
+        self.node_lat = np.asarray(node_lat, dtype=np.float64)
+        self.node_lon = np.asarray(node_lon, dtype=np.float64)
+        self.node_tree = cKDTree(np.column_stack([self.node_x, self.node_y]))
+        self.edge_mid = np.column_stack([
+            (self.node_x[self.edge_u] + self.node_x[self.edge_v]) / 2,
+            (self.node_y[self.edge_u] + self.node_y[self.edge_v]) / 2,
+        ])
+        self._build_csr()
+        self._freeze()
+
+        self.crime_tree = None
+
+    def _freeze(self):
+        # セッション・スレッド間で共有するので書き換えられないようにしておく
+        for value in vars(self).values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+
+    @property
+    def n_nodes(self):
+        return len(self.node_x)
+
+    @property
+    def n_edges(self):
+        return len(self.edge_u)
+
+    def memory(self):
+        # 部品ごとのおおよそのバイト数
+        usage = {
+            "nodes": array_bytes(self.node_ids, self.node_x, self.node_y, self.node_lat, self.node_lon),
+            "node_tree": tree_bytes(self.node_tree),
+            "edges": array_bytes(self.edge_u, self.edge_v, self.edge_length, self.edge_mid),
+            "geometry": array_bytes(self.geom_offsets, self.geom_xy),
+            "csr": array_bytes(self.pair_order, self.pair_start, self.csr_indptr, self.csr_indices),
+            "crime_tree": tree_bytes(self.crime_tree),
+        }
+        usage["total"] = sum(usage.values())
+        return usage
+
+    def path_xy(self, path, edges):
+        # 経路上のエッジ形状をつなげた座標列（つなぎ目の重複点は除く）
+        if len(edges) == 0:
+            return np.column_stack([self.node_x[path[:1]], self.node_y[path[:1]]])
+        starts = self.geom_offsets[edges]
+        counts = self.geom_offsets[edges + 1] - starts
+        skip = np.ones(len(edges), dtype=np.int64)
+        skip[0] = 0
+        starts = starts + skip
+        counts = counts - skip
+        idx = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        return self.geom_xy[idx]
+
+    def _build_csr(self):
+        # 多重辺は (u, v) ペアにまとめ、重みは経路探索時にペア内の最小値を使う
+        order = np.lexsort((self.edge_v, self.edge_u))
+        su = self.edge_u[order]
+        sv = self.edge_v[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (su[1:] != su[:-1]) | (sv[1:] != sv[:-1])
+        self.pair_order = order
+        self.pair_start = np.flatnonzero(first)
+        counts = np.bincount(su[first], minlength=self.n_nodes)
+        self.csr_indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.csr_indices = sv[first]
+
+    def slot_weights(self, weights):
+        slot_w = np.minimum.reduceat(weights[self.pair_order], self.pair_start)
+        # csgraph は重み 0 の辺を「辺なし」と扱うことがあるので下限を付ける
+        return np.maximum(slot_w, 1e-6)
+
+    def csr(self, weights):
+        return csr_matrix(
+            (self.slot_weights(weights), self.csr_indices, self.csr_indptr),
+            shape=(self.n_nodes, self.n_nodes),
+        )
+
+    def bounds(self):
+        west, east = float(self.node_lon.min()), float(self.node_lon.max())
+        south, north = float(self.node_lat.min()), float(self.node_lat.max())
+        return (south, west, north, east)
+
+    def set_crime_points(self, crime_locations, version=None):
+        # エリア外の点はコストに効かないので、影響半径ぶんの余白の内側だけを木に入れる
+        self.crime_version = version
+        self.crime_tree = None
+        if crime_locations:
+            lats, lons = np.array(crime_locations, dtype=np.float64).T
+            xs, ys = self.to_proj.transform(lons, lats)
+            pad = CRIME_PENALTY[0]
+            inside = (
+                (xs >= self.node_x.min() - pad) & (xs <= self.node_x.max() + pad)
+                & (ys >= self.node_y.min() - pad) & (ys <= self.node_y.max() + pad)
+            )
+            if inside.any():
+                self.crime_tree = cKDTree(np.column_stack([xs[inside], ys[inside]]))
+
+    def with_crime_points(self, crime_locations, version=None):
+        # 配列は共有したまま犯罪インデックスだけ差し替えた別オブジェクト（検索中のリクエストは古い方を使い続ける）
+        area = copy.copy(self)
+        area.set_crime_points(crime_locations, version)
+        return area
+
+    def project(self, latlon):
+        return self.to_proj.transform(latlon[1], latlon[0])
+
+    def nearest_node(self, latlon):
+        x, y = self.project(latlon)
+        _, i = self.node_tree.query([x, y])
+        return int(i)
+
+    def path_edges(self, path, weights):
+        return select_path_edges(
+            self.csr_indptr, self.csr_indices, self.pair_order, self.pair_start, weights, path
+        )
+
+    def bbox_around(self, nodes, buffer=ROUTE_BUFFER):
+        xs = self.node_x[nodes]
+        ys = self.node_y[nodes]
+        west, south = self.to_latlon.transform(xs.min() - buffer, ys.min() - buffer)
+        east, north = self.to_latlon.transform(xs.max() + buffer, ys.max() + buffer)
+        return (south, west, north, east)
+
+    def edges_in_bbox(self, bbox):
+        south, west, north, east = bbox
+        u_in = (
+            (self.node_lat[self.edge_u] >= south) & (self.node_lat[self.edge_u] <= north)
+            & (self.node_lon[self.edge_u] >= west) & (self.node_lon[self.edge_u] <= east)
+        )
+        v_in = (
+            (self.node_lat[self.edge_v] >= south) & (self.node_lat[self.edge_v] <= north)
+            & (self.node_lon[self.edge_v] >= west) & (self.node_lon[self.edge_v] <= east)
+        )
+        return np.flatnonzero(u_in | v_in)
+
+    def one_way_edges(self, edges):
+        # 往復エッジ (u→v, v→u) は描画用に片方だけ残す
+        u = self.edge_u[edges]
+        v = self.edge_v[edges]
+        n = self.n_nodes
+        keep = (u < v) | ~np.isin(u * n + v, v * n + u)
+        return edges[keep]
+
+    def edge_coords(self, edges):
+        # (エッジ数, 2, 2) の [[lon, lat], [lon, lat]] 配列
+        u = self.edge_u[edges]
+        v = self.edge_v[edges]
+        return np.stack([
+            np.column_stack([self.node_lon[u], self.node_lat[u]]),
+            np.column_stack([self.node_lon[v], self.node_lat[v]]),
+        ], axis=1)
+
+    def edge_lines(self, edges, precision=5):
+        # 描画用の線分リスト（座標は丸めて量子化）
+        return np.round(self.edge_coords(edges), precision).tolist()
+
+
+def select_path_edges(indptr, indices, pair_order, pair_start, weights, path):
+    # ノード列 → 使用したエッジ番号（多重辺は重みが最小のもの）。経路全体をまとめて引く
+    path = np.asarray(path, dtype=np.int64)
+    if len(path) < 2:
+        return np.zeros(0, dtype=np.int64)
+    a, b = path[:-1], path[1:]
+    # (a, b) の行の中で b を二分探索（csr_indices は行ごとに昇順）。次数は小さいので数回で終わる
+    lo, hi = indptr[a], indptr[a + 1]
+    last = max(len(indices) - 1, 0)
+    while True:
+        active = lo < hi
+        if not active.any():
+            break
+        mid = (lo + hi) // 2
+        right = active & (indices[np.minimum(mid, last)] < b)
+        lo = np.where(right, mid + 1, lo)
+        hi = np.where(active & ~right, mid, hi)
+    # ペアごとの多重辺を並べ、グループ内で最初に最小の重みになるものを選ぶ
+    starts = pair_start[lo]
+    nxt = lo + 1
+    ends = np.where(nxt < len(pair_start), pair_start[np.minimum(nxt, len(pair_start) - 1)], len(pair_order))
+    counts = ends - starts
+    offsets = np.cumsum(counts) - counts
+    members = pair_order[np.repeat(starts - offsets, counts) + np.arange(counts.sum())]
+    w = weights[members]
+    hit = np.flatnonzero(w == np.repeat(np.minimum.reduceat(w, offsets), counts))
+    group = np.repeat(np.arange(len(counts)), counts)[hit]
+    first = np.ones(len(hit), dtype=bool)
+    first[1:] = group[1:] != group[:-1]
+    return members[hit[first]].astype(np.int64)
+
+
+def walk_predecessors(pred, src, dst):
+    if src != dst and pred[dst] < 0:
+        raise NoRouteError("出発地から目的地までのルートが見つかりません")
+    path = [dst]
+    while path[-1] != src:
+        path.append(int(pred[path[-1]]))
+    path.reverse()
+    return path
+
+
+def shortest_path(area, weights, src, dst):
+    _, pred = dijkstra(area.csr(weights), directed=True, indices=src, return_predecessors=True)
+    return walk_predecessors(pred, src, dst)
+
+
+def _proximity(tree, points, radius, factor):
+    if tree is None:
+        return np.zeros(len(points))
+    d, _ = tree.query(points)
+    return np.maximum(0, radius - d) * factor
+
+
+def edge_safety_costs(mids, lengths, crime_tree, poi_trees):
+    # エッジ中点・長さの配列（全体でも一部の区間でもよい）に対する安全コスト
+    crime_penalty = _proximity(crime_tree, mids, *CRIME_PENALTY)
+    poi_bonus = (
+        _proximity(poi_trees.get("street_lamps"), mids, *LAMP_BONUS)
+        + _proximity(poi_trees.get("convenience_stores"), mids, *STORE_BONUS)
+        + _proximity(poi_trees.get("kobans"), mids, *KOBAN_BONUS)
+    )
+    return np.maximum(1, lengths + crime_penalty - poi_bonus)
+
+
+def compute_safety_costs(area, poi_trees):
+    return edge_safety_costs(area.edge_mid, area.edge_length, area.crime_tree, poi_trees)
+
+
+def build_poi_trees(area, pois):
+    trees = {}
+    for kind, points in pois.items():
+        if points:
+            lats = np.array([p[0] for p in points], dtype=np.float64)
+            lons = np.array([p[1] for p in points], dtype=np.float64)
+            xs, ys = area.to_proj.transform(lons, lats)
+            trees[kind] = cKDTree(np.column_stack([xs, ys]))
+    return trees
+
+
+def simplify_tolerance(lat, zoom, px=SIMPLIFY_PX):
+    # ズーム zoom で px ピクセルに相当する距離 (m)
+    return 156543.03392 * math.cos(math.radians(lat)) / 2 ** zoom * px
+
+
+def route_polyline(area, xy, zoom=None, precision=6):
+    # 投影座標の経路を Douglas–Peucker で簡略化して [(lat, lon), ...] にする
+    if zoom is not None and len(xy) > 2:
+        tol = simplify_tolerance(float(area.node_lat.mean()), zoom)
+        line = shapely.simplify(shapely.linestrings(xy), tol, preserve_topology=False)
+        xy = shapely.get_coordinates(line)
+    lon, lat = area.to_latlon.transform(xy[:, 0], xy[:, 1])
+    return list(zip(np.round(lat, precision).tolist(), np.round(lon, precision).tolist()))
+
+
+def route_metrics(area, path, weights, safety_cost, zoom=None):
+    edges = area.path_edges(path, weights)
+    total_length = float(area.edge_length[edges].sum())
+    total_safety_cost = float(safety_cost[edges].sum())
+    # 危険度（小さいほど安全）
+    danger_score = total_safety_cost / total_length if total_length > 0 else float("inf")
+    xy = area.path_xy(path, edges)
+    return {
+        "nodes": path,
+        "edges": edges,
+        "latlon": route_polyline(area, xy, zoom),
+        "n_points": len(xy),
+        "length": total_length,
+        "geometry_length": float(np.hypot(*np.diff(xy, axis=0).T).sum()),
+        "safety_cost": total_safety_cost,
+        "danger_score": danger_score,
+    }
+
+
+# -----------------------
+# --- エンジン本体 ---
+# -----------------------
+class RoutingEngine:
+    # グラフ・犯罪インデックス・POI をプロセス内にキャッシュして使い回す
+    # memory_budget (bytes) を超えたら最も長く使われていないエリアから追い出す（None なら件数のみで制限）
+    # data_version は犯罪データ・POI が差し替わるたびに変わる（下流のキャッシュのキーに使う）
+
+    def __init__(self, max_areas=4, max_poi_entries=64, crime_csv=CRIME_CSV, memory_budget=None, max_tiles=64,
+                 poi_ttl=POI_TTL, cost_pool=None, report_signal=None):
+        self.max_areas = max_areas
+        self.max_poi_entries = max_poi_entries
+        self.max_tiles = max_tiles
+        self.poi_ttl = poi_ttl
+        # 大きなグラフのコスト計算を任せるプロセスプール（parallel_costs.CostPool、None なら同じスレッドで計算）
+        self.cost_pool = cost_pool
+        # 掲示板の投稿による加減点（report_signal.ReportSignal、None なら使わない）
+        self.report_signal = report_signal
+        self.memory_budget = memory_budget if memory_budget is not None else default_budget()
+        self.crime_csv = Path(crime_csv)
+        self.crime_locations = load_crime_locations(crime_csv)
+        self.crime_version = file_version(crime_csv)
+        self.crime_heatmap = CrimeHeatmap(self.crime_locations, self.crime_version)
+        self._generation = 0
+        self.data_version = f"{self.crime_version}.0"
+        self._areas = OrderedDict()
+        self._pois = OrderedDict()
+        self._poi_meta = {}
+        self._poi_refreshing = set()
+        self._watcher = None
+        self._tiles = OrderedDict()
+        self._tile_sizes = {}
+        self._tile_locks = {}
+        self._area_costs = {}
+        self._lock = threading.Lock()
+        self._area_locks = {}
+        # Overpass などの I/O 待ちと、バックグラウンドで進める検索段階用
+        self._io_pool = ThreadPoolExecutor(max_workers=6, thread_name_prefix="nightwalk-io")
+        self._stage_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="nightwalk-stage")
+
+    # --- エリアグラフ ---
+    def add_area(self, area):
+        with self._lock:
+            locations, version = self.crime_locations, self.crime_version
+        area.set_crime_points(locations, version)
+        with self._lock:
+            self._areas[area.place] = area
+            self._areas.move_to_end(area.place)
+            while len(self._areas) > self.max_areas:
+                self._evict_area()
+            self._enforce_budget()
+        return area
+
+    def _evict_area(self):
+        evicted, _ = self._areas.popitem(last=False)
+        for with_pois in (True, False):
+            self._area_costs.pop((evicted, with_pois), None)
+        if self.report_signal is not None:
+            self.report_signal.drop(evicted)
+        count("area_cache.evict")
+
+    def _evict_pois(self):
+        key, _ = self._pois.popitem(last=False)
+        self._poi_meta.pop(key, None)
+
+    def _evict_tile(self):
+        key, _ = self._tiles.popitem(last=False)
+        self._tile_sizes.pop(key, None)
+        count("tile_cache.evict")
+
+    def _resident_bytes(self):
+        total = sum(a.memory()["total"] for a in self._areas.values())
+        total += sum(c.nbytes for c in self._area_costs.values())
+        total += sum(m["bytes"] for m in self._poi_meta.values())
+        total += sum(self._tile_sizes.values())
+        if self.report_signal is not None:
+            total += self.report_signal.nbytes
+        return total + self.crime_heatmap.nbytes
+
+    def _enforce_budget(self):
+        # self._lock を持った状態で呼ぶ。直近に使ったエリア 1 つは必ず残す
+        if self.memory_budget is None:
+            return
+        while len(self._areas) > 1 and self._resident_bytes() > self.memory_budget:
+            self._evict_area()
+        while self._tiles and self._resident_bytes() > self.memory_budget:
+            self._evict_tile()
+        while self._pois and self._resident_bytes() > self.memory_budget:
+            self._evict_pois()
+
+    def memory_report(self):
+        # 常駐しているグラフ・インデックス・キャッシュのバイト数
+        with self._lock:
+            areas = {place: area.memory() for place, area in self._areas.items()}
+            costs = {f"{place}:{'pois' if p else 'crime'}": c.nbytes for (place, p), c in self._area_costs.items()}
+            pois = sum(m["bytes"] for m in self._poi_meta.values())
+            n_pois = len(self._pois)
+            tiles = sum(self._tile_sizes.values())
+            n_tiles = len(self._tiles)
+        crime = self.crime_heatmap.nbytes
+        reports = self.report_signal.nbytes if self.report_signal is not None else 0
+        total = sum(a["total"] for a in areas.values()) + sum(costs.values()) + pois + tiles + crime + reports
+        return {
+            "budget": self.memory_budget,
+            "total": total,
+            "areas": areas,
+            "area_costs": costs,
+            "pois": {"entries": n_pois, "bytes": pois},
+            "tiles": {"entries": n_tiles, "bytes": tiles},
+            "crime_heatmap": crime,
+            "reports": reports,
+            "data_version": self.data_version,
+        }
+
+    def area(self, place):
+        with self._lock:
+            if place in self._areas:
+                self._areas.move_to_end(place)
+                count("area_cache.hit")
+                return self._areas[place]
+            lock = self._area_locks.setdefault(place, threading.Lock())
+        # 同じエリアを複数リクエストが同時に読み込まないようにする
+        with lock:
+            with self._lock:
+                if place in self._areas:
+                    count("area_cache.hit")
+                    return self._areas[place]
+            count("area_cache.miss")
+            with span("graph.load", place=place) as sp:
+                if is_tiles_name(place):
+                    area = self._stitch_tiles(place)
+                else:
+                    with span("graph.download"):
+                        G = safe_graph_from_place(place)
+                    with span("graph.project"):
+                        G_proj = ox.project_graph(G)
+                    with span("graph.index"):
+                        area = AreaGraph(place, G_proj, G)
+                    # 配列に展開したら networkx のグラフは不要
+                    del G, G_proj
+                area = self.add_area(area)
+                sp.set(nodes=area.n_nodes, edges=area.n_edges, bytes=area.memory()["total"])
+            return area
+
+    def coverage(self, points, place=None, pad=TILE_PAD):
+        # place が無ければ、points を囲む範囲のタイルをつないだグラフを使う
+        if place:
+            return self.area(place)
+        return self.area(tiles_name(tiles_for(points, pad)))
+
+    # --- タイル ---
+    def tile(self, key):
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                count("tile_cache.hit")
+                return self._tiles[key]
+            lock = self._tile_locks.setdefault(key, threading.Lock())
+        with lock:
+            with self._lock:
+                if key in self._tiles:
+                    count("tile_cache.hit")
+                    return self._tiles[key]
+            count("tile_cache.miss")
+            with span("graph.tile", tile=f"{key[0]}_{key[1]}") as sp:
+                G = download_tile(key)
+                # タイルは経緯度のまま配列で持つ（投影はつないだ後にまとめて行う）
+                arrays = graph_arrays(G) if G is not None else None
+                del G
+                size = array_bytes(*arrays.values()) if arrays else 0
+                sp.set(edges=len(arrays["edge_u"]) if arrays else 0, bytes=size)
+            with self._lock:
+                self._tiles[key] = arrays
+                self._tile_sizes[key] = size
+                while len(self._tiles) > self.max_tiles:
+                    self._evict_tile()
+                self._enforce_budget()
+            return arrays
+
+    def _stitch_tiles(self, name):
+        keys = parse_tiles_name(name)
+        futures = [submit(self._io_pool, self.tile, key) for key in keys]
+        tiles = [f.result() for f in futures]
+        with span("graph.stitch", tiles=len(keys)):
+            arrays = stitch(tiles)
+            lat, lon = arrays["node_y"], arrays["node_x"]
+            crs = utm_crs(float(lat.mean()), float(lon.mean()))
+            to_proj = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+            arrays["node_x"], arrays["node_y"] = to_proj.transform(lon, lat)
+            gx, gy = to_proj.transform(arrays["geom_xy"][:, 0], arrays["geom_xy"][:, 1])
+            arrays["geom_xy"] = np.column_stack([gx, gy])
+            return AreaGraph.from_arrays(name, crs, arrays, lat, lon)
+
+    # --- POI ---
+    def pois(self, bbox, cancel=None):
+        key = _poi_key(bbox)
+        with self._lock:
+            if key in self._pois:
+                self._pois.move_to_end(key)
+                count("poi_cache.hit")
+                if self._poi_expired(key):
+                    self._poi_refreshing.add(key)
+                    submit(self._stage_pool, self._refresh_pois, key)
+                return self._pois[key], []
+        count("poi_cache.miss")
+        pois, warnings, complete = self._fetch_pois(bbox, cancel)
+        # 取得に失敗したものはキャッシュしない（次回再取得）
+        if complete:
+            self._store_pois(key, pois)
+        return pois, warnings
+
+    def _fetch_pois(self, bbox, cancel=None):
+        # 3 種類の Overpass 問い合わせは並列に投げる
+        futures = {
+            kind: submit(self._io_pool, _load_poi, kind, loader, bbox)
+            for kind, (loader, _) in POI_LOADERS.items()
+        }
+        pois, warnings, complete = {}, [], True
+        for kind, future in futures.items():
+            try:
+                pois[kind] = _wait(future, cancel)
+            except SearchCancelled:
+                for f in futures.values():
+                    f.cancel()
+                raise
+            except Exception as e:
+                warnings.append(f"{POI_LOADERS[kind][1]}取得失敗: {e}")
+                pois[kind] = []
+                complete = False
+        return pois, warnings, complete
+
+    def _poi_expired(self, key):
+        # self._lock を持った状態で呼ぶ
+        return key not in self._poi_refreshing and time.time() - self._poi_meta[key]["fetched"] > self.poi_ttl
+
+    def _store_pois(self, key, pois):
+        # 内容が前回と同じなら取得時刻だけ更新する。変わっていれば差し替えて True
+        meta = {"bytes": poi_bytes(pois), "hash": _content_hash(pois), "fetched": time.time()}
+        with self._lock:
+            old = self._poi_meta.get(key)
+            if old and old["hash"] == meta["hash"]:
+                old["fetched"] = meta["fetched"]
+                return False
+            self._pois[key] = pois
+            self._poi_meta[key] = meta
+            while len(self._pois) > self.max_poi_entries:
+                self._evict_pois()
+            self._enforce_budget()
+            if old:
+                self._bump_version()
+            return old is not None
+
+    def _refresh_pois(self, key):
+        try:
+            with span("refresh.pois") as sp:
+                pois, _, complete = self._fetch_pois(key)
+                changed = complete and self._store_pois(key, pois)
+                sp.set(changed=changed)
+            if changed:
+                count("poi_cache.changed")
+                # この範囲の POI を使っていたエリア全体のコストを作り直す
+                with self._lock:
+                    areas = {p: a for p, a in self._areas.items() if _poi_key(a.bounds()) == key}
+                self._swap_costs(areas, with_pois_only=True)
+        except Exception as e:
+            logger.warning("POI の再取得に失敗: %s: %s", key, e)
+        finally:
+            with self._lock:
+                self._poi_refreshing.discard(key)
+
+    def area_costs(self, place, with_pois=True):
+        # エリア全体の安全コスト（一括ルート検索・等時線などで使い回す）
+        # 投稿の加減点はキャッシュに含めず、返すときに足す
+        key = (place, with_pois)
+        with self._lock:
+            cached = self._area_costs.get(key)
+            area = self._areas.get(place)
+        if cached is not None:
+            count("area_costs_cache.hit")
+            return self.report_costs(area, cached), []
+        count("area_costs_cache.miss")
+        area = self.area(place)
+        pois, warnings = self.pois(area.bounds()) if with_pois else ({}, [])
+        with span("costing", edges=area.n_edges):
+            costs = self.safety_costs(area, pois)
+        costs.flags.writeable = False
+        if not warnings:
+            with self._lock:
+                # 計算中に犯罪データが差し替わっていたら保存しない
+                if self._areas.get(place) is area:
+                    self._area_costs[key] = costs
+                    self._enforce_budget()
+        return self.report_costs(area, costs), warnings
+
+    def safety_costs(self, area, pois):
+        poi_trees = build_poi_trees(area, pois)
+        if self.cost_pool is not None and self.cost_pool.worth(area):
+            return self.cost_pool.costs(area, poi_trees)
+        return compute_safety_costs(area, poi_trees)
+
+    def report_costs(self, area, costs):
+        # 掲示板の投稿の近くのエッジを加減点する（エリアごとの配列を足すだけで DB は読まない）
+        if self.report_signal is None:
+            return costs
+        with span("costing.reports"):
+            adjust = self.report_signal.edge_adjust(area)
+        return np.maximum(1, costs + adjust)
+
+    def _swap_costs(self, areas, with_pois_only=False):
+        # areas = {place: 新しい AreaGraph}。キャッシュ済みのエリア全体コストを作り直してから差し替える
+        with self._lock:
+            keys = [k for k in self._area_costs if k[0] in areas and (k[1] or not with_pois_only)]
+        fresh = {}
+        for place, with_pois in keys:
+            area = areas[place]
+            pois = {}
+            if with_pois:
+                with self._lock:
+                    pois = self._pois.get(_poi_key(area.bounds()))
+                if pois is None:
+                    continue
+            with span("costing", edges=area.n_edges):
+                costs = self.safety_costs(area, pois)
+            costs.flags.writeable = False
+            fresh[(place, with_pois)] = costs
+        with self._lock:
+            for key in keys:
+                if key in fresh:
+                    self._area_costs[key] = fresh[key]
+                else:
+                    self._area_costs.pop(key, None)
+
+    # --- データの更新 ---
+    def _bump_version(self):
+        # self._lock を持った状態で呼ぶ
+        self._generation += 1
+        self.data_version = f"{self.crime_version}.{self._generation}"
+
+    def refresh_crime(self):
+        # 犯罪データ CSV の内容が変わっていれば、犯罪点が変わったエリアの
+        # 犯罪インデックス・ヒートマップ・エリア全体コストだけを作り直して差し替える
+        version = file_version(self.crime_csv)
+        if version == self.crime_version:
+            return False
+        with span("refresh.crime", version=version) as sp:
+            locations = load_crime_locations(self.crime_csv)
+            heatmap = CrimeHeatmap(locations, version)
+            with self._lock:
+                areas = dict(self._areas)
+            rebuilt = {}
+            for place, area in areas.items():
+                new = area.with_crime_points(locations, version)
+                if not _same_points(area.crime_tree, new.crime_tree):
+                    rebuilt[place] = new
+            self._swap_costs(rebuilt)
+            with self._lock:
+                for place, area in areas.items():
+                    if self._areas.get(place) is not area:
+                        continue
+                    if place in rebuilt:
+                        self._areas[place] = rebuilt[place]
+                    else:
+                        area.crime_version = version
+                self.crime_locations = locations
+                self.crime_version = version
+                self.crime_heatmap = heatmap
+                self._bump_version()
+                # 差し替えの途中で読み込まれたエリアは古い犯罪データで作られている
+                stale = [p for p, a in self._areas.items() if a.crime_version != version]
+                for place in stale:
+                    self._areas[place] = self._areas[place].with_crime_points(locations, version)
+                    for with_pois in (True, False):
+                        self._area_costs.pop((place, with_pois), None)
+            sp.set(points=len(locations), areas=len(areas), rebuilt=len(rebuilt) + len(stale))
+        return True
+
+    def refresh(self, preprocess=False):
+        # preprocess=True なら data/ の元 CSV の変更も見て crime_geocoded.csv を作り直す（新しい住所だけジオコード）
+        if preprocess:
+            refresh_crime_csv(
+                data_dir=self.crime_csv.parent,
+                out_path=self.crime_csv,
+                manifest_path=self.crime_csv.parent / "crime_sources.json",
+            )
+        changed = self.refresh_crime()
+        if self.report_signal is not None:
+            self.report_signal.sync(force=True)
+        with self._lock:
+            expired = [k for k in self._pois if self._poi_expired(k)]
+            self._poi_refreshing.update(expired)
+        for key in expired:
+            submit(self._stage_pool, self._refresh_pois, key)
+        return changed
+
+    def start_watcher(self, interval=300, preprocess=False):
+        # interval 秒ごとに refresh() するデーモンスレッド
+        if self._watcher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh(preprocess)
+                except Exception as e:
+                    logger.warning("データ更新に失敗: %s", e)
+
+        self._watcher = threading.Thread(target=loop, name="nightwalk-refresh", daemon=True)
+        self._watcher.start()
+
+    # --- パイプライン各段 ---
+    def resolve(self, point):
+        if isinstance(point, str):
+            hits = geocode_cached.cache_info().hits
+            try:
+                with span("geocode"):
+                    latlon = tuple(geocode_cached(point))
+            except Exception as e:
+                raise GeocodeError(f"住所変換エラー: {e}")
+            count("geocode_cache.hit" if geocode_cached.cache_info().hits > hits else "geocode_cache.miss")
+            return latlon
+        lat, lon = point
+        return (float(lat), float(lon))
+
+    def plan(self, origin, destination, place=None):
+        # place を省略すると出発地・目的地を囲むタイルだけを読み込む
+        orig_latlon = self.resolve(origin)
+        dest_latlon = self.resolve(destination)
+        area = self.coverage([orig_latlon, dest_latlon], place)
+        with span("snap"):
+            orig_node = area.nearest_node(orig_latlon)
+            dest_node = area.nearest_node(dest_latlon)
+        return {
+            "place": area.place,
+            "data_version": self.data_version,
+            "area": area,
+            "origin": orig_latlon,
+            "destination": dest_latlon,
+            "orig_node": orig_node,
+            "dest_node": dest_node,
+            "warnings": [],
+        }
+
+    def shortest_route(self, req):
+        area = req["area"]
+        with span("route.shortest") as sp:
+            path = shortest_path(area, area.edge_length, req["orig_node"], req["dest_node"])
+            sp.set(path_nodes=len(path))
+        req["shortest_path"] = path
+        req["bbox"] = area.bbox_around(path)
+        return path
+
+    def load_pois(self, req, cancel=None):
+        with span("pois") as sp:
+            pois, warnings = self.pois(req["bbox"], cancel)
+            sp.set(**{kind: len(points) for kind, points in pois.items()})
+        req["pois"] = pois
+        req["warnings"].extend(warnings)
+        return pois
+
+    def start_pois(self, req, cancel=None):
+        # 最短ルートを先に表示している間に POI を取得する
+        return submit(self._stage_pool, self.load_pois, req, cancel)
+
+    def safety_route(self, req):
+        area = req["area"]
+        with span("costing", edges=area.n_edges):
+            costs = self.safety_costs(area, req["pois"])
+        costs = self.report_costs(area, costs)
+        req["safety_cost"] = costs
+        with span("route.safety") as sp:
+            path = shortest_path(area, costs, req["orig_node"], req["dest_node"])
+            sp.set(path_nodes=len(path))
+        req["safety_path"] = path
+        return path
+
+    def describe_route(self, req, kind, zoom=None):
+        # 安全コストがまだ無い段階（最短ルートのみ）では長さをコストとして扱う
+        area = req["area"]
+        costs = req.get("safety_cost", area.edge_length)
+        weights = area.edge_length if kind == "shortest" else costs
+        with span("route.metrics", kind=kind) as sp:
+            route = route_metrics(area, req[f"{kind}_path"], weights, costs, zoom)
+            sp.set(points=route["n_points"], drawn_points=len(route["latlon"]))
+        return route
+
+    def search(self, origin, destination, place=None, mode="safety", zoom=None):
+        with span("search", place=place, mode=mode):
+            req = self.plan(origin, destination, place)
+            self.shortest_route(req)
+            self.load_pois(req)
+            self.safety_route(req)
+            return self.result(req, mode, zoom)
+
+    def result(self, req, mode="safety", zoom=None):
+        area = req["area"]
+        costs = req["safety_cost"]
+        routes = {
+            "shortest": self.describe_route(req, "shortest", zoom),
+            "safety": self.describe_route(req, "safety", zoom),
+        }
+        return {
+            "place": req["place"],
+            "mode": mode,
+            "origin": req["origin"],
+            "destination": req["destination"],
+            "bbox": req["bbox"],
+            "routes": routes,
+            "route": routes[mode],
+            "pois": req["pois"],
+            "warnings": req["warnings"],
+            "area": area,
+            "safety_cost": costs,
+            "data_version": req["data_version"],
+        }
+
+
+def _poi_key(bbox):
+    return tuple(round(c, 4) for c in bbox)
+
+
+def _content_hash(pois):
+    body = json.dumps(pois, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()[:12]
+
+
+def _same_points(a, b):
+    if a is None or b is None:
+        return a is b
+    return a.data.shape == b.data.shape and np.array_equal(a.data, b.data)
+
+
+def _load_poi(kind, loader, bbox):
+    with span(f"overpass.{kind}") as sp:
+        points = loader(bbox)
+        sp.set(points=len(points))
+    return points
+
+
+def _wait(future, cancel, poll=0.2):
+    # cancel（threading.Event）が立ったら待つのをやめる
+    while True:
+        if cancel is not None and cancel.is_set():
+            raise SearchCancelled("検索は中止されました")
+        try:
+            return future.result(timeout=poll)
+        except FutureTimeout:
+            continue
+
+
+def _score(value):
+    # JSON に Infinity を出さない
+    return round(value, 4) if np.isfinite(value) else None
+
+
+def route_feature(route, kind):
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [[lon, lat] for lat, lon in route["latlon"]],
+        },
+        "properties": {
+            "kind": kind,
+            "length": round(route["length"], 1),
+            "geometry_length": round(route["geometry_length"], 1),
+            "safety_cost": round(route["safety_cost"], 1),
+            "danger_score": _score(route["danger_score"]),
+        },
+    }
+
+
+def to_geojson(result, include_pois=False):
+    features = [route_feature(r, kind) for kind, r in result["routes"].items()]
+    for label, (lat, lon) in (("origin", result["origin"]), ("destination", result["destination"])):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"kind": label},
+        })
+    if include_pois:
+        for kind, points in result["pois"].items():
+            features.extend({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {"kind": kind, "name": tags.get("name")},
+            } for lat, lon, tags in points)
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "properties": {
+            "place": result["place"],
+            "mode": result["mode"],
+            "bbox": list(result["bbox"]),
+            "danger_score": _score(result["route"]["danger_score"]),
+            "warnings": result["warnings"],
+            "data_version": result["data_version"],
+        },
+    }
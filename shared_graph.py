@@ -0,0 +1,60 @@
+# shared_graph.py
+# 読み取り専用の numpy 配列を共有メモリに置き、ワーカープロセスからコピーなしで参照する。
+# ワーカーへ渡すのは spec（共有メモリ名・shape・dtype）だけなので、グラフを pickle しない。
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArrays:
+    def __init__(self, arrays):
+        self._blocks = []
+        self.spec = {}
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            self._blocks.append(shm)
+            self.spec[name] = (shm.name, arr.shape, arr.dtype.str)
+
+    @property
+    def nbytes(self):
+        return sum(shm.size for shm in self._blocks)
+
+    def close(self):
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(spec, writable=()):
+    # 戻り値の handles はプロセス終了まで保持しておくこと（GC されると配列が無効になる）
+    # writable に挙げた配列（ワーカーの出力先）以外は読み取り専用にする
+    arrays, handles = {}, []
+    for name, (shm_name, shape, dtype) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        arr.flags.writeable = name in writable
+        arrays[name] = arr
+        handles.append(shm)
+    return arrays, handles
+
+
+def routing_arrays(area, safety_cost):
+    # 経路探索と指標計算に必要な配列だけを共有する
+    return {
+        "indptr": area.csr_indptr.astype(np.int32),
+        "indices": area.csr_indices.astype(np.int32),
+        "pair_order": area.pair_order,
+        "pair_start": area.pair_start,
+        "edge_length": area.edge_length,
+        "safety_cost": np.asarray(safety_cost, dtype=np.float64),
+        "slot_safety": area.slot_weights(safety_cost),
+    }
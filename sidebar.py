@@ -1,6 +1,7 @@
 # sidebar.py
 import streamlit as st
 from auth_db import login, signup
+from passwords import AuthBusy
 
 def render_sidebar():
     st.sidebar.title("🌙 NightWalk")
@@ -27,12 +28,15 @@ def render_sidebar():
                 p = st.text_input("パスワード", type="password")
                 ok = st.form_submit_button("ログイン")
             if ok:
-                user = login(u, p)
+                try:
+                    user, error = login(u, p, ip=st.context.ip_address), "ログイン失敗"
+                except AuthBusy as e:
+                    user, error = None, str(e)
                 if user:
                     st.session_state["user"] = user
                     st.rerun()
                 else:
-                    st.error("ログイン失敗")
+                    st.error(error)
 
         elif mode == "新規登録":
             with st.sidebar.form("signup_form"):
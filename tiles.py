@@ -0,0 +1,121 @@
+# tiles.py
+# 固定タイル単位の歩行者グラフ（県全域を一度に読まず、OD の範囲に必要なタイルだけを使う）
+#
+# タイルは緯度・経度 TILE_DEG 度の格子で、キーは (i, j) = (floor(lat / TILE_DEG), floor(lon / TILE_DEG))。
+# 各タイルは境界をまたぐエッジも含めて取得する（truncate_by_edge）ので、
+# 隣り合うタイルは OSM のノード ID を共有し、つなぐだけで境界の道路が連結される。
+import math
+
+import numpy as np
+import osmnx as ox
+# 公開の場所がない例外なので非公開の osmnx._errors から読む（requirements.txt で 2.x までに固定）
+from osmnx._errors import InsufficientResponseError
+from pyproj import CRS
+
+TILE_DEG = 0.05
+# OD を囲む範囲の外側に確保する余白 (m)。遠回りのルートが範囲外に出ないように
+TILE_PAD = 1000
+TILE_PREFIX = "tiles:"
+# 1 回に読み込むタイル数の上限（徒歩ルートとしては十分な約 30 km 四方）
+MAX_TILES = 36
+M_PER_DEG = 111_320.0
+
+
+def tile_of(lat, lon):
+    return (math.floor(lat / TILE_DEG), math.floor(lon / TILE_DEG))
+
+
+def tile_bbox(key):
+    i, j = key
+    return (i * TILE_DEG, j * TILE_DEG, (i + 1) * TILE_DEG, (j + 1) * TILE_DEG)
+
+
+def tiles_for(points, pad=TILE_PAD):
+    # 点の外接矩形を pad (m) 広げた範囲にかかるタイル
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    dlat = pad / M_PER_DEG
+    dlon = pad / (M_PER_DEG * math.cos(math.radians(sum(lats) / len(lats))))
+    i0, j0 = tile_of(min(lats) - dlat, min(lons) - dlon)
+    i1, j1 = tile_of(max(lats) + dlat, max(lons) + dlon)
+    n = (i1 - i0 + 1) * (j1 - j0 + 1)
+    if n > MAX_TILES:
+        raise ValueError(f"範囲が広すぎます（タイル {n} 枚 > {MAX_TILES}）")
+    return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+
+def tiles_name(keys):
+    return TILE_PREFIX + "+".join(f"{i}_{j}" for i, j in sorted(keys))
+
+
+def parse_tiles_name(name):
+    body = name[len(TILE_PREFIX):]
+    return [tuple(int(v) for v in part.split("_")) for part in body.split("+") if part]
+
+
+def is_tiles_name(place):
+    return isinstance(place, str) and place.startswith(TILE_PREFIX)
+
+
+def download_tile(key):
+    # 道路のないタイル（海・山林など）は None
+    south, west, north, east = tile_bbox(key)
+    try:
+        try:
+            return ox.graph_from_bbox(
+                (west, south, east, north), network_type="walk", truncate_by_edge=True, retain_all=True
+            )
+        except TypeError:
+            # osmnx 1.x は (north, south, east, west) の位置引数
+            return ox.graph_from_bbox(
+                north, south, east, west, network_type="walk", truncate_by_edge=True, retain_all=True
+            )
+    except (ValueError, InsufficientResponseError):
+        return None
+
+
+def _take_geometry(offsets, xy, edges):
+    counts = offsets[edges + 1] - offsets[edges]
+    idx = np.repeat(offsets[edges] - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64), xy[idx]
+
+
+def stitch(tiles):
+    # タイルの配列（経緯度、エッジ端点はタイル内の番号）を 1 つにつなぐ。
+    # 境界をまたぐエッジは両側のタイルに入っているので 1 本にまとめる
+    tiles = [t for t in tiles if t is not None and len(t["edge_u"])]
+    if not tiles:
+        raise ValueError("範囲内に道路がありません")
+    ids = np.concatenate([t["node_ids"] for t in tiles])
+    node_ids, first = np.unique(ids, return_index=True)
+    node_x = np.concatenate([t["node_x"] for t in tiles])[first]
+    node_y = np.concatenate([t["node_y"] for t in tiles])[first]
+
+    u = np.searchsorted(node_ids, np.concatenate([t["node_ids"][t["edge_u"]] for t in tiles]))
+    v = np.searchsorted(node_ids, np.concatenate([t["node_ids"][t["edge_v"]] for t in tiles]))
+    length = np.concatenate([t["edge_length"] for t in tiles])
+    base = np.cumsum([0] + [len(t["geom_xy"]) for t in tiles[:-1]])
+    offsets = np.concatenate(
+        [t["geom_offsets"][:-1] + b for t, b in zip(tiles, base)] + [[sum(len(t["geom_xy"]) for t in tiles)]]
+    ).astype(np.int64)
+    xy = np.concatenate([t["geom_xy"] for t in tiles])
+
+    key = np.column_stack([u, v, np.round(length * 100).astype(np.int64)])
+    _, keep = np.unique(key, axis=0, return_index=True)
+    keep = np.sort(keep)
+    geom_offsets, geom_xy = _take_geometry(offsets, xy, keep)
+    return {
+        "node_ids": node_ids,
+        "node_x": node_x,
+        "node_y": node_y,
+        "edge_u": u[keep],
+        "edge_v": v[keep],
+        "edge_length": length[keep],
+        "geom_offsets": geom_offsets,
+        "geom_xy": geom_xy,
+    }
+
+
+def utm_crs(lat, lon):
+    zone = int((lon + 180) // 6) + 1
+    return CRS.from_epsg((32600 if lat >= 0 else 32700) + zone)